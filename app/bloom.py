@@ -0,0 +1,209 @@
+"""
+Filtro de Bloom dos telefones presentes em portabilidade_historico
+
+Uma resposta negativa garante que o número nunca foi portado, então a API
+pula a busca de portabilidade e vai direto para a faixa de numeração.
+
+Formato do arquivo (little-endian):
+    cabeçalho (32 bytes): magic 'BLOOM001', bits (uint64), hashes (uint32),
+                          reservado (uint32), elementos (uint64)
+    bits: bytearray com (bits + 7) // 8 bytes
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+BLOOM_PATH = os.getenv("BLOOM_PATH", "/app/data/portabilidade_bloom.bin")
+BLOOM_TAXA_FP = float(os.getenv("BLOOM_TAXA_FP", 0.01))  # Taxa de falso positivo desejada
+BLOOM_MAX_MB = float(os.getenv("BLOOM_MAX_MB", 128))  # Limite de memória do filtro
+
+MAGIC = b'BLOOM001'
+CABECALHO = struct.Struct('<8sQI4xQ')
+
+_MASCARA_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _misturar(x):
+    """splitmix64: espalha bem inteiros sequenciais como telefones"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASCARA_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASCARA_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASCARA_64
+    return x ^ (x >> 31)
+
+
+def dimensionar(elementos, taxa_fp=BLOOM_TAXA_FP, max_mb=BLOOM_MAX_MB):
+    """
+    Calcula (bits, hashes) para a quantidade de elementos
+
+    Se o tamanho ideal passar de max_mb, o filtro fica no limite e a taxa
+    de falso positivo real sobe (ver taxa_fp_estimada).
+    """
+    elementos = max(elementos, 1)
+    bits = math.ceil(-elementos * math.log(taxa_fp) / (math.log(2) ** 2))
+    bits = max(64, min(bits, int(max_mb * 1024 * 1024 * 8)))
+    hashes = max(1, round(bits / elementos * math.log(2)))
+    return bits, hashes
+
+
+class FiltroBloom:
+    """Filtro de Bloom para inteiros (double hashing sobre splitmix64)"""
+
+    def __init__(self, bits, hashes, dados=None, elementos=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.elementos = elementos
+        self.dados = dados if dados is not None else bytearray((bits + 7) // 8)
+
+        # Contadores para /stats
+        self.consultas = 0
+        self.negativos = 0
+
+    def _posicoes(self, valor):
+        h1 = _misturar(valor)
+        h2 = _misturar(h1) | 1
+        bits = self.bits
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % bits
+
+    def adicionar(self, valor):
+        dados = self.dados
+        for posicao in self._posicoes(valor):
+            dados[posicao >> 3] |= 1 << (posicao & 7)
+        self.elementos += 1
+
+    def contem(self, valor):
+        """False = com certeza ausente; True = provavelmente presente"""
+        self.consultas += 1
+        dados = self.dados
+        for posicao in self._posicoes(valor):
+            if not dados[posicao >> 3] & (1 << (posicao & 7)):
+                self.negativos += 1
+                return False
+        return True
+
+    def taxa_fp_estimada(self):
+        """Taxa de falso positivo teórica para os elementos inseridos"""
+        if self.elementos == 0:
+            return 0.0
+        return (1 - math.exp(-self.hashes * self.elementos / self.bits)) ** self.hashes
+
+    def estatisticas(self):
+        return {
+            "elementos": self.elementos,
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "tamanho_mb": round(len(self.dados) / 1024 / 1024, 2),
+            "taxa_fp_configurada": BLOOM_TAXA_FP,
+            "max_mb_configurado": BLOOM_MAX_MB,
+            "taxa_fp_estimada": round(self.taxa_fp_estimada(), 6),
+            "consultas": self.consultas,
+            "negativos": self.negativos
+        }
+
+    def salvar(self, caminho=BLOOM_PATH):
+        """Grava o filtro (arquivo temporário + os.replace)"""
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as f:
+            f.write(CABECALHO.pack(MAGIC, self.bits, self.hashes, self.elementos))
+            f.write(self.dados)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def abrir(cls, caminho=BLOOM_PATH):
+        """Abre o filtro via mmap somente leitura (compartilhado entre workers)"""
+        with open(caminho, 'rb') as f:
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, bits, hashes, elementos = CABECALHO.unpack_from(mapa, 0)
+        if magic != MAGIC or len(mapa) != CABECALHO.size + (bits + 7) // 8:
+            mapa.close()
+            raise ValueError(f"Filtro de Bloom inválido: {caminho}")
+
+        dados = memoryview(mapa)[CABECALHO.size:]
+        return cls(bits, hashes, dados, elementos)
+
+
+def gerar_filtro_bloom(conn, caminho=BLOOM_PATH, lote=100000):
+    """
+    Gera o filtro com todos os telefones de portabilidade_atual
+
+    portabilidade_atual tem exatamente os telefones distintos do histórico.
+    """
+    inicio = time.time()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM portabilidade_atual")
+    total = cursor.fetchone()[0]
+    cursor.close()
+
+    bits, hashes = dimensionar(total)
+    filtro = FiltroBloom(bits, hashes)
+    print(f"[BLOOM] Gerando filtro: {total:,} telefones, {bits / 8 / 1024 / 1024:,.1f} MB, "
+          f"{hashes} hashes", flush=True)
+
+    cursor = conn.cursor(name='bloom_portabilidade')
+    cursor.itersize = lote
+    cursor.execute("SELECT telefone FROM portabilidade_atual")
+
+    adicionar = filtro.adicionar
+    for (telefone,) in cursor:
+        adicionar(telefone)
+
+    cursor.close()
+    conn.commit()
+
+    filtro.salvar(caminho)
+    print(f"[BLOOM] ✓ Filtro gravado em {caminho} (falso positivo estimado "
+          f"{filtro.taxa_fp_estimada():.4%}) em {time.time() - inicio:.1f}s", flush=True)
+    return filtro
+
+
+# Filtro ativo do processo (None se o arquivo não existe)
+_filtro = None
+_lock_carga = threading.Lock()
+
+
+def obter_filtro():
+    """Retorna o filtro ativo (None se não carregado)"""
+    return _filtro
+
+
+def abrir_filtro(caminho=BLOOM_PATH):
+    """Abre o filtro do disco sem ativá-lo (None se o arquivo não existe)"""
+    if not os.path.exists(caminho):
+        print(f"[BLOOM] Arquivo não encontrado: {caminho}", flush=True)
+        return None
+    return FiltroBloom.abrir(caminho)
+
+
+def ativar_filtro(novo):
+    """Troca o filtro ativo (None desativa: nenhum número é descartado)"""
+    global _filtro
+
+    with _lock_carga:
+        _filtro = novo
+
+    if novo is not None:
+        print(f"[BLOOM] Carregado: {novo.elementos:,} telefones, "
+              f"falso positivo estimado {novo.taxa_fp_estimada():.4%}", flush=True)
+    return novo
+
+
+def carregar_filtro(caminho=BLOOM_PATH):
+    """
+    Abre o filtro do disco e troca o ativo
+
+    Sem arquivo, ou se ele não abre, o ativo é desligado: um filtro de outra
+    geração responderia "nunca portado" para números portados desde então.
+    """
+    try:
+        novo = abrir_filtro(caminho)
+    except Exception:
+        ativar_filtro(None)
+        raise
+    return ativar_filtro(novo)
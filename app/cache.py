@@ -0,0 +1,145 @@
+"""
+Cache de resultados de /consulta com admissão TinyLFU
+
+Os itens ficam em uma LRU limitada. Quando ela está cheia, um número novo só
+entra se for mais frequente que a vítima da LRU, segundo um count-min sketch
+com envelhecimento. Assim, varreduras de números únicos (lotes de CRM) não
+expulsam os números quentes (call centers).
+
+A cada importação concluída o cache é invalidado e a geração incrementada.
+"""
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+CACHE_CONSULTA_TAMANHO = int(os.getenv("CACHE_CONSULTA_TAMANHO", 100000))  # 0 desativa
+
+# Multiplicadores ímpares para derivar um índice por linha do sketch
+_SEMENTES = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+_MASCARA_64 = 0xFFFFFFFFFFFFFFFF
+
+# Tabela de tradução byte -> byte >> 1: envelhece uma linha inteira em C
+_METADE = bytes(valor >> 1 for valor in range(256))
+
+
+class SketchFrequencia:
+    """Count-min sketch de 4 linhas com contadores de 8 bits e envelhecimento"""
+
+    def __init__(self, capacidade):
+        largura = 1
+        while largura < max(capacidade, 16):
+            largura <<= 1
+
+        self.mascara = largura - 1
+        self.linhas = [array('B', bytes(largura)) for _ in _SEMENTES]
+        # Após amostra incrementos, todos os contadores são divididos por 2
+        self.amostra = 10 * max(capacidade, 16)
+        self.incrementos = 0
+
+    def _indices(self, chave):
+        h = hash(chave) & _MASCARA_64
+        for semente in _SEMENTES:
+            yield ((h * semente) & _MASCARA_64) >> 32 & self.mascara
+
+    def incrementar(self, chave):
+        for linha, i in zip(self.linhas, self._indices(chave)):
+            if linha[i] < 255:
+                linha[i] += 1
+
+        self.incrementos += 1
+        if self.incrementos >= self.amostra:
+            self._envelhecer()
+
+    def frequencia(self, chave):
+        return min(linha[i] for linha, i in zip(self.linhas, self._indices(chave)))
+
+    def _envelhecer(self):
+        # bytes.translate divide todos os contadores sem laço em Python
+        self.linhas = [array('B', linha.tobytes().translate(_METADE)) for linha in self.linhas]
+        self.incrementos //= 2
+
+
+class CacheTinyLFU:
+    """Cache LRU limitado com admissão por frequência (TinyLFU)"""
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self._itens = OrderedDict()
+        self._sketch = SketchFrequencia(capacidade)
+        self._lock = threading.Lock()
+
+        self.geracao = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejeicoes = 0
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou None (e registra o acesso)"""
+        if self.capacidade <= 0:
+            return None
+
+        with self._lock:
+            self._sketch.incrementar(chave)
+
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.misses += 1
+                return None
+
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def guardar(self, chave, valor, geracao=None):
+        """
+        Guarda o valor se a política de admissão permitir
+
+        geracao é a geração lida antes de calcular o valor: se o cache foi
+        invalidado nesse meio tempo, o valor (antigo) é descartado.
+        """
+        if self.capacidade <= 0:
+            return
+
+        with self._lock:
+            if geracao is not None and geracao != self.geracao:
+                return
+
+            if chave in self._itens:
+                self._itens[chave] = valor
+                self._itens.move_to_end(chave)
+                return
+
+            if len(self._itens) >= self.capacidade:
+                vitima = next(iter(self._itens))
+                if self._sketch.frequencia(chave) <= self._sketch.frequencia(vitima):
+                    self.rejeicoes += 1
+                    return
+                del self._itens[vitima]
+                self.evictions += 1
+
+            self._itens[chave] = valor
+
+    def invalidar(self):
+        """Descarta todos os itens (nova base importada)"""
+        with self._lock:
+            self._itens.clear()
+            self.geracao += 1
+
+    def estatisticas(self):
+        consultas = self.hits + self.misses
+        return {
+            "capacidade": self.capacidade,
+            "itens": len(self._itens),
+            "geracao": self.geracao,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / consultas, 4) if consultas else 0.0,
+            "evictions": self.evictions,
+            "rejeicoes": self.rejeicoes
+        }
+
+
+# Cache de /consulta (chave: telefone normalizado)
+cache_consultas = CacheTinyLFU(CACHE_CONSULTA_TAMANHO)
@@ -0,0 +1,234 @@
+"""
+Codificador do formato binário do COPY para portabilidade_historico
+
+As linhas do CSV de origem (19 campos separados por ';') são convertidas
+no cliente e gravadas no formato binário do PostgreSQL direto na tabela
+final, sem tabela de staging em texto nem INSERT ... SELECT com regex e
+casts no servidor.
+
+Formato (https://www.postgresql.org/docs/current/sql-copy.html):
+    cabeçalho: 'PGCOPY\\n\\377\\r\\n\\0', flags (int32), extensão (int32)
+    linha:     quantidade de campos (int16) e, por campo, tamanho (int32,
+               -1 = NULL) seguido dos bytes; bigint = int64, timestamp =
+               microssegundos desde 2000-01-01 (int64), texto = UTF-8
+    trailer:   int16 -1
+
+As conversões seguem as regras do antigo INSERT ... SELECT: campo vazio é
+NULL, textos cortados no tamanho da coluna, telefone só com dígitos (até 15)
+e datas '0000-00-00 00:00:00' nulas.
+"""
+import csv
+import io
+import re
+import struct
+from datetime import date, datetime
+from functools import lru_cache
+
+from app.historico import converter_data
+
+# Colunas gravadas, na ordem do COPY: (nome, tipo, tamanho do varchar)
+COLUNAS = (
+    ('spid_origem', 'varchar', 10),
+    ('flag_1', 'bigint', None),
+    ('data_criacao', 'varchar', 50),
+    ('telefone', 'bigint', None),
+    ('codigo_1', 'bigint', None),
+    ('spid_destino', 'varchar', 10),
+    ('codigo_operadora', 'varchar', 10),
+    ('codigo_completo', 'varchar', 10),
+    ('flag_2', 'bigint', None),
+    ('flag_3', 'bigint', None),
+    ('status', 'varchar', 20),
+    ('flag_4', 'bigint', None),
+    ('data_atualizacao', 'varchar', 50),
+    ('flag_5', 'bigint', None),
+    ('data_nula_1', 'varchar', 50),
+    ('flag_6', 'bigint', None),
+    ('flag_7', 'bigint', None),
+    ('flag_8', 'bigint', None),
+    ('data_nula_2', 'varchar', 50),
+    ('data_criacao_ts', 'timestamp', None),
+    ('data_atualizacao_ts', 'timestamp', None),
+)
+
+CAMPOS_ORIGEM = 19
+
+
+def sql_copy(tabela='portabilidade_historico'):
+    """COPY binário das COLUNAS para a tabela"""
+    return (
+        f"COPY {tabela} ("
+        + ", ".join(nome for nome, _, _ in COLUNAS)
+        + ") FROM STDIN WITH (FORMAT binary)"
+    )
+
+
+SQL_COPY = sql_copy()
+
+CABECALHO = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+TRAILER = struct.pack('!h', -1)
+
+_NULO = struct.pack('!i', -1)
+_LINHA = struct.pack('!h', len(COLUNAS))
+_INT8 = struct.Struct('!iq').pack
+_TAMANHO = struct.Struct('!i').pack
+_EPOCA_PG = datetime(2000, 1, 1)
+_DATA_ZERADA = '0000-00-00 00:00:00'
+
+# Mesmo padrão de sql_texto_para_timestamp (ano 0000 não existe em date)
+_FORMATO_DATA = re.compile(r'[0-9]{4}-[01][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]')
+
+# Campo de origem de cada coluna não-timestamp e sua conversão: None =
+# bigint, 0 = telefone, n = varchar(n), -n = varchar(n) com data zerada nula
+_LAYOUT = (
+    (0, 10), (1, None), (2, 50), (3, 0), (4, None), (5, 10), (6, 10), (7, 10),
+    (8, None), (9, None), (10, 20), (11, None), (12, 50), (13, None), (14, -50),
+    (15, None), (16, None), (17, None), (18, -50),
+)
+
+
+def _inteiro(valor):
+    # NULLIF(campo, '')::BIGINT: texto inválido é erro (o lote cai no INSERT)
+    return int(valor) if valor else None
+
+
+def _texto(valor, tamanho):
+    return valor[:tamanho] if valor else None
+
+
+def converter_linha(campos):
+    """
+    Converte os 19 campos de uma linha do CSV para os valores das COLUNAS
+
+    Levanta ValueError se a linha não tem 19 campos ou um inteiro é inválido.
+    """
+    if len(campos) != CAMPOS_ORIGEM:
+        raise ValueError(f"Linha com {len(campos)} campos (esperado {CAMPOS_ORIGEM})")
+
+    telefone = campos[3]
+    return (
+        _texto(campos[0], 10),
+        _inteiro(campos[1]),
+        _texto(campos[2], 50),
+        int(telefone) if telefone.isdigit() and len(telefone) <= 15 else None,
+        _inteiro(campos[4]),
+        _texto(campos[5], 10),
+        _texto(campos[6], 10),
+        _texto(campos[7], 10),
+        _inteiro(campos[8]),
+        _inteiro(campos[9]),
+        _texto(campos[10], 20),
+        _inteiro(campos[11]),
+        _texto(campos[12], 50),
+        _inteiro(campos[13]),
+        None if campos[14] == _DATA_ZERADA else _texto(campos[14], 50),
+        _inteiro(campos[15]),
+        _inteiro(campos[16]),
+        _inteiro(campos[17]),
+        None if campos[18] == _DATA_ZERADA else _texto(campos[18], 50),
+        converter_data(campos[2]) if campos[2] else None,
+        converter_data(campos[12]) if campos[12] else None,
+    )
+
+
+@lru_cache(maxsize=65536)
+def _dias_desde_2000(data):
+    """Dias entre 2000-01-01 e 'YYYY-MM-DD' (None se a data não existe)"""
+    try:
+        return (date(int(data[:4]), int(data[5:7]), int(data[8:10])) - _EPOCA_PG.date()).days
+    except ValueError:
+        return None
+
+
+def _timestamp(valor):
+    """
+    Campo binário de timestamp a partir do texto 'YYYY-MM-DD HH:MM:SS'
+
+    Mesmo resultado de converter_data, sem strptime: a parte da data é
+    convertida uma vez por dia distinto (cache) e a hora somada em segundos.
+    """
+    if not valor or not _FORMATO_DATA.match(valor):
+        return _NULO
+    dias = _dias_desde_2000(valor[:10])
+    horas = int(valor[11:13])
+    if dias is None or horas > 23:
+        return _NULO
+    segundos = horas * 3600 + int(valor[14:16]) * 60 + int(valor[17:19])
+    return _INT8(8, (dias * 86400 + segundos) * 1000000)
+
+
+def _codificar_campos(campos, partes):
+    """Converte e codifica os 19 campos de uma linha (mesmas regras de converter_linha)"""
+    if len(campos) != CAMPOS_ORIGEM:
+        raise ValueError(f"Linha com {len(campos)} campos (esperado {CAMPOS_ORIGEM})")
+
+    append = partes.append
+    append(_LINHA)
+    for indice, tamanho in _LAYOUT:
+        valor = campos[indice]
+        if tamanho is None:
+            # NULLIF(campo, '')::BIGINT
+            append(_INT8(8, int(valor)) if valor else _NULO)
+        elif tamanho == 0:
+            # Telefone: só dígitos, até 15
+            append(_INT8(8, int(valor)) if valor.isdigit() and len(valor) <= 15 else _NULO)
+        elif not valor or (tamanho < 0 and valor == _DATA_ZERADA):
+            append(_NULO)
+        else:
+            dados = valor[:abs(tamanho)].encode('utf-8')
+            append(_TAMANHO(len(dados)))
+            append(dados)
+    append(_timestamp(campos[2]))
+    append(_timestamp(campos[12]))
+
+
+def codificar_linhas(texto):
+    """
+    Codifica linhas CSV completas (str) no formato binário, sem cabeçalho
+
+    Retorna (bytes, quantidade_de_linhas).
+    """
+    partes = []
+    quantidade = 0
+    for campos in csv.reader(io.StringIO(texto), delimiter=';'):
+        if not campos:
+            continue
+        _codificar_campos(campos, partes)
+        quantidade += 1
+    return b''.join(partes), quantidade
+
+
+class LeitorCopyBinario:
+    """
+    Arquivo (read) para COPY ... FROM STDIN WITH (FORMAT binary)
+
+    origem.read(size) deve devolver bytes com linhas inteiras do CSV (ex:
+    BatchReader do importador); b'' indica o fim. O cabeçalho e o trailer do
+    formato binário são acrescentados aqui.
+    """
+
+    def __init__(self, origem):
+        self.origem = origem
+        self.linhas = 0
+        self._cabecalho = True
+        self._fim = False
+
+    def read(self, size=-1):
+        if self._fim:
+            return b''
+
+        # b'' encerra o COPY: só devolve vazio depois do trailer
+        corpo = b''
+        while not corpo:
+            dados = self.origem.read(size)
+            if not dados:
+                corpo = TRAILER
+                self._fim = True
+                break
+            corpo, quantidade = codificar_linhas(dados.decode('utf-8'))
+            self.linhas += quantidade
+
+        if self._cabecalho:
+            self._cabecalho = False
+            return CABECALHO + corpo
+        return corpo
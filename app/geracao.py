@@ -0,0 +1,42 @@
+"""
+Geração dos dados de consulta compartilhada entre processos
+
+Quem publica um novo índice de faixas, snapshot ou filtro de Bloom
+incrementa a geração gravada em GERACAO_PATH. Cada worker do uvicorn compara
+a geração do arquivo com a que tem carregada e, se mudou, mapeia os arquivos
+novos e invalida o próprio cache.
+"""
+import fcntl
+import os
+
+GERACAO_PATH = os.getenv("GERACAO_PATH", "/app/data/geracao")
+GERACAO_INTERVALO = float(os.getenv("GERACAO_INTERVALO", 2))  # segundos entre verificações
+
+
+def ler_geracao(caminho=GERACAO_PATH):
+    """Geração publicada (0 se nunca publicada)"""
+    try:
+        with open(caminho, 'r') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def publicar_geracao(caminho=GERACAO_PATH):
+    """Incrementa a geração publicada e retorna o novo valor"""
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+
+    # Lock entre processos: importadores e workers podem publicar juntos
+    with open(caminho + '.lock', 'w') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        geracao = ler_geracao(caminho) + 1
+
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w') as f:
+            f.write(str(geracao))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+
+    print(f"[GERACAO] Publicada geração {geracao}", flush=True)
+    return geracao
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Estruturas derivadas de portabilidade_historico
+
+As funções recebem uma conexão DB-API (psycopg2), então podem ser usadas
+tanto pelos importadores quanto pela API.
+
+Uso manual: python -m app.historico
+"""
+import time
+from datetime import datetime
+
+# Converte o texto 'YYYY-MM-DD HH:MM:SS' para timestamp; datas zeradas
+# ('0000-00-00 00:00:00') e textos fora do formato viram NULL
+def sql_texto_para_timestamp(coluna):
+    return (
+        f"CASE WHEN {coluna} ~ '^[0-9]{{4}}-[01][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]' "
+        f"AND left({coluna}, 4) <> '0000' THEN {coluna}::timestamp END"
+    )
+
+
+def sql_inserir_staging(tabela, staging):
+    """
+    INSERT ... SELECT que converte a staging em texto (19 campos TEXT, COPY
+    do CSV) para as colunas de portabilidade_historico
+    """
+    return f"""
+        INSERT INTO {tabela} (
+            spid_origem, flag_1, data_criacao, telefone, codigo_1,
+            spid_destino, codigo_operadora, codigo_completo,
+            flag_2, flag_3, status, flag_4, data_atualizacao,
+            flag_5, data_nula_1, flag_6, flag_7, flag_8, data_nula_2,
+            data_criacao_ts, data_atualizacao_ts
+        )
+        SELECT
+            campo1::VARCHAR(10),
+            NULLIF(campo2, '')::BIGINT,
+            campo3::VARCHAR(50),
+            CASE
+                WHEN campo4 ~ '^[0-9]+$' AND LENGTH(campo4) <= 15
+                THEN campo4::BIGINT
+                ELSE NULL
+            END,
+            NULLIF(campo5, '')::BIGINT,
+            campo6::VARCHAR(10),
+            campo7::VARCHAR(10),
+            campo8::VARCHAR(10),
+            NULLIF(campo9, '')::BIGINT,
+            NULLIF(campo10, '')::BIGINT,
+            campo11::VARCHAR(20),
+            NULLIF(campo12, '')::BIGINT,
+            campo13::VARCHAR(50),
+            NULLIF(campo14, '')::BIGINT,
+            CASE WHEN campo15 = '0000-00-00 00:00:00' THEN NULL ELSE campo15::VARCHAR(50) END,
+            NULLIF(campo16, '')::BIGINT,
+            NULLIF(campo17, '')::BIGINT,
+            NULLIF(campo18, '')::BIGINT,
+            CASE WHEN campo19 = '0000-00-00 00:00:00' THEN NULL ELSE campo19::VARCHAR(50) END,
+            {sql_texto_para_timestamp('campo3')},
+            {sql_texto_para_timestamp('campo13')}
+        FROM {staging}
+    """
+
+
+def converter_data(texto):
+    """Mesmo que sql_texto_para_timestamp, em Python (importação linha a linha)"""
+    try:
+        return datetime.strptime(texto[:19], '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def reconstruir_portabilidade_atual(conn):
+    """
+    Recria portabilidade_atual com o último evento de cada telefone
+
+    A tabela nova é montada ao lado e trocada por RENAME, então as consultas
+    continuam vendo a versão anterior até o fim.
+    Retorna a quantidade de telefones portados.
+    """
+    inicio = time.time()
+    cursor = conn.cursor()
+
+    print("[HISTORICO] Reconstruindo portabilidade_atual...", flush=True)
+
+    cursor.execute("DROP TABLE IF EXISTS portabilidade_atual_nova")
+    cursor.execute("""
+        CREATE TABLE portabilidade_atual_nova (
+            telefone BIGINT PRIMARY KEY,
+            spid_destino VARCHAR(10),
+            codigo_completo VARCHAR(10),
+            data_atualizacao VARCHAR(50)
+        )
+    """)
+
+    # data_atualizacao está no formato 'YYYY-MM-DD HH:MM:SS', então a
+    # ordenação textual coincide com a cronológica
+    cursor.execute("""
+        INSERT INTO portabilidade_atual_nova (telefone, spid_destino, codigo_completo, data_atualizacao)
+        SELECT DISTINCT ON (telefone)
+            telefone, spid_destino, codigo_completo, data_atualizacao
+        FROM portabilidade_historico
+        WHERE telefone IS NOT NULL
+        ORDER BY telefone, data_atualizacao DESC NULLS LAST, id DESC
+    """)
+    total = cursor.rowcount
+    conn.commit()
+
+    cursor.execute("ANALYZE portabilidade_atual_nova")
+    cursor.execute("DROP TABLE IF EXISTS portabilidade_atual")
+    cursor.execute("ALTER TABLE portabilidade_atual_nova RENAME TO portabilidade_atual")
+    cursor.execute("ALTER INDEX portabilidade_atual_nova_pkey RENAME TO portabilidade_atual_pkey")
+    conn.commit()
+    cursor.close()
+
+    print(f"[HISTORICO] ✓ portabilidade_atual: {total:,} telefones "
+          f"em {time.time() - inicio:.1f}s", flush=True)
+    return total
+
+
+def criar_controle(cursor, controle="public.rollup_controle"):
+    """Tabela de marcas (último id processado) das estruturas incrementais"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {controle} (
+            tabela VARCHAR(50) PRIMARY KEY,
+            ultimo_id BIGINT NOT NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def ler_marca(cursor, tabela, controle="public.rollup_controle"):
+    """Último id já processado para `tabela` (0 se nunca rodou)"""
+    cursor.execute(f"SELECT ultimo_id FROM {controle} WHERE tabela = %s", (tabela,))
+    linha = cursor.fetchone()
+    return linha[0] if linha else 0
+
+
+def gravar_marca(cursor, tabela, ultimo_id, controle="public.rollup_controle"):
+    """Grava a marca de `tabela` (commit fica com quem chama, junto com o lote)"""
+    cursor.execute(f"""
+        INSERT INTO {controle} (tabela, ultimo_id, atualizado_em)
+        VALUES (%s, %s, now())
+        ON CONFLICT (tabela) DO UPDATE
+        SET ultimo_id = EXCLUDED.ultimo_id, atualizado_em = EXCLUDED.atualizado_em
+    """, (tabela, ultimo_id))
+
+
+def preparar_datas_historico(conn, lote=1000000):
+    """
+    Preenche data_criacao_ts/data_atualizacao_ts e cria o índice
+    (telefone, data_atualizacao_ts) usado por GET /historico/{telefone}
+
+    Só converte linhas ainda sem data tipada (bases importadas antes das
+    colunas existirem). O UPDATE é feito em faixas de id com commit por lote,
+    junto com a marca 'datas_historico' em rollup_controle: ids já
+    percorridos (inclusive os de data inválida, que ficam NULL) não são
+    revisitados nas próximas execuções. Se portabilidade_historico foi
+    recarregada (MAX(id) abaixo da marca), a marca volta a zero.
+    """
+    inicio = time.time()
+    cursor = conn.cursor()
+
+    cursor.execute("ALTER TABLE portabilidade_historico ADD COLUMN IF NOT EXISTS data_criacao_ts TIMESTAMP")
+    cursor.execute("ALTER TABLE portabilidade_historico ADD COLUMN IF NOT EXISTS data_atualizacao_ts TIMESTAMP")
+    criar_controle(cursor)
+    conn.commit()
+
+    ultimo_id = ler_marca(cursor, 'datas_historico')
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM portabilidade_historico")
+    maior = cursor.fetchone()[0]
+
+    if maior < ultimo_id:
+        print("[HISTORICO] Histórico recarregado: convertendo datas do zero", flush=True)
+        ultimo_id = 0
+
+    convertidas = 0
+    if maior > ultimo_id:
+        print(f"[HISTORICO] Convertendo datas (ids {ultimo_id + 1:,} a {maior:,})...", flush=True)
+
+        update = f"""
+            UPDATE portabilidade_historico
+            SET data_criacao_ts = {{criacao}},
+                data_atualizacao_ts = {{atualizacao}}
+            WHERE id > %s AND id <= %s
+              AND data_atualizacao_ts IS NULL
+              AND data_criacao_ts IS NULL
+              AND (data_atualizacao IS NOT NULL OR data_criacao IS NOT NULL)
+        """
+        rapido = update.format(
+            criacao=sql_texto_para_timestamp('data_criacao'),
+            atualizacao=sql_texto_para_timestamp('data_atualizacao')
+        )
+        # Datas no formato mas inválidas (ex: 30/02) derrubam o cast: o lote
+        # é refeito convertendo linha a linha com tratamento de erro
+        seguro = update.format(
+            criacao='texto_para_timestamp(data_criacao)',
+            atualizacao='texto_para_timestamp(data_atualizacao)'
+        )
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION texto_para_timestamp(valor TEXT) RETURNS TIMESTAMP
+            LANGUAGE plpgsql IMMUTABLE AS $$
+            BEGIN
+                RETURN CASE WHEN left(valor, 4) <> '0000' THEN valor::timestamp END;
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END
+            $$
+        """)
+        conn.commit()
+
+        for id_inicio in range(ultimo_id, maior, lote):
+            id_fim = min(id_inicio + lote, maior)
+            try:
+                cursor.execute(rapido, (id_inicio, id_fim))
+            except Exception:
+                conn.rollback()
+                cursor.execute(seguro, (id_inicio, id_fim))
+            convertidas += cursor.rowcount
+            gravar_marca(cursor, 'datas_historico', id_fim)
+            conn.commit()
+
+            print(f"[HISTORICO]   {convertidas:,} linhas convertidas "
+                  f"(até id {id_fim:,})", flush=True)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_historico_telefone_data
+        ON portabilidade_historico (telefone, data_atualizacao_ts)
+    """)
+    cursor.execute("ANALYZE portabilidade_historico")
+    conn.commit()
+    cursor.close()
+
+    print(f"[HISTORICO] ✓ Datas tipadas e índice (telefone, data_atualizacao_ts): "
+          f"{convertidas:,} linhas convertidas em {time.time() - inicio:.1f}s", flush=True)
+    return convertidas
+
+
+def atualizar_rollups(conn, lote=5000000, esquema="public"):
+    """
+    Atualiza portabilidade_rollup (mês × spid_origem × spid_destino × DDD)
+
+    Incremental: só agrega os eventos com id acima da marca gravada em
+    rollup_controle, somando às contagens existentes (ON CONFLICT). Cada
+    faixa de ids é agregada e commitada junto com a nova marca, então uma
+    execução interrompida continua de onde parou. Se portabilidade_historico
+    foi recarregada (MAX(id) abaixo da marca), o rollup é refeito do zero.
+
+    Com esquema, as três tabelas são as desse esquema (ex: a tabela sombra
+    de uma recarga, cujo rollup é montado antes da troca).
+
+    O mês vem de data_atualizacao_ts (ou data_criacao_ts); eventos sem data
+    válida ficam fora. Deve rodar com a importação concluída: linhas ainda
+    não commitadas com id abaixo da marca não seriam contadas.
+    Retorna quantos ids novos foram percorridos.
+    """
+    inicio = time.time()
+    cursor = conn.cursor()
+    rollup = f"{esquema}.portabilidade_rollup"
+    controle = f"{esquema}.rollup_controle"
+    historico = f"{esquema}.portabilidade_historico"
+
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {rollup} (
+            mes DATE NOT NULL,
+            spid_origem VARCHAR(10) NOT NULL,
+            spid_destino VARCHAR(10) NOT NULL,
+            ddd VARCHAR(2) NOT NULL,
+            quantidade BIGINT NOT NULL,
+            PRIMARY KEY (mes, spid_origem, spid_destino, ddd)
+        )
+    """)
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_rollup_destino_mes
+        ON {rollup} (spid_destino, mes)
+    """)
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_rollup_origem_mes
+        ON {rollup} (spid_origem, mes)
+    """)
+    criar_controle(cursor, controle)
+    conn.commit()
+
+    ultimo_id = ler_marca(cursor, 'portabilidade_rollup', controle)
+
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {historico}")
+    maior = cursor.fetchone()[0]
+
+    if maior < ultimo_id:
+        print("[ROLLUP] Histórico recarregado: refazendo rollup do zero", flush=True)
+        cursor.execute(f"TRUNCATE {rollup}")
+        ultimo_id = 0
+
+    agregados = 0
+    if maior > ultimo_id:
+        print(f"[ROLLUP] Agregando eventos (ids {ultimo_id + 1:,} a {maior:,})...", flush=True)
+
+    for id_inicio in range(ultimo_id, maior, lote):
+        id_fim = min(id_inicio + lote, maior)
+        cursor.execute(f"""
+            INSERT INTO {rollup} AS r (mes, spid_origem, spid_destino, ddd, quantidade)
+            SELECT
+                date_trunc('month', COALESCE(data_atualizacao_ts, data_criacao_ts))::date,
+                COALESCE(spid_origem, ''),
+                COALESCE(spid_destino, ''),
+                COALESCE(left(telefone::text, 2), ''),
+                COUNT(*)
+            FROM {historico}
+            WHERE id > %s AND id <= %s
+              AND COALESCE(data_atualizacao_ts, data_criacao_ts) IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (mes, spid_origem, spid_destino, ddd)
+            DO UPDATE SET quantidade = r.quantidade + EXCLUDED.quantidade
+        """, (id_inicio, id_fim))
+        gravar_marca(cursor, 'portabilidade_rollup', id_fim, controle)
+        conn.commit()
+
+        agregados += id_fim - id_inicio
+        print(f"[ROLLUP]   até id {id_fim:,}", flush=True)
+
+    if agregados:
+        cursor.execute(f"ANALYZE {rollup}")
+        conn.commit()
+    cursor.close()
+
+    print(f"[ROLLUP] ✓ {rollup} atualizado: ids até {maior:,} "
+          f"em {time.time() - inicio:.1f}s", flush=True)
+    return agregados
+
+
+if __name__ == "__main__":
+    from app.database import engine
+    from app.snapshot import gerar_snapshot
+    from app.bloom import gerar_filtro_bloom
+    from app.geracao import publicar_geracao
+
+    conn = engine.raw_connection()
+    try:
+        preparar_datas_historico(conn)
+        atualizar_rollups(conn)
+        reconstruir_portabilidade_atual(conn)
+        gerar_snapshot(conn)
+        gerar_filtro_bloom(conn)
+    finally:
+        conn.close()
+
+    publicar_geracao()
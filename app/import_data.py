@@ -1,11 +1,16 @@
 import os
 import sys
+import json
 import requests
 import gzip
 import tempfile
+import time
 from sqlalchemy import text
+from sqlalchemy.schema import CreateTable, CreateIndex
 from app.database import engine, SessionLocal
-from app.models import Base, FaixaOperadora, OperadoraRN1, OperadoraSTFC
+from app.models import Base, FaixaOperadora, OperadoraRN1, OperadoraSTFC, FAIXA_COLUNAS_COBERTAS
+from app.lookup import publicar_indice, SQL_FAIXA, FATOR_NUMERO, numero_nacional
+from app.operadoras import gerar_dimensao
 
 # URLs dos arquivos (GitHub raw)
 # Arquivos pré-convertidos de MySQL para PostgreSQL
@@ -16,9 +21,54 @@ FILES = {
     "faixa_operadora": "faixa_operadora.sql"
 }
 
+# faixa_numero = [ddd+prefixo+faixa_inicio, ddd+prefixo+faixa_fim] (lookup.numero_nacional)
+SQL_PREENCHER_FAIXA_NUMERO = text("""
+    UPDATE faixa_operadora
+    SET faixa_numero = int8range(
+        CAST(ddd || prefixo AS bigint) * :fator + faixa_inicio,
+        CAST(ddd || prefixo AS bigint) * :fator + faixa_fim,
+        '[]'
+    )
+    WHERE ddd ~ '^[0-9]{2}$'
+      AND prefixo ~ '^[0-9]{4}$'
+      AND faixa_inicio IS NOT NULL
+      AND faixa_fim IS NOT NULL
+      AND faixa_inicio <= faixa_fim
+""")
+
+# Recarga sem indisponibilidade: os dados novos são carregados em tabelas
+# sombra no esquema ESQUEMA_CARGA (UNLOGGED durante a carga), indexadas e
+# validadas lá, e trocadas pelas tabelas de public em uma transação curta.
+# Até a troca a API continua lendo a base anterior.
+ESQUEMA_CARGA = "carga"
+ESQUEMA_ANTIGO = "carga_antiga"
+TABELAS_DATASET = (OperadoraRN1.__table__, OperadoraSTFC.__table__, FaixaOperadora.__table__)
+# A troca espera pouco pelos locks (leituras novas da API ficam na fila atrás
+# dela) e tenta de novo até TROCA_TENTATIVAS vezes
+TROCA_LOCK_TIMEOUT = os.getenv("IMPORT_SWAP_LOCK_TIMEOUT", "2s")
+TROCA_TENTATIVAS = int(os.getenv("IMPORT_SWAP_RETRIES", 5))
+LOCK_NAO_OBTIDO = "55P03"  # lock_not_available
+
+# Colunas em INCLUDE do GiST de faixa_numero
+COLUNAS_COBERTAS = ", ".join(FAIXA_COLUNAS_COBERTAS)
+
+# Consulta anterior: varredura no índice composto (ddd, prefixo, faixa_inicio, faixa_fim)
+SQL_FAIXA_COMPOSTO = text("""
+    SELECT nome_operadora, sigla_operadora, estado, tipo_numero
+    FROM faixa_operadora
+    WHERE ddd = :ddd
+      AND prefixo = :prefixo
+      AND faixa_inicio <= :numero
+      AND faixa_fim >= :numero
+    LIMIT 1
+""")
+
 class ImportadorPortabilidade:
     def __init__(self):
-        self.session = SessionLocal()
+        # Conexão própria: o search_path da carga vale para toda a sessão
+        self.conexao = engine.connect()
+        self.session = SessionLocal(bind=self.conexao)
+        self.esquema = "public"
         self.temp_dir = tempfile.mkdtemp()
 
     def log(self, message):
@@ -61,18 +111,95 @@ class ImportadorPortabilidade:
         Base.metadata.create_all(bind=engine)
         self.log("✓ Tabelas criadas")
 
-    def limpar_tabelas(self):
-        """Limpar dados existentes"""
-        self.log("Limpando tabelas existentes...")
-        try:
-            self.session.execute(text("TRUNCATE TABLE faixa_operadora RESTART IDENTITY CASCADE"))
-            self.session.execute(text("TRUNCATE TABLE operadoras_rn1 RESTART IDENTITY CASCADE"))
-            self.session.execute(text("TRUNCATE TABLE operadoras_stfc RESTART IDENTITY CASCADE"))
+    def usar_esquema(self, esquema):
+        """Aponta as consultas sem esquema (SQL dos arquivos, ORM) para `esquema`"""
+        if esquema == "public":
+            self.session.execute(text("RESET search_path"))
+        else:
+            self.session.execute(text(f"SET search_path TO {esquema}, public"))
+        self.session.commit()
+        self.esquema = esquema
+
+    def preparar_tabelas_sombra(self):
+        """
+        Cria as tabelas sombra vazias em ESQUEMA_CARGA (UNLOGGED, sem índices)
+
+        Uma carga anterior interrompida é descartada. Os índices do modelo são
+        criados depois da carga, em indexar_tabelas_sombra.
+        """
+        self.log(f"Preparando tabelas sombra no esquema {ESQUEMA_CARGA}...")
+        self.session.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_CARGA} CASCADE"))
+        self.session.execute(text(f"CREATE SCHEMA {ESQUEMA_CARGA}"))
+        self.session.commit()
+
+        # DDL sem esquema: com o search_path da carga, tabelas, sequences e
+        # índices são criados em ESQUEMA_CARGA com os mesmos nomes de public
+        self.usar_esquema(ESQUEMA_CARGA)
+        for tabela in TABELAS_DATASET:
+            self.session.execute(CreateTable(tabela))
+            self.session.execute(text(f"ALTER TABLE {tabela.name} SET UNLOGGED"))
+        self.session.commit()
+        self.log("✓ Tabelas sombra criadas (UNLOGGED)")
+
+    def indexar_tabelas_sombra(self):
+        """Torna as tabelas sombra LOGGED e cria os índices do modelo"""
+        self.log("\n=== INDEXANDO TABELAS SOMBRA ===")
+
+        # SET LOGGED reescreve a tabela; os índices vêm depois para não
+        # serem reconstruídos junto
+        for tabela in TABELAS_DATASET:
+            self.session.execute(text(f"ALTER TABLE {ESQUEMA_CARGA}.{tabela.name} SET LOGGED"))
             self.session.commit()
-            self.log("✓ Tabelas limpas")
-        except Exception as e:
-            self.log(f"Aviso: {str(e)}")
-            self.session.rollback()
+            self.log(f"✓ {tabela.name}: LOGGED")
+
+        for tabela in TABELAS_DATASET:
+            for indice in tabela.indexes:
+                # idx_faixa_numero é criado por preparar_faixa_numero
+                if indice.name == 'idx_faixa_numero':
+                    continue
+                self.session.execute(CreateIndex(indice))
+                self.session.commit()
+            self.log(f"✓ {tabela.name}: índices criados")
+
+    def trocar_tabelas(self):
+        """
+        Troca as tabelas de public pelas sombra em uma única transação
+
+        ALTER TABLE ... SET SCHEMA leva junto índices, constraints e sequences
+        de cada tabela. As consultas da API esperam só pelos locks da troca,
+        limitados a TROCA_LOCK_TIMEOUT por tentativa.
+        """
+        self.log("\n=== TROCA DAS TABELAS ===")
+        self.usar_esquema("public")
+
+        for tentativa in range(1, TROCA_TENTATIVAS + 1):
+            try:
+                self.session.execute(text("SET LOCAL lock_timeout = :espera"), {"espera": TROCA_LOCK_TIMEOUT})
+                self.session.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_ANTIGO} CASCADE"))
+                self.session.execute(text(f"CREATE SCHEMA {ESQUEMA_ANTIGO}"))
+                for tabela in TABELAS_DATASET:
+                    self.session.execute(text(f"ALTER TABLE IF EXISTS public.{tabela.name} SET SCHEMA {ESQUEMA_ANTIGO}"))
+                    self.session.execute(text(f"ALTER TABLE {ESQUEMA_CARGA}.{tabela.name} SET SCHEMA public"))
+                self.session.commit()
+                break
+            except Exception as e:
+                self.session.rollback()
+                if getattr(getattr(e, "orig", None), "pgcode", None) != LOCK_NAO_OBTIDO:
+                    self.log(f"✗ ERRO na troca das tabelas (base atual mantida): {str(e)}")
+                    return False
+                self.log(f"⚠ Tentativa {tentativa}/{TROCA_TENTATIVAS}: locks não obtidos em {TROCA_LOCK_TIMEOUT}")
+                time.sleep(tentativa)
+        else:
+            self.log("✗ Troca não concluída: base atual mantida")
+            return False
+
+        self.log("✓ Tabelas novas em uso")
+
+        self.session.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_ANTIGO} CASCADE"))
+        self.session.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_CARGA} CASCADE"))
+        self.session.commit()
+        self.log("✓ Tabelas anteriores removidas")
+        return True
 
     def importar_sql_direto(self, filepath, test_mode=False):
         """Importa arquivo SQL diretamente no PostgreSQL"""
@@ -182,7 +309,7 @@ class ImportadorPortabilidade:
         result = self.session.execute(text("""
             SELECT tablename, indexname
             FROM pg_indexes
-            WHERE schemaname = 'public'
+            WHERE schemaname = current_schema()
             ORDER BY tablename, indexname
         """))
 
@@ -192,6 +319,147 @@ class ImportadorPortabilidade:
 
         self.log("✓ Índices verificados")
 
+    def preparar_faixa_numero(self):
+        """
+        Preenche faixa_numero (int8range do número nacional) e cria o índice
+
+        Tenta uma exclusion constraint, que cria o GiST e garante que não há
+        faixas sobrepostas. Se a base tiver sobreposições, cria um GiST simples.
+        Nos dois casos o índice inclui as colunas da resposta (INCLUDE), e o
+        VACUUM no final atualiza o visibility map para index-only scans.
+        """
+        self.log("\n=== FAIXA NUMÉRICA (INT8RANGE) ===")
+
+        # Bases antigas não têm a coluna; a constraint é recriada após o UPDATE
+        self.session.execute(text("ALTER TABLE faixa_operadora ADD COLUMN IF NOT EXISTS faixa_numero int8range"))
+        self.session.execute(text("ALTER TABLE faixa_operadora DROP CONSTRAINT IF EXISTS faixa_numero_sem_sobreposicao"))
+        self.session.execute(text(f"DROP INDEX IF EXISTS {self.esquema}.idx_faixa_numero"))
+
+        atualizadas = self.session.execute(SQL_PREENCHER_FAIXA_NUMERO, {"fator": FATOR_NUMERO}).rowcount
+        self.session.commit()
+        self.log(f"✓ {atualizadas:,} faixas convertidas para int8range")
+
+        try:
+            self.session.execute(text(f"""
+                ALTER TABLE faixa_operadora
+                ADD CONSTRAINT faixa_numero_sem_sobreposicao
+                EXCLUDE USING gist (faixa_numero WITH &&) INCLUDE ({COLUNAS_COBERTAS})
+            """))
+            self.session.commit()
+            self.log("✓ Exclusion constraint criada: nenhuma faixa sobreposta")
+        except Exception:
+            self.session.rollback()
+            self.session.execute(text(f"""
+                CREATE INDEX idx_faixa_numero ON faixa_operadora
+                USING gist (faixa_numero) INCLUDE ({COLUNAS_COBERTAS})
+            """))
+            self.session.commit()
+
+            sobrepostas = self.session.execute(text("""
+                SELECT COUNT(*)
+                FROM faixa_operadora a
+                JOIN faixa_operadora b ON a.faixa_numero && b.faixa_numero AND a.id < b.id
+            """)).scalar()
+            self.log(f"⚠ {sobrepostas:,} pares de faixas sobrepostas: criado GiST sem exclusion constraint")
+
+        self.vacuum_analyze("faixa_operadora")
+
+    def vacuum_analyze(self, *tabelas):
+        """
+        VACUUM (ANALYZE) fora de transação
+
+        Após a carga e o UPDATE de faixa_numero as páginas não estão marcadas
+        como all-visible; sem isso o index-only scan ainda visita o heap.
+        """
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for tabela in tabelas:
+                conn.execute(text(f"VACUUM (ANALYZE) {self.esquema}.{tabela}"))
+                self.log(f"✓ VACUUM ANALYZE {self.esquema}.{tabela}")
+
+    def _explain(self, sql, parametros):
+        """EXPLAIN (ANALYZE, BUFFERS) de uma consulta: (plano, tempo_ms, buffers)"""
+        plano = self.session.execute(
+            text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql.text), parametros
+        ).scalar()
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+
+        raiz = plano[0]
+        no = raiz["Plan"]
+        buffers = no.get("Shared Hit Blocks", 0) + no.get("Shared Read Blocks", 0)
+        return no, raiz["Planning Time"] + raiz["Execution Time"], buffers
+
+    @staticmethod
+    def _no_de_acesso(no):
+        """Nó de acesso à tabela, abaixo do Limit"""
+        while no.get("Plans") and "Index Name" not in no and "Relation Name" not in no:
+            no = no["Plans"][0]
+        return no
+
+    @classmethod
+    def _descrever_plano(cls, no):
+        """Ex: 'Index Only Scan using idx_x'"""
+        no = cls._no_de_acesso(no)
+        descricao = no["Node Type"]
+        if "Index Name" in no:
+            descricao += f" using {no['Index Name']}"
+        return descricao
+
+    def comparar_consultas_faixa(self, amostras=200):
+        """
+        Compara (EXPLAIN ANALYZE) a consulta por índice composto com a sonda
+        de contenção em faixa_numero, para números reais da base
+        """
+        self.log("\n=== COMPARAÇÃO DE PLANOS: COMPOSTO x INT8RANGE ===")
+
+        linhas = self.session.execute(text("""
+            SELECT ddd, prefixo, (faixa_inicio + faixa_fim) / 2
+            FROM faixa_operadora
+            WHERE faixa_numero IS NOT NULL
+            ORDER BY random()
+            LIMIT :amostras
+        """), {"amostras": amostras}).fetchall()
+
+        if not linhas:
+            self.log("✗ Nenhuma faixa com faixa_numero para comparar")
+            return None
+
+        consultas = [
+            ("Índice composto (ddd, prefixo, faixa)", SQL_FAIXA_COMPOSTO,
+             lambda ddd, prefixo, numero: {"ddd": ddd, "prefixo": prefixo, "numero": numero}),
+            ("Contenção em faixa_numero (int8range)", SQL_FAIXA,
+             lambda ddd, prefixo, numero: {"numero_nacional": numero_nacional(ddd, prefixo, numero)}),
+        ]
+
+        resultados = []
+        for nome, sql, parametros in consultas:
+            # Aquecer o cache de buffers para comparar os dois em pé de igualdade
+            for ddd, prefixo, numero in linhas[:10]:
+                self._explain(sql, parametros(ddd, prefixo, numero))
+
+            tempos, buffers, heap = [], [], 0
+            for ddd, prefixo, numero in linhas:
+                no, tempo, lidos = self._explain(sql, parametros(ddd, prefixo, numero))
+                tempos.append(tempo)
+                buffers.append(lidos)
+                heap += self._no_de_acesso(no).get("Heap Fetches", 0)
+
+            media = sum(tempos) / len(tempos)
+            resultados.append(media)
+            self.log(f"  {nome}")
+            self.log(f"    plano: {self._descrever_plano(no)}")
+            self.log(f"    tempo médio: {media * 1000:,.1f} µs | buffers por consulta: "
+                     f"{sum(buffers) / len(buffers):,.1f} | heap fetches: {heap:,}")
+
+        composto, intervalo = resultados
+        if intervalo <= composto:
+            comparacao = f"{composto / intervalo:.2f}x mais rápido"
+        else:
+            comparacao = f"{intervalo / composto:.2f}x mais lento"
+        self.log(f"✓ int8range {comparacao} que o índice composto "
+                 f"({intervalo * 1000:,.1f} µs x {composto * 1000:,.1f} µs, {len(linhas)} números)")
+        return resultados
+
     def teste_consulta_portabilidade(self):
         """Teste de consulta real de portabilidade"""
         self.log("\n=== TESTE DE CONSULTA ===")
@@ -222,6 +490,26 @@ class ImportadorPortabilidade:
             self.log("✗ Consulta falhou")
             return False
 
+    def gerar_dimensao_operadoras(self):
+        """Grava a dimensão de operadoras usada pela API"""
+        self.log("\nGerando dimensão de operadoras...")
+        try:
+            total = gerar_dimensao(self.session)
+            self.log(f"✓ {total:,} operadoras")
+        except Exception as e:
+            self.session.rollback()
+            self.log(f"⚠ Falha ao gerar dimensão de operadoras: {str(e)}")
+
+    def publicar_indice_faixas(self):
+        """Grava o índice de faixas mapeado e publica nova geração"""
+        self.log("\nPublicando índice de faixas...")
+        try:
+            geracao = publicar_indice()
+            self.log(f"✓ Índice publicado (geração {geracao})")
+        except Exception as e:
+            # A API continua com o índice anterior
+            self.log(f"⚠ Falha ao publicar índice: {str(e)}")
+
     def executar_importacao(self, test_mode=False):
         """Executa importação completa"""
         self.log("="*60)
@@ -234,8 +522,8 @@ class ImportadorPortabilidade:
         # 1. Criar tabelas
         self.criar_tabelas()
 
-        # 2. Limpar dados existentes
-        self.limpar_tabelas()
+        # 2. Tabelas sombra: a API continua na base atual até a troca
+        self.preparar_tabelas_sombra()
 
         # 3. Download e importação
         arquivos_ordem = [
@@ -259,16 +547,37 @@ class ImportadorPortabilidade:
 
         # 5. Validação
         if not self.validar_dados():
-            self.log("\n✗ VALIDAÇÃO FALHOU!")
+            self.log("\n✗ VALIDAÇÃO FALHOU! Base atual mantida")
             return False
 
-        # 6. Verificar índices
+        # 6. Índices, faixa numérica (int8range), GiST de cobertura e VACUUM ANALYZE
+        self.indexar_tabelas_sombra()
+        self.preparar_faixa_numero()
+        self.vacuum_analyze("operadoras_rn1", "operadoras_stfc")
+
+        # 7. Verificar índices
         self.verificar_indices()
 
-        # 7. Teste de consulta
+        # 8. Teste de consulta
         if not self.teste_consulta_portabilidade():
             self.log("\n⚠ Teste de consulta falhou")
 
+        # 9. Plano da consulta por int8range x índice composto
+        try:
+            self.comparar_consultas_faixa()
+        except Exception as e:
+            self.session.rollback()
+            self.log(f"⚠ Comparação de planos falhou: {str(e)}")
+
+        # 10. Troca atômica: a API passa a ler a base nova
+        if not self.trocar_tabelas():
+            return False
+
+        # 11. Dimensão de operadoras (RN1/SPID/EOT/CNPJ) e índice de faixas;
+        # a publicação da geração faz os workers da API recarregarem os dois
+        self.gerar_dimensao_operadoras()
+        self.publicar_indice_faixas()
+
         self.log("\n" + "="*60)
         self.log("✓ IMPORTAÇÃO CONCLUÍDA COM SUCESSO!")
         self.log("="*60)
@@ -284,7 +593,15 @@ class ImportadorPortabilidade:
         except:
             pass
         finally:
+            # A conexão volta ao pool: não levar o search_path da carga
+            try:
+                self.session.rollback()
+                self.session.execute(text("RESET search_path"))
+                self.session.commit()
+            except Exception:
+                self.conexao.invalidate()
             self.session.close()
+            self.conexao.close()
 
 
 if __name__ == "__main__":
@@ -293,6 +610,14 @@ if __name__ == "__main__":
 
     importador = ImportadorPortabilidade()
 
+    # Apenas comparar os planos de consulta na base já importada
+    if "--explain" in sys.argv:
+        try:
+            sucesso = importador.comparar_consultas_faixa() is not None
+        finally:
+            importador.cleanup()
+        sys.exit(0 if sucesso else 1)
+
     try:
         sucesso = importador.executar_importacao(test_mode=test_mode)
         importador.cleanup()
@@ -0,0 +1,170 @@
+"""
+Índice de faixas em arquivo mapeado (mmap), compartilhado entre workers
+
+O índice é montado uma única vez a partir de faixa_operadora e gravado em
+INDICE_FAIXAS_PATH. Cada worker do uvicorn mapeia o arquivo somente leitura,
+então as páginas ficam uma única vez no page cache, qualquer que seja o
+número de workers.
+
+Formato do arquivo (little-endian):
+    cabeçalho (48 bytes): magic 'FAIXAS01', gerado_em (int64, epoch), grupos (uint64),
+                          faixas (uint64), tamanho_operadoras (uint64),
+                          reservado (8 bytes)
+    chaves:    int32[grupos], ordenadas (int(ddd + prefixo))
+    posicoes:  int32[grupos + 1], início de cada grupo nos arrays de faixa
+    inicios:   int32[faixas]
+    fins:      int32[faixas]
+    fim_max:   int32[faixas]
+    registros: uint32[faixas], índice na tabela de operadoras
+    operadoras: JSON {"faixas": [[nome, sigla, estado, tipo]], "nomes_rn1": {}}
+
+A tabela de operadoras tem poucos milhares de combinações distintas, então
+cada worker a decodifica para tuplas Faixa.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from app.lookup import Faixa, chave_grupo
+
+INDICE_FAIXAS_PATH = os.getenv("INDICE_FAIXAS_PATH", "/app/data/faixas.bin")
+
+MAGIC = b'FAIXAS01'
+CABECALHO = struct.Struct('<8sqQQQ8x')
+
+
+def gravar_indice(indice, caminho=INDICE_FAIXAS_PATH):
+    """
+    Grava um IndiceFaixas no formato mapeável
+
+    Usa arquivo temporário + os.replace: workers com o arquivo antigo
+    mapeado continuam lendo a versão anterior até trocarem.
+    """
+    grupos = sorted(
+        (chave, grupo)
+        for (ddd, prefixo), grupo in indice.grupos.items()
+        for chave in [chave_grupo(ddd, prefixo)]
+        if chave is not None
+    )
+
+    chaves = array('i')
+    posicoes = array('i', [0])
+    inicios, fins, fim_max, registros = array('i'), array('i'), array('i'), array('I')
+    operadoras = {}
+
+    for chave, (g_inicios, g_fins, g_fim_max, g_registros) in grupos:
+        chaves.append(chave)
+        inicios.extend(g_inicios)
+        fins.extend(g_fins)
+        fim_max.extend(g_fim_max)
+        registros.extend(operadoras.setdefault(faixa, len(operadoras)) for faixa in g_registros)
+        posicoes.append(len(inicios))
+
+    tabela = json.dumps({
+        "faixas": [list(faixa) for faixa in operadoras],
+        "nomes_rn1": indice.nomes_rn1
+    }, ensure_ascii=False).encode('utf-8')
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'wb') as f:
+        f.write(CABECALHO.pack(MAGIC, int(time.time()), len(chaves), len(inicios), len(tabela)))
+        for dados in (chaves, posicoes, inicios, fins, fim_max, registros):
+            dados.tofile(f)
+        f.write(tabela)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+    return len(inicios)
+
+
+class IndiceFaixasMapeado:
+    """Índice de faixas sobre o arquivo mapeado (mesma interface de IndiceFaixas)"""
+
+    def __init__(self, caminho=INDICE_FAIXAS_PATH):
+        self.caminho = caminho
+
+        with open(caminho, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, gerado_em, grupos, faixas, tamanho_tabela = CABECALHO.unpack_from(self._mmap, 0)
+        fim_arrays = CABECALHO.size + (grupos * 2 + 1 + faixas * 4) * 4
+        if magic != MAGIC or len(self._mmap) != fim_arrays + tamanho_tabela:
+            self._mmap.close()
+            raise ValueError(f"Índice de faixas inválido: {caminho}")
+
+        self.gerado_em = gerado_em
+        self.quantidade_grupos = grupos
+        self.total_faixas = faixas
+
+        visao = memoryview(self._mmap)
+        posicao = CABECALHO.size
+
+        def fatia(quantidade, formato):
+            nonlocal posicao
+            dados = visao[posicao:posicao + quantidade * 4].cast(formato)
+            posicao += quantidade * 4
+            return dados
+
+        self._chaves = fatia(grupos, 'i')
+        self._posicoes = fatia(grupos + 1, 'i')
+        self._inicios = fatia(faixas, 'i')
+        self._fins = fatia(faixas, 'i')
+        self._fim_max = fatia(faixas, 'i')
+        self._registros = fatia(faixas, 'I')
+
+        tabela = json.loads(bytes(visao[fim_arrays:]).decode('utf-8'))
+        self._operadoras = [Faixa(*faixa) for faixa in tabela["faixas"]]
+        self.nomes_rn1 = tabela["nomes_rn1"]
+
+    def _grupo(self, ddd, prefixo):
+        """(início, fim) do grupo nos arrays de faixa, ou None"""
+        chave = chave_grupo(ddd, prefixo)
+        if chave is None:
+            return None
+
+        i = bisect_left(self._chaves, chave)
+        if i == self.quantidade_grupos or self._chaves[i] != chave:
+            return None
+        return self._posicoes[i], self._posicoes[i + 1]
+
+    def _procurar(self, numero, inicio, lo):
+        """Faixa que contém o número (lo = primeira posição com inicio > numero)"""
+        fins, fim_max = self._fins, self._fim_max
+        i = lo - 1
+        while i >= inicio and fim_max[i] >= numero:
+            if fins[i] >= numero:
+                return self._operadoras[self._registros[i]]
+            i -= 1
+        return None
+
+    def buscar(self, ddd, prefixo, numero):
+        """Retorna a Faixa que contém o número ou None"""
+        grupo = self._grupo(ddd, prefixo)
+        if grupo is None:
+            return None
+
+        inicio, fim = grupo
+        return self._procurar(numero, inicio, bisect_right(self._inicios, numero, inicio, fim))
+
+    def buscar_grupo(self, ddd, prefixo, numeros):
+        """Resolve vários números (ordenados) do mesmo (ddd, prefixo)"""
+        grupo = self._grupo(ddd, prefixo)
+        if grupo is None:
+            return [None] * len(numeros)
+
+        inicio, fim = grupo
+        inicios = self._inicios
+        resultados = []
+        lo = inicio
+
+        for numero in numeros:
+            lo = bisect_right(inicios, numero, lo, fim)
+            resultados.append(self._procurar(numero, inicio, lo))
+
+        return resultados
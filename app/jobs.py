@@ -0,0 +1,341 @@
+"""
+Jobs de classificação em massa de arquivos CSV
+
+Cada job tem um diretório em JOBS_DIR com:
+    job.json        estado do job (sobrevive a reinícios da API)
+    entrada.csv     arquivo enviado (ou entrada.csv.gz)
+    resultado.csv.gz   saída com as colunas operadora, rn1 e portado
+
+Os jobs rodam um por vez em uma thread; cada job divide o arquivo em blocos
+de JOBS_BLOCO linhas que são classificados por um pool de processos.
+Jobs que estavam pendentes ou em processamento quando a API parou são
+reprocessados do início na próxima inicialização.
+"""
+import csv
+import fcntl
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+JOBS_DIR = os.getenv("JOBS_DIR", "/app/data/jobs")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", os.cpu_count() or 2))
+JOBS_BLOCO = int(os.getenv("JOBS_BLOCO", 100000))  # linhas por bloco
+
+STATUS_PENDENTE = "pendente"
+STATUS_PROCESSANDO = "processando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+
+COLUNAS_RESULTADO = ["operadora", "rn1", "portado"]
+
+_fila = queue.Queue()
+_thread = None
+_lock_estado = threading.Lock()
+
+
+def _agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def caminho_job(job_id, *partes):
+    return os.path.join(JOBS_DIR, job_id, *partes)
+
+
+def ler_job(job_id):
+    """Estado do job (dict) ou None se não existe"""
+    try:
+        with open(caminho_job(job_id, 'job.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def salvar_job(job):
+    """Grava job.json de forma atômica"""
+    job["atualizado_em"] = _agora()
+    destino = caminho_job(job["id"], 'job.json')
+    with _lock_estado:
+        with open(destino + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(destino + '.tmp', destino)
+
+
+def criar_job(arquivo, nome_arquivo, coluna=0, cabecalho=True, delimitador=','):
+    """
+    Cria um job a partir de um arquivo enviado (file-like) e o enfileira
+
+    O arquivo é copiado em blocos para o disco, sem carregar tudo na memória.
+    """
+    job_id = uuid.uuid4().hex
+    os.makedirs(caminho_job(job_id), exist_ok=True)
+
+    compactado = (nome_arquivo or '').endswith('.gz')
+    entrada = caminho_job(job_id, 'entrada.csv.gz' if compactado else 'entrada.csv')
+
+    with open(entrada, 'wb') as f:
+        while True:
+            bloco = arquivo.read(1024 * 1024)
+            if not bloco:
+                break
+            f.write(bloco)
+
+    job = {
+        "id": job_id,
+        "status": STATUS_PENDENTE,
+        "arquivo": nome_arquivo,
+        "entrada": entrada,
+        "resultado": caminho_job(job_id, 'resultado.csv.gz'),
+        "coluna": coluna,
+        "cabecalho": cabecalho,
+        "delimitador": delimitador,
+        "tamanho_bytes": os.path.getsize(entrada),
+        "linhas_processadas": 0,
+        "linhas_com_erro": 0,
+        "criado_em": _agora(),
+        "iniciado_em": None,
+        "concluido_em": None,
+        "erro": None
+    }
+    salvar_job(job)
+
+    _fila.put(job_id)
+    return job
+
+
+# Pool de processos: cada worker mapeia o índice de faixas e o
+# snapshot/filtro de portabilidade uma vez
+
+def _inicializar_worker():
+    from app.lookup import preparar_indice
+    from app.snapshot import carregar_snapshot
+    from app.bloom import carregar_filtro
+
+    preparar_indice()
+    carregar_snapshot()
+    carregar_filtro()
+
+
+def _obter_portabilidades(telefones):
+    """Portabilidade de uma lista de telefones, sem event loop (worker)"""
+    from app.bloom import obter_filtro
+    from app.snapshot import obter_snapshot
+    from app.database import SessionLocal
+    from app.lookup import SQL_PORTABILIDADE_ATUAL_LOTE, Portabilidade
+
+    filtro = obter_filtro()
+    if filtro is not None:
+        telefones = [telefone for telefone in telefones if filtro.contem(telefone)]
+
+    snapshot = obter_snapshot()
+    if snapshot is not None:
+        return snapshot.buscar_varios(telefones)
+
+    if not telefones:
+        return {}
+
+    session = SessionLocal()
+    try:
+        linhas = session.execute(SQL_PORTABILIDADE_ATUAL_LOTE, {"telefones": telefones})
+        return {linha[0]: Portabilidade(linha[1], linha[2]) for linha in linhas}
+    finally:
+        session.close()
+
+
+def _classificar_bloco(linhas, coluna, delimitador):
+    """
+    Classifica um bloco de linhas CSV (texto) e devolve o CSV de saída
+
+    Retorna (texto_csv, quantidade_de_linhas, linhas_com_erro).
+    """
+    from app.lookup import obter_indice, consultar_lote
+
+    indice = obter_indice()
+    if indice is None:
+        raise RuntimeError("Índice de faixas não carregado no worker")
+
+    registros = list(csv.reader(linhas, delimiter=delimitador))
+    telefones = [
+        registro[coluna] if len(registro) > coluna else ''
+        for registro in registros
+    ]
+
+    resultados = consultar_lote(indice, telefones, _obter_portabilidades)
+
+    saida = io.StringIO()
+    escritor = csv.writer(saida, delimiter=delimitador, lineterminator='\n')
+    erros = 0
+    for registro, resultado in zip(registros, resultados):
+        if "erro" in resultado:
+            erros += 1
+            registro.extend(["", "", ""])
+        else:
+            registro.extend([
+                resultado.get("operadora") or "",
+                resultado.get("rn1") or "",
+                "1" if resultado.get("portado") else "0"
+            ])
+        escritor.writerow(registro)
+
+    return saida.getvalue(), len(registros), erros
+
+
+def _ler_blocos(arquivo, tamanho):
+    bloco = []
+    for linha in arquivo:
+        bloco.append(linha)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def processar_job(job_id, executor):
+    """Processa um job do início ao fim"""
+    # Com vários workers do uvicorn, todos re-enfileiram os jobs interrompidos:
+    # o lock do job garante que só um processo o executa
+    with open(caminho_job(job_id, 'job.lock'), 'w') as trava:
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        job = ler_job(job_id)
+        if job is None or job["status"] not in (STATUS_PENDENTE, STATUS_PROCESSANDO):
+            return
+
+        _processar(job, executor)
+
+
+def _processar(job, executor):
+    job_id = job["id"]
+
+    job.update({
+        "status": STATUS_PROCESSANDO,
+        "iniciado_em": _agora(),
+        "linhas_processadas": 0,
+        "linhas_com_erro": 0,
+        "erro": None
+    })
+    salvar_job(job)
+    inicio = time.time()
+
+    abrir = gzip.open if job["entrada"].endswith('.gz') else open
+    temporario = job["resultado"] + '.tmp'
+
+    try:
+        with abrir(job["entrada"], 'rt', encoding='utf-8', errors='replace', newline='') as entrada, \
+                gzip.open(temporario, 'wt', encoding='utf-8', newline='') as saida:
+
+            if job["cabecalho"]:
+                primeira = entrada.readline()
+                if primeira:
+                    cabecalho = next(csv.reader([primeira], delimiter=job["delimitador"]))
+                    csv.writer(saida, delimiter=job["delimitador"], lineterminator='\n').writerow(
+                        cabecalho + COLUNAS_RESULTADO
+                    )
+
+            # No máximo 2 blocos por worker em voo: memória limitada e
+            # saída escrita na ordem da entrada
+            pendentes = []
+            limite = max(1, JOBS_WORKERS * 2)
+
+            def escrever_proximo():
+                texto, quantidade, erros = pendentes.pop(0).result()
+                saida.write(texto)
+                job["linhas_processadas"] += quantidade
+                job["linhas_com_erro"] += erros
+                job["linhas_por_segundo"] = int(job["linhas_processadas"] / max(time.time() - inicio, 0.001))
+                salvar_job(job)
+
+            for bloco in _ler_blocos(entrada, JOBS_BLOCO):
+                pendentes.append(executor.submit(
+                    _classificar_bloco, bloco, job["coluna"], job["delimitador"]
+                ))
+                if len(pendentes) >= limite:
+                    escrever_proximo()
+
+            while pendentes:
+                escrever_proximo()
+
+        os.replace(temporario, job["resultado"])
+        job["status"] = STATUS_CONCLUIDO
+
+    except Exception as e:
+        job["status"] = STATUS_ERRO
+        job["erro"] = str(e)
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    job["concluido_em"] = _agora()
+    job["tempo_segundos"] = round(time.time() - inicio, 1)
+    salvar_job(job)
+    print(f"[JOBS] Job {job_id}: {job['status']} - {job['linhas_processadas']:,} linhas "
+          f"em {job['tempo_segundos']}s", flush=True)
+
+
+def _executar_fila():
+    """Thread que processa os jobs enfileirados, um por vez"""
+    from app.geracao import ler_geracao
+
+    contexto = multiprocessing.get_context("spawn")
+    executor = None
+    geracao_pool = None
+
+    while True:
+        job_id = _fila.get()
+        try:
+            # Pool mantido entre jobs; recriado se uma nova base foi publicada
+            geracao = ler_geracao()
+            if executor is not None and geracao != geracao_pool:
+                executor.shutdown(wait=True)
+                executor = None
+
+            if executor is None:
+                geracao_pool = geracao
+                executor = ProcessPoolExecutor(
+                    max_workers=JOBS_WORKERS,
+                    mp_context=contexto,
+                    initializer=_inicializar_worker
+                )
+            processar_job(job_id, executor)
+        except Exception as e:
+            print(f"[JOBS] Falha no job {job_id}: {str(e)}", flush=True)
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+        finally:
+            _fila.task_done()
+
+
+def iniciar():
+    """Inicia a thread de jobs e re-enfileira jobs interrompidos"""
+    global _thread
+
+    if _thread is not None:
+        return
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+
+    interrompidos = []
+    for job_id in sorted(os.listdir(JOBS_DIR)):
+        job = ler_job(job_id)
+        if job and job["status"] in (STATUS_PENDENTE, STATUS_PROCESSANDO):
+            interrompidos.append((job["criado_em"], job_id))
+
+    for _, job_id in sorted(interrompidos):
+        _fila.put(job_id)
+
+    if interrompidos:
+        print(f"[JOBS] {len(interrompidos)} job(s) re-enfileirado(s)", flush=True)
+
+    _thread = threading.Thread(target=_executar_fila, name="jobs-classificacao", daemon=True)
+    _thread.start()
@@ -0,0 +1,467 @@
+"""
+Motor de consulta em memória das faixas de numeração (faixa_operadora)
+
+As ~235k faixas são carregadas uma única vez do banco e agrupadas por
+(ddd, prefixo) em arrays ordenados por faixa_inicio. A consulta é uma busca
+binária, sem ida ao PostgreSQL. O índice montado é gravado em um arquivo
+mapeado (app.indice_compartilhado) que todos os workers compartilham.
+
+A portabilidade real vem de portabilidade_atual (último evento de cada
+telefone em portabilidade_historico); a faixa é usada quando não há evento.
+"""
+import fcntl
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from app.database import SessionLocal
+from app.models import FaixaOperadora, OperadoraRN1
+from app.resposta import montar_resultado
+
+# Dados da operadora retornados para uma faixa encontrada
+Faixa = namedtuple('Faixa', ['nome_operadora', 'sigla_operadora', 'estado', 'tipo_numero'])
+
+# Último evento de portabilidade de um telefone
+Portabilidade = namedtuple('Portabilidade', ['codigo_completo', 'spid_destino'])
+
+SQL_PORTABILIDADE_ATUAL = text("""
+    SELECT codigo_completo, spid_destino
+    FROM portabilidade_atual
+    WHERE telefone = :telefone
+""")
+
+SQL_PORTABILIDADE_ATUAL_LOTE = text("""
+    SELECT telefone, codigo_completo, spid_destino
+    FROM portabilidade_atual
+    WHERE telefone = ANY(:telefones)
+""")
+
+# Último evento até uma data: uma descida no índice (telefone, data_atualizacao_ts)
+# lendo de trás para frente, sem percorrer o histórico do número
+SQL_PORTABILIDADE_EM_DATA = text("""
+    SELECT codigo_completo, spid_destino
+    FROM portabilidade_historico
+    WHERE telefone = :telefone
+      AND data_atualizacao_ts <= :data_referencia
+    ORDER BY data_atualizacao_ts DESC
+    LIMIT 1
+""")
+
+# Linha do tempo de um número (índice idx_historico_telefone_data)
+SQL_HISTORICO_TELEFONE = text("""
+    SELECT spid_origem, spid_destino, codigo_completo, status,
+           data_criacao_ts, data_atualizacao_ts
+    FROM portabilidade_historico
+    WHERE telefone = :telefone
+    ORDER BY data_atualizacao_ts, id
+""")
+
+# Colunas de agrupamento de portabilidade_rollup (app.historico.atualizar_rollups)
+DIMENSOES_ROLLUP = ('mes', 'spid_origem', 'spid_destino', 'ddd')
+
+# Uma sonda de contenção no GiST de faixa_numero (int8range do número nacional)
+SQL_FAIXA = text("""
+    SELECT nome_operadora, sigla_operadora, estado, tipo_numero
+    FROM faixa_operadora
+    WHERE faixa_numero @> CAST(:numero_nacional AS bigint)
+    LIMIT 1
+""")
+
+# Espaço reservado para o número após o prefixo (celular tem 5 dígitos)
+FATOR_NUMERO = 100000
+
+
+def normalizar_telefone(telefone):
+    """
+    Limpa o telefone e extrai seus componentes
+
+    Retorna (telefone, ddd, prefixo, numero). Levanta ValueError se inválido.
+    """
+    telefone = telefone.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
+
+    if len(telefone) < 10 or len(telefone) > 11 or not telefone.isdigit():
+        raise ValueError("Telefone inválido. Use formato: DDDNumero (ex: 11987654321)")
+
+    ddd = telefone[:2]
+
+    # Para celular (11 dígitos): prefixo = 4 primeiros após DDD
+    # Para fixo (10 dígitos): prefixo = 4 primeiros após DDD
+    prefixo = telefone[2:6]
+    numero = telefone[6:]
+
+    return telefone, ddd, prefixo, numero
+
+
+def chave_grupo(ddd, prefixo):
+    """Chave inteira de (ddd, prefixo), ou None se fora do formato consultável"""
+    if len(ddd) != 2 or len(prefixo) != 4 or not (ddd + prefixo).isdigit():
+        return None
+    return int(ddd + prefixo)
+
+
+def numero_nacional(ddd, prefixo, numero):
+    """Número absoluto usado em faixa_numero (None se fora do formato)"""
+    chave = chave_grupo(ddd, prefixo)
+    if chave is None:
+        return None
+    return chave * FATOR_NUMERO + int(numero)
+
+
+class IndiceFaixas:
+    """Índice imutável de faixas: (ddd, prefixo) -> arrays ordenados"""
+
+    def __init__(self, grupos, total_faixas, nomes_rn1=None):
+        # grupos: {(ddd, prefixo): (inicios, fins, fim_max, faixas)}
+        self.grupos = grupos
+        self.total_faixas = total_faixas
+        # rn1_prefixo -> nome da operadora (para números portados)
+        self.nomes_rn1 = nomes_rn1 or {}
+
+    @classmethod
+    def carregar(cls, session):
+        """Lê faixa_operadora e monta o índice"""
+        linhas = session.query(
+            FaixaOperadora.ddd,
+            FaixaOperadora.prefixo,
+            FaixaOperadora.faixa_inicio,
+            FaixaOperadora.faixa_fim,
+            FaixaOperadora.nome_operadora,
+            FaixaOperadora.sigla_operadora,
+            FaixaOperadora.estado,
+            FaixaOperadora.tipo_numero
+        ).order_by(
+            FaixaOperadora.ddd,
+            FaixaOperadora.prefixo,
+            FaixaOperadora.faixa_inicio
+        ).yield_per(50000)
+
+        # Registros de operadora se repetem muito: reaproveitar a mesma tupla
+        faixas_unicas = {}
+        grupos = {}
+        total = 0
+
+        for ddd, prefixo, inicio, fim, nome, sigla, estado, tipo in linhas:
+            if inicio is None or fim is None:
+                continue
+
+            chave = (ddd, prefixo)
+            grupo = grupos.get(chave)
+            if grupo is None:
+                grupo = (array('i'), array('i'), array('i'), [])
+                grupos[chave] = grupo
+
+            faixa = Faixa(nome, sigla, estado, tipo)
+            faixa = faixas_unicas.setdefault(faixa, faixa)
+
+            inicios, fins, fim_max, registros = grupo
+            inicios.append(inicio)
+            fins.append(fim)
+            # Maior faixa_fim até esta posição (permite faixas sobrepostas)
+            fim_max.append(max(fim, fim_max[-1]) if fim_max else fim)
+            registros.append(faixa)
+            total += 1
+
+        # Os dumps de origem trazem '\r' no final do rn1_prefixo
+        nomes_rn1 = {
+            (rn1 or '').strip(): nome
+            for nome, rn1 in session.query(OperadoraRN1.nome_operadora, OperadoraRN1.rn1_prefixo)
+        }
+
+        return cls(grupos, total, nomes_rn1)
+
+    def buscar(self, ddd, prefixo, numero):
+        """Retorna a Faixa que contém o número ou None"""
+        grupo = self.grupos.get((ddd, prefixo))
+        if grupo is None:
+            return None
+
+        inicios, fins, fim_max, registros = grupo
+
+        # Última faixa com inicio <= numero
+        i = bisect_right(inicios, numero) - 1
+
+        # Voltar apenas enquanto alguma faixa anterior ainda alcança o número
+        while i >= 0 and fim_max[i] >= numero:
+            if fins[i] >= numero:
+                return registros[i]
+            i -= 1
+
+        return None
+
+    def buscar_grupo(self, ddd, prefixo, numeros):
+        """
+        Resolve vários números do mesmo (ddd, prefixo) de uma vez
+
+        numeros deve estar ordenado; a busca avança sempre a partir da
+        posição anterior (estilo searchsorted). Retorna lista de Faixa/None.
+        """
+        grupo = self.grupos.get((ddd, prefixo))
+        if grupo is None:
+            return [None] * len(numeros)
+
+        inicios, fins, fim_max, registros = grupo
+        resultados = []
+        lo = 0
+
+        for numero in numeros:
+            lo = bisect_right(inicios, numero, lo)
+            i = lo - 1
+            encontrada = None
+
+            while i >= 0 and fim_max[i] >= numero:
+                if fins[i] >= numero:
+                    encontrada = registros[i]
+                    break
+                i -= 1
+
+            resultados.append(encontrada)
+
+        return resultados
+
+
+async def buscar_portabilidade(session, telefone):
+    """Último evento de portabilidade do telefone (ou None) - AsyncSession"""
+    resultado = await session.execute(SQL_PORTABILIDADE_ATUAL, {"telefone": int(telefone)})
+    linha = resultado.fetchone()
+    if linha is None:
+        return None
+    return Portabilidade(linha[0], linha[1])
+
+
+async def buscar_portabilidade_em(session, telefone, data_referencia):
+    """Último evento de portabilidade até data_referencia (ou None) - AsyncSession"""
+    resultado = await session.execute(
+        SQL_PORTABILIDADE_EM_DATA,
+        {"telefone": int(telefone), "data_referencia": data_referencia}
+    )
+    linha = resultado.fetchone()
+    if linha is None:
+        return None
+    return Portabilidade(linha[0], linha[1])
+
+
+async def buscar_portabilidades(session, telefones):
+    """Últimos eventos de uma lista de telefones: {telefone_int: Portabilidade}"""
+    if not telefones:
+        return {}
+    resultado = await session.execute(SQL_PORTABILIDADE_ATUAL_LOTE, {"telefones": list(telefones)})
+    return {linha[0]: Portabilidade(linha[1], linha[2]) for linha in resultado}
+
+
+async def buscar_historico(session, telefone):
+    """Eventos de portabilidade do telefone em ordem cronológica (lista de dicts)"""
+    resultado = await session.execute(SQL_HISTORICO_TELEFONE, {"telefone": int(telefone)})
+    return [
+        {
+            "spid_origem": spid_origem,
+            "spid_destino": spid_destino,
+            "rn1": (codigo_completo or '').strip() or None,
+            "status": status,
+            "data_criacao": data_criacao,
+            "data_atualizacao": data_atualizacao
+        }
+        for spid_origem, spid_destino, codigo_completo, status, data_criacao, data_atualizacao in resultado
+    ]
+
+
+async def buscar_rollup(session, agrupar, mes_inicio=None, mes_fim=None,
+                        spids_origem=None, spids_destino=None, ddd=None):
+    """
+    Contagens de portabilidade agregadas por colunas de DIMENSOES_ROLLUP
+
+    mes_inicio/mes_fim são datas (primeiro dia do mês, inclusivos); os
+    filtros de SPID recebem listas. Retorna lista de dicts com as colunas de
+    agrupamento e 'quantidade', da maior para a menor.
+    """
+    colunas = [coluna for coluna in DIMENSOES_ROLLUP if coluna in agrupar]
+    filtros = []
+    parametros = {}
+
+    if mes_inicio is not None:
+        filtros.append("mes >= :mes_inicio")
+        parametros["mes_inicio"] = mes_inicio
+    if mes_fim is not None:
+        filtros.append("mes <= :mes_fim")
+        parametros["mes_fim"] = mes_fim
+    if spids_origem is not None:
+        filtros.append("spid_origem = ANY(:spids_origem)")
+        parametros["spids_origem"] = list(spids_origem)
+    if spids_destino is not None:
+        filtros.append("spid_destino = ANY(:spids_destino)")
+        parametros["spids_destino"] = list(spids_destino)
+    if ddd is not None:
+        filtros.append("ddd = :ddd")
+        parametros["ddd"] = ddd
+
+    # Colunas vêm só de DIMENSOES_ROLLUP; valores vão como parâmetros
+    sql = "SELECT " + "".join(f"{coluna}, " for coluna in colunas) + "SUM(quantidade) AS quantidade"
+    sql += " FROM portabilidade_rollup"
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    if colunas:
+        sql += " GROUP BY " + ", ".join(colunas) + " ORDER BY quantidade DESC, " + ", ".join(colunas)
+
+    resultado = await session.execute(text(sql), parametros)
+    linhas = []
+    for linha in resultado.mappings():
+        item = dict(linha)
+        if item.get("mes") is not None:
+            item["mes"] = item["mes"].strftime('%Y-%m')
+        item["quantidade"] = int(item["quantidade"] or 0)
+        linhas.append(item)
+    return linhas
+
+
+async def buscar_faixa(session, ddd, prefixo, numero):
+    """Faixa do número direto no banco (usado enquanto o índice não carrega)"""
+    nacional = numero_nacional(ddd, prefixo, numero)
+    if nacional is None:
+        return None
+
+    resultado = await session.execute(SQL_FAIXA, {"numero_nacional": nacional})
+    linha = resultado.fetchone()
+    if linha is None:
+        return None
+    return Faixa(*linha)
+
+
+def preparar_lote(telefones):
+    """
+    Normaliza uma lista de telefones e agrupa por (ddd, prefixo)
+
+    Retorna (resultados, grupos): resultados já traz os erros de validação
+    nas posições inválidas; grupos é {(ddd, prefixo): [(numero, posicao, normalizado)]}.
+    """
+    resultados = [None] * len(telefones)
+    grupos = {}
+
+    for posicao, bruto in enumerate(telefones):
+        try:
+            normalizado = normalizar_telefone(bruto)
+        except ValueError as e:
+            resultados[posicao] = {"telefone": bruto, "erro": str(e)}
+            continue
+
+        _, ddd, prefixo, numero = normalizado
+        grupos.setdefault((ddd, prefixo), []).append((int(numero), posicao, normalizado))
+
+    return resultados, grupos
+
+
+def telefones_do_lote(grupos):
+    """Telefones (int) válidos de um lote preparado"""
+    return [int(item[2][0]) for itens in grupos.values() for item in itens]
+
+
+def resolver_lote(indice, resultados, grupos, portabilidades):
+    """
+    Resolve um lote preparado: uma passada ordenada por (ddd, prefixo)
+
+    portabilidades é {telefone_int: Portabilidade}. Preenche e retorna
+    resultados, na mesma ordem da entrada.
+    """
+    for (ddd, prefixo), itens in grupos.items():
+        itens.sort(key=lambda item: item[0])
+        faixas = indice.buscar_grupo(ddd, prefixo, [item[0] for item in itens])
+
+        for (_, posicao, normalizado), faixa in zip(itens, faixas):
+            resultados[posicao] = montar_resultado(
+                *normalizado,
+                faixa,
+                portabilidades.get(int(normalizado[0])),
+                indice.nomes_rn1
+            )
+
+    return resultados
+
+
+def consultar_lote(indice, telefones, obter_portabilidades=None):
+    """
+    Consulta uma lista de telefones no índice (sem acesso ao banco)
+
+    obter_portabilidades recebe a lista de telefones (int) e retorna
+    {telefone: Portabilidade}, por exemplo o snapshot mmap.
+    """
+    resultados, grupos = preparar_lote(telefones)
+
+    portabilidades = {}
+    if obter_portabilidades is not None:
+        portabilidades = obter_portabilidades(telefones_do_lote(grupos))
+
+    return resolver_lote(indice, resultados, grupos, portabilidades)
+
+
+# Índice ativo do processo. A troca é feita substituindo a referência,
+# então consultas em andamento continuam usando a cópia antiga.
+_indice = None
+_lock_recarga = threading.Lock()
+
+
+def obter_indice():
+    """Retorna o índice ativo (None se ainda não carregado)"""
+    return _indice
+
+
+def carregar_indice(caminho=None):
+    """Mapeia o índice de faixas publicado e troca o ativo (sem acesso ao banco)"""
+    # Import tardio: indice_compartilhado depende deste módulo
+    from app.indice_compartilhado import IndiceFaixasMapeado, INDICE_FAIXAS_PATH
+    global _indice
+
+    with _lock_recarga:
+        novo = IndiceFaixasMapeado(caminho or INDICE_FAIXAS_PATH)
+        _indice = novo
+
+    print(f"[LOOKUP] Índice de faixas mapeado: {novo.total_faixas:,} faixas, "
+          f"{novo.quantidade_grupos:,} prefixos", flush=True)
+    return novo
+
+
+def publicar_indice(caminho=None):
+    """
+    Monta o índice a partir do banco, grava o arquivo compartilhado e
+    publica uma nova geração (os workers trocam ao perceber a mudança)
+    """
+    from app.indice_compartilhado import gravar_indice, INDICE_FAIXAS_PATH
+    from app.geracao import publicar_geracao
+
+    session = SessionLocal()
+    try:
+        indice = IndiceFaixas.carregar(session)
+    finally:
+        session.close()
+
+    total = gravar_indice(indice, caminho or INDICE_FAIXAS_PATH)
+    print(f"[LOOKUP] Índice de faixas gravado: {total:,} faixas, "
+          f"{len(indice.grupos):,} prefixos", flush=True)
+    return publicar_geracao()
+
+
+def preparar_indice(caminho=None):
+    """
+    Mapeia o índice publicado; se ainda não existe, monta a partir do banco
+
+    Com vários workers subindo juntos, um lock de arquivo garante que só um
+    deles lê faixa_operadora; os demais esperam e mapeiam o mesmo arquivo.
+    """
+    from app.indice_compartilhado import INDICE_FAIXAS_PATH
+
+    caminho = caminho or INDICE_FAIXAS_PATH
+    if not os.path.exists(caminho):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        with open(caminho + '.lock', 'w') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            if not os.path.exists(caminho):
+                publicar_indice(caminho)
+
+    return carregar_indice(caminho)
+
+
+def recarregar_indice():
+    """Monta um novo índice a partir do banco, publica e troca o ativo"""
+    publicar_indice()
+    return carregar_indice()
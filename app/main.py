@@ -1,19 +1,33 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, FileResponse, Response
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import os
 import subprocess
 import sys
 import psutil
 import json
 import time
+import asyncio
 from datetime import datetime, timedelta
-from sqlalchemy import text
-
-from app.database import SessionLocal, engine
-from app.models import Base, FaixaOperadora, OperadoraRN1, OperadoraSTFC, PortabilidadeHistorico
+from sqlalchemy import text, select, func
+
+from app.database import engine, AsyncSessionLocal, LookupSessionLocal
+from app.models import Base, FaixaOperadora, OperadoraRN1, OperadoraSTFC, PortabilidadeHistorico, PortabilidadeAtual
+from app.lookup import (
+    normalizar_telefone, obter_indice, preparar_indice, carregar_indice, preparar_lote, resolver_lote,
+    telefones_do_lote, buscar_portabilidade, buscar_portabilidades, buscar_faixa,
+    buscar_historico, buscar_portabilidade_em, buscar_rollup, DIMENSOES_ROLLUP
+)
+from app.snapshot import obter_snapshot, carregar_snapshot, abrir_snapshot, ativar_snapshot, SNAPSHOT_PATH
+from app.bloom import obter_filtro, carregar_filtro, abrir_filtro, ativar_filtro, BLOOM_PATH
+from app.cache import cache_consultas
+from app.resposta import montar_resposta
+from app.operadoras import obter_dimensao, carregar_dimensao, preparar_dimensao, normalizar_codigo
+from app.geracao import ler_geracao, publicar_geracao, GERACAO_INTERVALO
+from app import jobs
 
 app = FastAPI(
     title="API Portabilidade",
@@ -33,6 +47,7 @@ app.add_middleware(
 # Models
 class TelefoneConsulta(BaseModel):
     telefone: str
+    data_referencia: Optional[str] = None  # YYYY-MM-DD ou YYYY-MM-DDTHH:MM:SS
 
 class PortabilidadeResponse(BaseModel):
     telefone: str
@@ -44,6 +59,25 @@ class PortabilidadeResponse(BaseModel):
     numero: Optional[str] = None
     estado: Optional[str] = None
     tipo_numero: Optional[str] = None
+    rn1: Optional[str] = None  # RN1 da operadora atual, quando portado
+
+class ConsultaLote(BaseModel):
+    telefones: List[str]
+
+class EventoPortabilidade(BaseModel):
+    spid_origem: Optional[str] = None
+    spid_destino: Optional[str] = None
+    rn1: Optional[str] = None
+    operadora: Optional[str] = None  # Nome da operadora de destino (RN1/SPID)
+    operadora_origem: Optional[str] = None  # Nome da operadora de origem (SPID)
+    status: Optional[str] = None
+    data_criacao: Optional[datetime] = None
+    data_atualizacao: Optional[datetime] = None
+
+class HistoricoResponse(BaseModel):
+    telefone: str
+    total_eventos: int
+    eventos: List[EventoPortabilidade]
 
 class ImportRequest(BaseModel):
     test_mode: bool = False
@@ -53,11 +87,31 @@ class StatsResponse(BaseModel):
     operadoras_stfc: int
     faixa_operadora: int
     total_registros: int
+    filtro_bloom: Optional[Dict[str, Any]] = None
+    operadoras: Optional[Dict[str, Any]] = None
+    cache_consulta: Optional[Dict[str, Any]] = None
+    geracao: Optional[int] = None
 
 class RebootRequest(BaseModel):
     confirm: bool = False
     delay: int = 5  # segundos de delay antes do reboot
 
+# Limite de números por requisição em /consulta/lote
+CONSULTA_LOTE_MAX = int(os.getenv("CONSULTA_LOTE_MAX", 1000000))
+
+# Validade (segundos) das respostas de GET /consulta/{telefone} em caches HTTP
+CONSULTA_MAX_AGE = int(os.getenv("CONSULTA_MAX_AGE", 300))
+
+# Números resolvidos por vez em /consulta/stream (limita a memória usada)
+CONSULTA_STREAM_LOTE = int(os.getenv("CONSULTA_STREAM_LOTE", 10000))
+
+# Tamanho máximo de uma linha do /consulta/stream: o que passar disso é
+# respondido como telefone inválido e o restante da linha descartado
+CONSULTA_STREAM_LINHA_MAX = 64
+
+# Geração dos dados (índice, snapshot, filtro) carregada neste worker
+geracao_carregada = None
+
 # Estado da importação
 import_status = {
     "running": False,
@@ -76,6 +130,15 @@ async def root():
         "endpoints": {
             "health": "GET /health - Status do sistema",
             "consulta": "POST /consulta - Consultar portabilidade",
+            "consulta_get": "GET /consulta/{telefone} - Consultar portabilidade (cacheável, ETag)",
+            "historico": "GET /historico/{telefone} - Eventos de portabilidade do número",
+            "stats_portabilidade": "GET /stats/portabilidade - Contagens por mês/operadora/DDD (rollup)",
+            "operadoras": "GET /operadoras/{codigo} - Operadora por RN1, SPID, EOT ou CNPJ",
+            "consulta_lote": "POST /consulta/lote - Consultar lista de telefones",
+            "consulta_stream": "POST /consulta/stream - Consultar telefones em streaming (um por linha, resposta NDJSON)",
+            "jobs_classificacao": "POST /jobs/classificacao - Classificar arquivo CSV em background",
+            "jobs_status": "GET /jobs/{id} - Status do job de classificação",
+            "jobs_resultado": "GET /jobs/{id}/resultado - Baixar CSV classificado (gzip)",
             "stats": "GET /stats - Estatísticas da base",
             "import": "POST /import - Importar base de dados",
             "import_status": "GET /import/status - Status da importação",
@@ -96,20 +159,18 @@ async def health():
 
     try:
         # Testar conexão com banco
-        session = SessionLocal()
-        result = session.execute(text("SELECT 1"))
-        result.fetchone()
-        db_status = "connected"
-
-        # Contar tabelas
-        result = session.execute(text("""
-            SELECT COUNT(*)
-            FROM information_schema.tables
-            WHERE table_schema = 'public'
-        """))
-        db_tables_count = result.fetchone()[0]
-
-        session.close()
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(text("SELECT 1"))
+            result.fetchone()
+            db_status = "connected"
+
+            # Contar tabelas
+            result = await session.execute(text("""
+                SELECT COUNT(*)
+                FROM information_schema.tables
+                WHERE table_schema = 'public'
+            """))
+            db_tables_count = result.fetchone()[0]
     except Exception as e:
         db_status = f"error: {str(e)}"
 
@@ -126,90 +187,630 @@ async def health():
 async def stats():
     """Retorna estatísticas da base de dados"""
     try:
-        session = SessionLocal()
-
-        rn1_count = session.query(OperadoraRN1).count()
-        stfc_count = session.query(OperadoraSTFC).count()
-        faixa_count = session.query(FaixaOperadora).count()
+        async with AsyncSessionLocal() as session:
+            rn1_count = await session.scalar(select(func.count()).select_from(OperadoraRN1))
+            stfc_count = await session.scalar(select(func.count()).select_from(OperadoraSTFC))
+            faixa_count = await session.scalar(select(func.count()).select_from(FaixaOperadora))
 
-        session.close()
+        filtro = obter_filtro()
+        dimensao = obter_dimensao()
 
         return StatsResponse(
             operadoras_rn1=rn1_count,
             operadoras_stfc=stfc_count,
             faixa_operadora=faixa_count,
-            total_registros=rn1_count + stfc_count + faixa_count
+            total_registros=rn1_count + stfc_count + faixa_count,
+            filtro_bloom=filtro.estatisticas() if filtro is not None else None,
+            operadoras=dimensao.estatisticas() if dimensao is not None else None,
+            cache_consulta=cache_consultas.estatisticas(),
+            geracao=geracao_carregada
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter estatísticas: {str(e)}")
 
+@app.on_event("startup")
+async def carregar_indice_faixas():
+    """Mapeia índice de faixas, snapshot e filtro na inicialização do worker"""
+    global geracao_carregada
+
+    # Lida antes de carregar: uma publicação durante a carga é vista depois
+    geracao_carregada = ler_geracao()
+
+    # O índice publicado é mapeado mesmo com o banco fora do ar
+    try:
+        await run_in_threadpool(preparar_indice)
+    except Exception as e:
+        # Sem índice, /consulta continua funcionando direto no banco
+        print(f"[LOOKUP] Índice de faixas não carregado: {str(e)}", flush=True)
+
+    try:
+        # Bases antigas não têm portabilidade_atual
+        await run_in_threadpool(
+            Base.metadata.create_all, bind=engine, tables=[PortabilidadeAtual.__table__]
+        )
+    except Exception as e:
+        print(f"[DB] portabilidade_atual não verificada: {str(e)}", flush=True)
+
+    try:
+        carregar_snapshot()
+    except Exception as e:
+        # Sem snapshot, a portabilidade é consultada em portabilidade_atual
+        print(f"[SNAPSHOT] Snapshot não carregado: {str(e)}", flush=True)
+
+    try:
+        carregar_filtro()
+    except Exception as e:
+        print(f"[BLOOM] Filtro não carregado: {str(e)}", flush=True)
+
+    try:
+        await run_in_threadpool(preparar_dimensao)
+    except Exception as e:
+        print(f"[OPERADORAS] Dimensão não carregada: {str(e)}", flush=True)
+
+    asyncio.create_task(vigiar_geracao())
+
+    try:
+        jobs.iniciar()
+    except Exception as e:
+        print(f"[JOBS] Fila de jobs não iniciada: {str(e)}", flush=True)
+
+def sincronizar_geracao():
+    """
+    Troca índice, snapshot e filtro se outra geração foi publicada
+
+    Os arquivos são apenas relidos/remapeados (sem acesso ao banco), então todos os
+    workers trocam em poucos milissegundos. Retorna True se houve troca.
+    """
+    global geracao_carregada
+
+    geracao = ler_geracao()
+    if geracao == geracao_carregada:
+        return False
+
+    try:
+        carregar_indice()
+    except Exception as e:
+        print(f"[LOOKUP] Falha ao mapear índice: {str(e)}", flush=True)
+
+    # Snapshot e filtro da nova geração são abertos antes e trocados juntos;
+    # o que não abrir é desligado (nunca servido de outra geração)
+    try:
+        snapshot = abrir_snapshot()
+    except Exception as e:
+        snapshot = None
+        print(f"[SNAPSHOT] Falha ao recarregar snapshot: {str(e)}", flush=True)
+
+    try:
+        filtro = abrir_filtro()
+    except Exception as e:
+        filtro = None
+        print(f"[BLOOM] Falha ao recarregar filtro: {str(e)}", flush=True)
+
+    ativar_snapshot(snapshot)
+    ativar_filtro(filtro)
+
+    try:
+        carregar_dimensao()
+    except Exception as e:
+        print(f"[OPERADORAS] Falha ao recarregar dimensão: {str(e)}", flush=True)
+
+    cache_consultas.invalidar()
+    geracao_carregada = geracao
+    print(f"[GERACAO] Worker {os.getpid()} na geração {geracao}", flush=True)
+    return True
+
+async def vigiar_geracao():
+    """Verifica periodicamente se há nova geração publicada"""
+    while True:
+        await asyncio.sleep(GERACAO_INTERVALO)
+        try:
+            await run_in_threadpool(sincronizar_geracao)
+        except Exception as e:
+            print(f"[GERACAO] Falha ao verificar geração: {str(e)}", flush=True)
+
+async def obter_portabilidade(session, telefone):
+    """
+    Último evento de portabilidade do telefone
+
+    Ordem: filtro de Bloom (negativo = nunca portado), snapshot mmap e,
+    por último, a chave primária de portabilidade_atual.
+    """
+    telefone = int(telefone)
+
+    filtro = obter_filtro()
+    if filtro is not None and not filtro.contem(telefone):
+        return None
+
+    snapshot = obter_snapshot()
+    if snapshot is not None:
+        return snapshot.buscar(telefone)
+
+    return await buscar_portabilidade(session, telefone)
+
+async def obter_portabilidade_em(session, telefone, data_referencia):
+    """
+    Último evento de portabilidade até data_referencia
+
+    Snapshot e cache só têm o estado atual, então a busca vai ao histórico;
+    o filtro de Bloom continua valendo (nunca portado em nenhuma data).
+    """
+    telefone = int(telefone)
+
+    filtro = obter_filtro()
+    if filtro is not None and not filtro.contem(telefone):
+        return None
+
+    return await buscar_portabilidade_em(session, telefone, data_referencia)
+
+def interpretar_data_referencia(texto):
+    """
+    Converte data_referencia para datetime local (sem fuso)
+
+    Só a data vale para o dia inteiro (até 23:59:59.999999).
+    Levanta ValueError se o formato for inválido.
+    """
+    texto = texto.strip()
+    if len(texto) == 10:
+        return datetime.combine(datetime.fromisoformat(texto).date(), datetime.max.time())
+
+    data = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    if data.tzinfo is not None:
+        # Datas do histórico estão no fuso do servidor
+        data = data.astimezone().replace(tzinfo=None)
+    return data
+
+async def obter_portabilidades(session, telefones):
+    """Versão em lote de obter_portabilidade: {telefone: Portabilidade}"""
+    filtro = obter_filtro()
+    if filtro is not None:
+        telefones = [telefone for telefone in telefones if filtro.contem(telefone)]
+
+    snapshot = obter_snapshot()
+    if snapshot is not None:
+        return snapshot.buscar_varios(telefones)
+
+    return await buscar_portabilidades(session, telefones)
+
+def validar_consulta(telefone_bruto, data_referencia=None):
+    """
+    Normaliza telefone e data_referencia da consulta (HTTP 400 se inválidos)
+
+    Retorna ((telefone, ddd, prefixo, numero), data_referencia ou None).
+    """
+    try:
+        normalizado = normalizar_telefone(telefone_bruto)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not data_referencia:
+        return normalizado, None
+
+    try:
+        return normalizado, interpretar_data_referencia(data_referencia)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="data_referencia inválida. Use YYYY-MM-DD ou YYYY-MM-DDTHH:MM:SS"
+        )
+
+async def resolver_consulta(telefone_bruto, data_referencia=None):
+    """
+    Corpo JSON (bytes) da consulta de um telefone: cache, índice e portabilidade
+
+    O cache guarda a resposta já serializada, então um hit não serializa nada.
+    Com data_referencia, a operadora é a vigente naquela data (sem cache).
+    """
+    (telefone, ddd, prefixo, numero), data_referencia = validar_consulta(telefone_bruto, data_referencia)
+
+    if data_referencia is None:
+        corpo = cache_consultas.obter(telefone)
+        if corpo is not None:
+            return corpo
+
+    geracao = cache_consultas.geracao
+
+    try:
+        # Converter número para inteiro para comparar com faixa
+        numero_int = int(numero)
+
+        async with LookupSessionLocal() as session:
+            # Último evento de portabilidade do número (até a data, se informada)
+            if data_referencia is None:
+                portabilidade = await obter_portabilidade(session, telefone)
+            else:
+                portabilidade = await obter_portabilidade_em(session, telefone, data_referencia)
+
+            indice = obter_indice()
+            if indice is None:
+                # Startup sem índice: tenta mapear (ou montar) de novo
+                try:
+                    indice = await run_in_threadpool(preparar_indice)
+                except Exception as e:
+                    print(f"[LOOKUP] Índice de faixas não carregado: {str(e)}", flush=True)
+
+            if indice is not None:
+                # Busca binária no índice em memória
+                faixa = indice.buscar(ddd, prefixo, numero_int)
+                nomes_rn1 = indice.nomes_rn1
+            else:
+                # Índice ainda não carregado: consultar faixa de operadora no banco
+                faixa = await buscar_faixa(session, ddd, prefixo, numero_int)
+                nomes_rn1 = {}
+
+        corpo = montar_resposta(telefone, ddd, prefixo, numero, faixa, portabilidade, nomes_rn1)
+        if data_referencia is None:
+            cache_consultas.guardar(telefone, corpo, geracao)
+
+        return corpo
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar portabilidade: {str(e)}")
+
 @app.post("/consulta", response_model=PortabilidadeResponse)
 async def consultar_portabilidade(dados: TelefoneConsulta):
     """
     Consulta portabilidade de um número de telefone
 
     Formato aceito: DDDNumero (ex: 11987654321)
+
+    - data_referencia (opcional): operadora vigente naquela data/hora; antes
+      do primeiro evento de portabilidade vale a operadora da faixa
+
+    A resposta já sai serializada (app.resposta); response_model fica só
+    para a documentação.
     """
-    # Limpar telefone
-    telefone = dados.telefone.replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
+    return Response(
+        content=await resolver_consulta(dados.telefone, dados.data_referencia),
+        media_type="application/json"
+    )
+
+def etag_consulta():
+    """ETag das consultas: muda a cada geração de dados publicada"""
+    return f'"portabilidade-{geracao_carregada or 0}"'
+
+def etag_confere(if_none_match, etag):
+    """Compara If-None-Match com o ETag atual (comparação fraca, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag
+        for tag in if_none_match.split(",")
+    )
+
+@app.get("/consulta/{telefone}", response_model=PortabilidadeResponse)
+async def consultar_portabilidade_get(telefone: str, request: Request, data_referencia: Optional[str] = None):
+    """
+    Consulta portabilidade via GET (cacheável por proxy/CDN)
 
-    if len(telefone) < 10 or len(telefone) > 11:
-        raise HTTPException(status_code=400, detail="Telefone inválido. Use formato: DDDNumero (ex: 11987654321)")
+    A resposta traz ETag da geração dos dados e Cache-Control com max-age
+    CONSULTA_MAX_AGE. Requisição condicional com If-None-Match igual ao ETag
+    recebe 304 sem passar pelo motor de consulta. Aceita ?data_referencia=
+    como POST /consulta.
+    """
+    etag = etag_consulta()
+    cabecalhos = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CONSULTA_MAX_AGE}"
+    }
 
-    # Extrair componentes
-    ddd = telefone[:2]
+    # Entrada inválida é 400 mesmo com If-None-Match
+    validar_consulta(telefone, data_referencia)
+
+    if etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos)
+
+    return Response(
+        content=await resolver_consulta(telefone, data_referencia),
+        media_type="application/json",
+        headers=cabecalhos
+    )
+
+async def resolver_telefones(telefones):
+    """
+    Resolve uma lista de telefones (mesma ordem da entrada)
+
+    A normalização e a busca no índice rodam no threadpool; a portabilidade
+    de todos os números é buscada de uma vez.
+    """
+    indice = obter_indice()
+    if indice is None:
+        indice = await run_in_threadpool(preparar_indice)
 
-    # Para celular (11 dígitos): prefixo = 4 primeiros após DDD
-    # Para fixo (10 dígitos): prefixo = 3 ou 4 primeiros após DDD
-    if len(telefone) == 11:
-        prefixo = telefone[2:6]  # 9XXXX
-        numero = telefone[6:]    # últimos 4 dígitos
-    else:
-        prefixo = telefone[2:6]  # XXXX
-        numero = telefone[6:]    # últimos 4 dígitos
+    resultados, grupos = await run_in_threadpool(preparar_lote, telefones)
+
+    async with LookupSessionLocal() as session:
+        portabilidades = await obter_portabilidades(session, telefones_do_lote(grupos))
+
+    return await run_in_threadpool(resolver_lote, indice, resultados, grupos, portabilidades)
+
+@app.post("/consulta/lote")
+async def consultar_portabilidade_lote(dados: ConsultaLote):
+    """
+    Consulta portabilidade de uma lista de telefones
+
+    Os resultados são retornados na mesma ordem da lista enviada.
+    Telefones inválidos trazem o campo "erro".
+    """
+    if len(dados.telefones) > CONSULTA_LOTE_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo de {CONSULTA_LOTE_MAX:,} telefones por requisição"
+        )
 
     try:
-        session = SessionLocal()
+        resultados = await resolver_telefones(dados.telefones)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar lote: {str(e)}")
 
-        # Consultar faixa de operadora
-        # Converter número para inteiro para comparar com faixa
-        numero_int = int(numero)
+    return JSONResponse(content={
+        "total": len(resultados),
+        "encontrados": sum(1 for r in resultados if r.get("operadora") not in (None, "Não encontrado")),
+        "resultados": resultados
+    })
 
-        faixa = session.query(FaixaOperadora).filter(
-            FaixaOperadora.ddd == ddd,
-            FaixaOperadora.prefixo == prefixo,
-            FaixaOperadora.faixa_inicio <= numero_int,
-            FaixaOperadora.faixa_fim >= numero_int
-        ).first()
-
-        session.close()
-
-        if not faixa:
-            # Número não encontrado na base
-            return PortabilidadeResponse(
-                telefone=telefone,
-                ddd=ddd,
-                prefixo=prefixo,
-                numero=numero,
-                operadora="Não encontrado",
-                portado=False
-            )
-
-        # Retornar dados da operadora
-        return PortabilidadeResponse(
-            telefone=telefone,
-            ddd=ddd,
-            prefixo=prefixo,
-            numero=numero,
-            operadora=faixa.nome_operadora,
-            sigla_operadora=faixa.sigla_operadora,
-            estado=faixa.estado,
-            tipo_numero=faixa.tipo_numero,
-            portado=True  # Se encontrou na base, pode ter sido portado
+class StreamingDuplexResponse(StreamingResponse):
+    """
+    StreamingResponse que não escuta o receive()
+
+    A StreamingResponse padrão consome as mensagens do receive() para
+    detectar desconexão, o que roubaria os pedaços do corpo da requisição
+    que o gerador ainda está lendo.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+async def resolver_bloco_ndjson(telefones):
+    """Resolve um bloco de telefones e devolve as linhas NDJSON (bytes)"""
+    resultados = await resolver_telefones(telefones)
+
+    return ''.join(
+        json.dumps(resultado, ensure_ascii=False) + '\n' for resultado in resultados
+    ).encode('utf-8')
+
+@app.post("/consulta/stream")
+async def consultar_portabilidade_stream(request: Request):
+    """
+    Consulta portabilidade em streaming
+
+    O corpo é lido aos poucos (um telefone por linha, pode ser chunked) e os
+    resultados voltam em NDJSON, na mesma ordem, à medida que cada bloco de
+    CONSULTA_STREAM_LOTE números é resolvido. A memória usada não depende do
+    tamanho da lista. Linhas com mais de CONSULTA_STREAM_LINHA_MAX bytes são
+    respondidas como inválidas, sem acumular o corpo em memória.
+    """
+    async def gerar():
+        pendentes = []
+        resto = b''
+        descartando = False
+
+        async for pedaco in request.stream():
+            linhas = (resto + pedaco).split(b'\n')
+            resto = linhas.pop()
+
+            if descartando:
+                # Restante da linha longa já respondida
+                if not linhas:
+                    resto = b''
+                    continue
+                linhas[0] = b''
+                descartando = False
+
+            if len(resto) > CONSULTA_STREAM_LINHA_MAX:
+                linhas.append(resto[:CONSULTA_STREAM_LINHA_MAX])
+                resto = b''
+                descartando = True
+
+            for linha in linhas:
+                # Linha longa que veio inteira no pedaço: só o início é ecoado
+                linha = linha[:CONSULTA_STREAM_LINHA_MAX].strip()
+                if linha:
+                    pendentes.append(linha.decode('utf-8', errors='replace'))
+
+            if len(pendentes) >= CONSULTA_STREAM_LOTE:
+                yield await resolver_bloco_ndjson(pendentes)
+                pendentes = []
+
+        resto = resto.strip()
+        if resto:
+            pendentes.append(resto.decode('utf-8', errors='replace'))
+
+        if pendentes:
+            yield await resolver_bloco_ndjson(pendentes)
+
+    return StreamingDuplexResponse(gerar(), media_type="application/x-ndjson")
+
+@app.post("/jobs/classificacao")
+async def criar_job_classificacao(
+    arquivo: UploadFile = File(...),
+    coluna: int = Form(0),
+    cabecalho: bool = Form(True),
+    delimitador: str = Form(",")
+):
+    """
+    Cria um job de classificação de um arquivo CSV (ou .csv.gz)
+
+    - coluna: índice (a partir de 0) da coluna com o telefone
+    - cabecalho: se a primeira linha é cabeçalho
+    - delimitador: separador de campos
+
+    O resultado é o mesmo CSV com as colunas operadora, rn1 e portado.
+    """
+    if coluna < 0 or len(delimitador) != 1:
+        raise HTTPException(status_code=400, detail="Parâmetros inválidos: coluna >= 0 e delimitador de 1 caractere")
+
+    try:
+        job = await run_in_threadpool(
+            jobs.criar_job, arquivo.file, arquivo.filename, coluna, cabecalho, delimitador
         )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao criar job: {str(e)}")
+    finally:
+        await arquivo.close()
+
+    return {
+        "status": "started",
+        "job": job,
+        "message": f"Job criado. Use GET /jobs/{job['id']} para acompanhar progresso."
+    }
 
+@app.get("/jobs/{job_id}")
+async def status_job_classificacao(job_id: str):
+    """Retorna o status de um job de classificação"""
+    job = jobs.ler_job(job_id) if job_id.isalnum() else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+@app.get("/jobs/{job_id}/resultado")
+async def resultado_job_classificacao(job_id: str):
+    """Baixa o CSV classificado (gzip) de um job concluído"""
+    job = jobs.ler_job(job_id) if job_id.isalnum() else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job["status"] != jobs.STATUS_CONCLUIDO:
+        raise HTTPException(status_code=409, detail=f"Job ainda não concluído (status: {job['status']})")
+
+    nome = os.path.splitext(os.path.basename(job.get("arquivo") or "resultado"))[0]
+    if nome.endswith('.csv'):
+        nome = nome[:-4]
+    return FileResponse(
+        job["resultado"],
+        media_type="application/gzip",
+        filename=f"{nome}_classificado.csv.gz"
+    )
+
+@app.get("/historico/{telefone}", response_model=HistoricoResponse)
+async def historico_telefone(telefone: str):
+    """
+    Todos os eventos de portabilidade de um número, em ordem cronológica
+
+    Servido pelo índice (telefone, data_atualizacao_ts).
+    """
+    try:
+        telefone = normalizar_telefone(telefone)[0]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        async with LookupSessionLocal() as session:
+            eventos = await buscar_historico(session, telefone)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar portabilidade: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar histórico: {str(e)}")
+
+    # Nomes das operadoras pela dimensão em memória (sem JOIN no banco)
+    dimensao = obter_dimensao()
+    indice = obter_indice()
+    nomes_rn1 = indice.nomes_rn1 if indice is not None else {}
+
+    for evento in eventos:
+        evento["operadora"] = nomes_rn1.get(evento["rn1"])
+        if dimensao is not None:
+            destino = dimensao.por_codigo('rn1', evento["rn1"]) or dimensao.por_codigo('spid', evento["spid_destino"])
+            origem = dimensao.por_codigo('spid', evento["spid_origem"])
+            if destino is not None:
+                evento["operadora"] = destino["nome"]
+            if origem is not None:
+                evento["operadora_origem"] = origem["nome"]
+
+    return HistoricoResponse(telefone=telefone, total_eventos=len(eventos), eventos=eventos)
+
+def interpretar_mes(texto, parametro):
+    """'YYYY-MM' -> date do primeiro dia do mês (HTTP 400 se inválido)"""
+    try:
+        return datetime.strptime(texto.strip(), '%Y-%m').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{parametro} inválido (use YYYY-MM)")
+
+def spids_da_operadora(codigo):
+    """SPIDs de uma operadora informada por SPID, RN1, EOT ou CNPJ"""
+    dimensao = obter_dimensao()
+    operadora = dimensao.buscar(codigo) if dimensao is not None else None
+    if operadora is not None and operadora["spids"]:
+        return operadora["spids"]
+    return [normalizar_codigo('spid', codigo)]
+
+@app.get("/stats/portabilidade")
+async def stats_portabilidade(
+    agrupar: str = "mes",
+    mes_inicio: Optional[str] = None,
+    mes_fim: Optional[str] = None,
+    origem: Optional[str] = None,
+    destino: Optional[str] = None,
+    ddd: Optional[str] = None
+):
+    """
+    Contagens de portabilidade por mês, operadora de origem/destino e DDD
+
+    Lê só o rollup pré-agregado (portabilidade_rollup), sem varrer o histórico.
+    agrupar: colunas separadas por vírgula entre mes, spid_origem, spid_destino, ddd.
+    origem/destino: SPID, RN1, EOT ou CNPJ (todos os SPIDs da operadora contam).
+    Ex: ganhos da operadora X no mês: ?destino=X&mes_inicio=2024-05&mes_fim=2024-05
+    """
+    colunas = [coluna.strip() for coluna in agrupar.split(',') if coluna.strip()]
+    invalidas = [coluna for coluna in colunas if coluna not in DIMENSOES_ROLLUP]
+    if invalidas:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Agrupamento inválido: {', '.join(invalidas)} (use {', '.join(DIMENSOES_ROLLUP)})"
+        )
+
+    filtros = {
+        "mes_inicio": interpretar_mes(mes_inicio, "mes_inicio") if mes_inicio else None,
+        "mes_fim": interpretar_mes(mes_fim, "mes_fim") if mes_fim else None,
+        "spids_origem": spids_da_operadora(origem) if origem else None,
+        "spids_destino": spids_da_operadora(destino) if destino else None,
+        "ddd": ddd.strip() if ddd else None
+    }
+
+    try:
+        async with LookupSessionLocal() as session:
+            linhas = await buscar_rollup(session, colunas, **filtros)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar rollup: {str(e)}")
+
+    # Nomes das operadoras pela dimensão em memória
+    dimensao = obter_dimensao()
+    if dimensao is not None:
+        for linha in linhas:
+            for coluna in ('spid_origem', 'spid_destino'):
+                if coluna in linha:
+                    operadora = dimensao.por_codigo('spid', linha[coluna])
+                    linha[coluna.replace('spid', 'operadora')] = operadora["nome"] if operadora else None
+
+    return {
+        "agrupamento": [coluna for coluna in DIMENSOES_ROLLUP if coluna in colunas],
+        "filtros": {
+            "mes_inicio": mes_inicio,
+            "mes_fim": mes_fim,
+            "spids_origem": filtros["spids_origem"],
+            "spids_destino": filtros["spids_destino"],
+            "ddd": filtros["ddd"]
+        },
+        "total": sum(linha["quantidade"] for linha in linhas),
+        "linhas": linhas
+    }
+
+@app.get("/operadoras/{codigo}")
+async def operadora_por_codigo(codigo: str):
+    """
+    Registro completo de uma operadora por RN1, SPID, EOT ou CNPJ
+
+    Nomes, CNPJs e todos os códigos da mesma operadora (dimensão em memória).
+    """
+    dimensao = obter_dimensao()
+    if dimensao is None:
+        raise HTTPException(status_code=503, detail="Dimensão de operadoras não carregada")
+
+    operadora = dimensao.buscar(codigo)
+    if operadora is None:
+        raise HTTPException(status_code=404, detail="Operadora não encontrada")
+    return operadora
 
 def executar_importacao(test_mode: bool = False):
     """Executa importação em background"""
@@ -236,6 +837,10 @@ def executar_importacao(test_mode: bool = False):
         import_status["last_status"] = "success" if result.returncode == 0 else "error"
         import_status["message"] = result.stdout if result.returncode == 0 else result.stderr
 
+        # O importador publica o novo índice; trocar já neste worker
+        if result.returncode == 0:
+            sincronizar_geracao()
+
     except subprocess.TimeoutExpired:
         import_status["running"] = False
         import_status["last_run"] = "timeout"
@@ -346,30 +951,35 @@ async def reboot_system(request: RebootRequest, background_tasks: BackgroundTask
     }
 
 # Importação Histórica (51M registros)
-def get_historico_status() -> Dict[str, Any]:
+def processo_importacao_historico():
+    """Procura o processo de importação histórica: (pid, create_time) ou None"""
+    for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
+        try:
+            cmdline = ' '.join(proc.info['cmdline'] or [])
+            if 'import_chunks_smart.py' in cmdline or 'import_historico_auto.sh' in cmdline:
+                return proc.info['pid'], proc.info['create_time']
+        except:
+            pass
+    return None
+
+async def get_historico_status() -> Dict[str, Any]:
     """Obtém status da importação histórica"""
-    try:
-        session = SessionLocal()
+    session = AsyncSessionLocal()
 
+    try:
         # Contar registros
-        count_result = session.execute(text("SELECT COUNT(*) FROM portabilidade_historico"))
+        count_result = await session.execute(text("SELECT COUNT(*) FROM portabilidade_historico"))
         current_count = count_result.fetchone()[0]
 
-        # Verificar se processo está rodando
+        # Verificar se processo está rodando (varredura de processos fora do event loop)
         import_running = False
         import_pid = None
         start_time = None
 
-        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
-            try:
-                cmdline = ' '.join(proc.info['cmdline'] or [])
-                if 'import_chunks_smart.py' in cmdline or 'import_historico_auto.sh' in cmdline:
-                    import_running = True
-                    import_pid = proc.info['pid']
-                    start_time = proc.info['create_time']
-                    break
-            except:
-                pass
+        processo = await run_in_threadpool(processo_importacao_historico)
+        if processo is not None:
+            import_running = True
+            import_pid, start_time = processo
 
         # Verificar arquivo de chunks
         chunks_info = {}
@@ -385,23 +995,23 @@ def get_historico_status() -> Dict[str, Any]:
         speed = 0
         try:
             # Criar tabela temporária se não existir
-            session.execute(text("""
+            await session.execute(text("""
                 CREATE TABLE IF NOT EXISTS import_stats (
                     id SERIAL PRIMARY KEY,
                     record_count BIGINT,
                     timestamp TIMESTAMP DEFAULT NOW()
                 )
             """))
-            session.commit()
+            await session.commit()
 
             # Salvar contagem atual
-            session.execute(text("""
+            await session.execute(text("""
                 INSERT INTO import_stats (record_count) VALUES (:count)
             """), {"count": current_count})
-            session.commit()
+            await session.commit()
 
             # Obter contagem de 30 segundos atrás
-            result = session.execute(text("""
+            result = await session.execute(text("""
                 SELECT record_count, EXTRACT(EPOCH FROM (NOW() - timestamp)) as seconds_ago
                 FROM import_stats
                 WHERE timestamp > NOW() - INTERVAL '60 seconds'
@@ -416,16 +1026,16 @@ def get_historico_status() -> Dict[str, Any]:
                 speed = int(records_diff / time_diff) if time_diff > 0 else 0
 
             # Limpar registros antigos
-            session.execute(text("""
+            await session.execute(text("""
                 DELETE FROM import_stats
                 WHERE timestamp < NOW() - INTERVAL '5 minutes'
             """))
-            session.commit()
+            await session.commit()
 
         except:
-            pass
+            await session.rollback()
 
-        session.close()
+        await session.close()
 
         # Calcular progresso
         TOTAL_EXPECTED = 51618684
@@ -455,6 +1065,7 @@ def get_historico_status() -> Dict[str, Any]:
         }
 
     except Exception as e:
+        await session.close()
         return {
             'error': str(e),
             'running': False,
@@ -466,22 +1077,30 @@ def get_historico_status() -> Dict[str, Any]:
         }
 
 @app.post("/import/historico")
-async def import_historico(background_tasks: BackgroundTasks):
+async def import_historico(background_tasks: BackgroundTasks, recarregar: bool = False):
     """
     Inicia importação dos 51M registros históricos
+
+    Com recarregar=true, baixa o export atual e o carrega em uma tabela
+    sombra que substitui a atual no fim; as consultas seguem na base
+    anterior durante a carga.
     """
-    status = get_historico_status()
+    status = await get_historico_status()
 
     if status.get('running'):
         raise HTTPException(status_code=409, detail="Importação histórica já está em execução")
 
-    if status.get('completed'):
+    if status.get('completed') and not recarregar:
         raise HTTPException(status_code=400, detail="Importação histórica já foi concluída")
 
     # Executar em background
     def run_import():
         subprocess.run(["/app/import_historico_auto.sh"],
-                      env={**os.environ, 'AUTO_IMPORT_HISTORICO': 'true'})
+                      env={**os.environ, 'AUTO_IMPORT_HISTORICO': 'true',
+                           'IMPORT_RELOAD': 'true' if recarregar else 'false'})
+
+        # Mapear o snapshot e o filtro publicados pelo importador
+        sincronizar_geracao()
 
     background_tasks.add_task(run_import)
 
@@ -497,10 +1116,7 @@ async def reset_import_historico():
     """
     Reseta a importação histórica (limpa tabela e arquivos)
     """
-    try:
-        session = SessionLocal()
-
-        # Verificar se tem processo rodando
+    def terminar_processos():
         for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
             try:
                 cmdline = ' '.join(proc.info['cmdline'] or [])
@@ -509,10 +1125,26 @@ async def reset_import_historico():
             except:
                 pass
 
+    session = AsyncSessionLocal()
+
+    try:
+        # Verificar se tem processo rodando
+        await run_in_threadpool(terminar_processos)
+
         # Limpar tabela
-        session.execute(text("TRUNCATE TABLE portabilidade_historico"))
-        session.execute(text("DROP TABLE IF EXISTS import_stats"))
-        session.commit()
+        await session.execute(text("TRUNCATE TABLE portabilidade_historico"))
+        # Estado atual é derivado do histórico apagado
+        await session.execute(text("TRUNCATE TABLE portabilidade_atual"))
+        await session.execute(text("DROP TABLE IF EXISTS import_stats"))
+        # Rollups derivados do histórico apagado
+        await session.execute(text("DROP TABLE IF EXISTS portabilidade_rollup, rollup_controle"))
+        # Checkpoints de retomada apontam para linhas que não existem mais
+        await session.execute(text("DROP TABLE IF EXISTS import_checkpoint"))
+        # Tabela sombra de uma recarga interrompida
+        await session.execute(text("DROP SCHEMA IF EXISTS carga_historico CASCADE"))
+        await session.commit()
+
+        await session.close()
 
         # Limpar arquivos
         import shutil
@@ -533,13 +1165,22 @@ async def reset_import_historico():
             if os.path.exists(gz_path):
                 os.remove(gz_path)
 
-        session.close()
+        # Remover snapshot e filtro e publicar nova geração para os workers os descartarem
+        for caminho in [SNAPSHOT_PATH, BLOOM_PATH]:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+        await run_in_threadpool(publicar_geracao)
+        await run_in_threadpool(sincronizar_geracao)
 
         return {
             "status": "success",
             "message": "Importação resetada com sucesso",
             "actions": [
                 "Tabela portabilidade_historico limpa",
+                "Rollups de portabilidade removidos",
+                "Tabela portabilidade_atual, snapshot e filtro removidos",
+                "Checkpoints de importação removidos",
                 "Arquivos CSV removidos",
                 "Chunks temporários removidos",
                 "Processos de importação terminados"
@@ -547,17 +1188,18 @@ async def reset_import_historico():
         }
 
     except Exception as e:
+        await session.close()
         raise HTTPException(status_code=500, detail=f"Erro ao resetar: {str(e)}")
 
 @app.get("/import/historico/status")
 async def import_historico_status():
     """Retorna status da importação histórica em JSON"""
-    return get_historico_status()
+    return await get_historico_status()
 
 @app.get("/import/historico/reset-page", response_class=HTMLResponse)
 async def import_historico_reset_page():
     """Página dedicada para reset da importação"""
-    status = get_historico_status()
+    status = await get_historico_status()
 
     html_content = f"""
     <!DOCTYPE html>
@@ -733,7 +1375,7 @@ async def import_historico_reset_page():
 @app.get("/import/historico/progress", response_class=HTMLResponse)
 async def import_historico_progress():
     """Página web com progresso visual da importação"""
-    status = get_historico_status()
+    status = await get_historico_status()
 
     html_content = f"""
     <!DOCTYPE html>
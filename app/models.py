@@ -1,6 +1,11 @@
 from sqlalchemy import Column, Integer, String, Text, Index, DateTime, BigInteger
+from sqlalchemy.dialects.postgresql import INT8RANGE
 from app.database import Base
 
+# Colunas devolvidas por /consulta: incluídas no índice de faixa_numero para
+# a consulta ser index-only scan
+FAIXA_COLUNAS_COBERTAS = ['nome_operadora', 'sigla_operadora', 'estado', 'tipo_numero']
+
 class FaixaOperadora(Base):
     __tablename__ = "faixa_operadora"
 
@@ -15,12 +20,20 @@ class FaixaOperadora(Base):
     sigla_operadora = Column(String(10))
     estado = Column(String(2), index=True)  # Índice para consultas por estado
     codigo_regiao = Column(String(10))
+    # [ddd+prefixo+faixa_inicio, ddd+prefixo+faixa_fim] como número nacional
+    # (lookup.numero_nacional). Preenchida na importação, que recria o índice
+    # como exclusion constraint quando não há sobreposição
+    # (import_data.preparar_faixa_numero)
+    faixa_numero = Column(INT8RANGE)
 
     __table_args__ = (
         # Índice composto para consulta de portabilidade (DDD + Prefixo + Faixa)
         Index('idx_ddd_prefixo_faixa', 'ddd', 'prefixo', 'faixa_inicio', 'faixa_fim'),
         # Índice para consulta por operadora
         Index('idx_sigla_operadora', 'sigla_operadora'),
+        # GiST de cobertura para a sonda de contenção (lookup.SQL_FAIXA)
+        Index('idx_faixa_numero', 'faixa_numero', postgresql_using='gist',
+              postgresql_include=FAIXA_COLUNAS_COBERTAS),
     )
 
 
@@ -82,9 +95,24 @@ class PortabilidadeHistorico(Base):
     flag_7 = Column(BigInteger)  # Campo 17
     flag_8 = Column(BigInteger)  # Campo 18
     data_nula_2 = Column(String(50))  # Campo 19
+    # Datas tipadas (derivadas de data_criacao/data_atualizacao na importação)
+    data_criacao_ts = Column(DateTime)
+    data_atualizacao_ts = Column(DateTime)
 
     __table_args__ = (
         Index('idx_telefone', 'telefone'),
+        # Linha do tempo de um número em ordem cronológica (GET /historico)
+        Index('idx_historico_telefone_data', 'telefone', 'data_atualizacao_ts'),
         Index('idx_spid_origem', 'spid_origem'),
         Index('idx_codigo_completo', 'codigo_completo'),
     )
+
+
+class PortabilidadeAtual(Base):
+    """Estado mais recente de cada número portado (derivado de portabilidade_historico)"""
+    __tablename__ = "portabilidade_atual"
+
+    telefone = Column(BigInteger, primary_key=True)  # Número completo (DDD + número)
+    spid_destino = Column(String(10))
+    codigo_completo = Column(String(10))  # RN1 da operadora atual
+    data_atualizacao = Column(String(50))  # Data do último evento de portabilidade
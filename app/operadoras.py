@@ -0,0 +1,232 @@
+"""
+Dimensão de operadoras: RN1, SPID, EOT e CNPJ de uma mesma operadora
+
+operadoras_rn1 (rn1_prefixo, cnpj) e operadoras_stfc (eot, rn1, spid, cnpj)
+são unidas uma única vez, na importação: códigos que aparecem na mesma linha
+ou compartilham CNPJ pertencem à mesma operadora. O resultado é gravado em
+OPERADORAS_PATH (JSON, poucos milhares de operadoras) e cada worker o mantém
+em memória como dicts código -> operadora, sem ida ao banco por consulta.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+
+from app.database import SessionLocal
+from app.models import OperadoraRN1, OperadoraSTFC
+
+OPERADORAS_PATH = os.getenv("OPERADORAS_PATH", "/app/data/operadoras.json")
+
+# Tipos de código indexados na dimensão
+TIPOS_CODIGO = ('rn1', 'spid', 'eot', 'cnpj')
+
+
+def normalizar_codigo(tipo, valor):
+    """Normaliza um código para comparação ('' se vazio)"""
+    valor = (valor or '').strip()
+    if tipo == 'cnpj':
+        return ''.join(c for c in valor if c.isdigit())
+    if tipo == 'spid' and valor.isdigit():
+        # O histórico usa SPID com 4 dígitos
+        return valor.zfill(4)
+    return valor
+
+
+class _Uniao:
+    """Union-find simples sobre chaves (tipo, código)"""
+
+    def __init__(self):
+        self.pai = {}
+
+    def raiz(self, chave):
+        self.pai.setdefault(chave, chave)
+        while self.pai[chave] != chave:
+            self.pai[chave] = self.pai[self.pai[chave]]
+            chave = self.pai[chave]
+        return chave
+
+    def unir(self, chaves):
+        chaves = list(chaves)
+        for chave in chaves[1:]:
+            self.pai[self.raiz(chave)] = self.raiz(chaves[0])
+
+
+def montar_operadoras(linhas_rn1, linhas_stfc):
+    """
+    Agrupa os códigos por operadora
+
+    linhas_rn1: (nome_operadora, cnpj, rn1_prefixo)
+    linhas_stfc: (nome_fantasia, razao_social, holding, cnpj, rn1, spid, eot)
+    Retorna a lista de operadoras (dicts), com id sequencial.
+    """
+    uniao = _Uniao()
+    registros = []
+
+    for nome, cnpj, rn1 in linhas_rn1:
+        codigos = {'cnpj': cnpj, 'rn1': rn1}
+        registros.append(({'nome': nome}, codigos))
+
+    for nome_fantasia, razao_social, holding, cnpj, rn1, spid, eot in linhas_stfc:
+        codigos = {'cnpj': cnpj, 'rn1': rn1, 'spid': spid, 'eot': eot}
+        registros.append(({
+            'nome_fantasia': nome_fantasia,
+            'razao_social': razao_social,
+            'holding': holding
+        }, codigos))
+
+    chaves_por_registro = []
+    for _, codigos in registros:
+        chaves = [
+            (tipo, codigo)
+            for tipo in TIPOS_CODIGO
+            for codigo in [normalizar_codigo(tipo, codigos.get(tipo))]
+            if codigo
+        ]
+        if chaves:
+            uniao.unir(chaves)
+        chaves_por_registro.append(chaves)
+
+    grupos = {}
+    for (dados, _), chaves in zip(registros, chaves_por_registro):
+        if not chaves:
+            continue
+        grupo = grupos.setdefault(uniao.raiz(chaves[0]), {
+            'nomes': [], 'nomes_fantasia': [], 'razoes_sociais': [], 'holdings': [],
+            **{tipo: set() for tipo in TIPOS_CODIGO}
+        })
+        for tipo, codigo in chaves:
+            grupo[tipo].add(codigo)
+        for campo, lista in (('nome', 'nomes'), ('nome_fantasia', 'nomes_fantasia'),
+                             ('razao_social', 'razoes_sociais'), ('holding', 'holdings')):
+            valor = (dados.get(campo) or '').strip()
+            if valor and valor not in grupo[lista]:
+                grupo[lista].append(valor)
+
+    operadoras = []
+    # Ordem estável entre importações: pelo menor código de cada operadora
+    for grupo in sorted(grupos.values(), key=lambda g: min(g['cnpj'] or g['rn1'] or g['spid'] or g['eot'])):
+        nome = next(iter(grupo['nomes'] + grupo['nomes_fantasia'] + grupo['razoes_sociais']), None)
+        operadoras.append({
+            'id': len(operadoras) + 1,
+            'nome': nome,
+            'razao_social': next(iter(grupo['razoes_sociais']), None),
+            'nome_fantasia': next(iter(grupo['nomes_fantasia']), None),
+            'holding': next(iter(grupo['holdings']), None),
+            'cnpjs': sorted(grupo['cnpj']),
+            'rn1s': sorted(grupo['rn1']),
+            'spids': sorted(grupo['spid']),
+            'eots': sorted(grupo['eot'])
+        })
+
+    return operadoras
+
+
+def gerar_dimensao(session, caminho=OPERADORAS_PATH):
+    """Monta a dimensão a partir do banco e grava o JSON (os.replace)"""
+    inicio = time.time()
+    linhas_rn1 = session.query(
+        OperadoraRN1.nome_operadora, OperadoraRN1.cnpj, OperadoraRN1.rn1_prefixo
+    ).all()
+    linhas_stfc = session.query(
+        OperadoraSTFC.nome_fantasia, OperadoraSTFC.razao_social, OperadoraSTFC.holding,
+        OperadoraSTFC.cnpj, OperadoraSTFC.rn1, OperadoraSTFC.spid, OperadoraSTFC.eot
+    ).all()
+
+    operadoras = montar_operadoras(linhas_rn1, linhas_stfc)
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump({"gerado_em": int(time.time()), "operadoras": operadoras}, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+    print(f"[OPERADORAS] ✓ Dimensão gravada: {len(operadoras):,} operadoras "
+          f"em {time.time() - inicio:.1f}s", flush=True)
+    return len(operadoras)
+
+
+class DimensaoOperadoras:
+    """Operadoras em memória, indexadas por RN1, SPID, EOT e CNPJ"""
+
+    def __init__(self, operadoras):
+        self.operadoras = operadoras
+        self.por_id = {operadora['id']: operadora for operadora in operadoras}
+        self._indices = {tipo: {} for tipo in TIPOS_CODIGO}
+
+        for operadora in operadoras:
+            for tipo in TIPOS_CODIGO:
+                for codigo in operadora[tipo + 's']:
+                    self._indices[tipo].setdefault(codigo, operadora)
+
+    @classmethod
+    def abrir(cls, caminho=OPERADORAS_PATH):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["operadoras"])
+
+    def por_codigo(self, tipo, codigo):
+        """Operadora (dict) pelo código de um tipo, ou None"""
+        return self._indices[tipo].get(normalizar_codigo(tipo, codigo))
+
+    def buscar(self, codigo):
+        """Operadora por qualquer código (RN1, SPID, EOT ou CNPJ)"""
+        for tipo in TIPOS_CODIGO:
+            operadora = self.por_codigo(tipo, codigo)
+            if operadora is not None:
+                return operadora
+        return None
+
+    def estatisticas(self):
+        return {
+            "operadoras": len(self.operadoras),
+            **{f"codigos_{tipo}": len(indice) for tipo, indice in self._indices.items()}
+        }
+
+
+# Dimensão ativa do processo (None se o arquivo não existe)
+_dimensao = None
+_lock_carga = threading.Lock()
+
+
+def obter_dimensao():
+    """Retorna a dimensão ativa (None se não carregada)"""
+    return _dimensao
+
+
+def carregar_dimensao(caminho=OPERADORAS_PATH):
+    """Lê a dimensão do disco e troca a ativa"""
+    global _dimensao
+
+    if not os.path.exists(caminho):
+        print(f"[OPERADORAS] Arquivo não encontrado: {caminho}", flush=True)
+        return None
+
+    with _lock_carga:
+        nova = DimensaoOperadoras.abrir(caminho)
+        _dimensao = nova
+
+    print(f"[OPERADORAS] Carregada: {len(nova.operadoras):,} operadoras", flush=True)
+    return nova
+
+
+def preparar_dimensao(caminho=OPERADORAS_PATH):
+    """
+    Carrega a dimensão; se ainda não existe, monta a partir do banco
+
+    Como em lookup.preparar_indice, um lock de arquivo garante que só um
+    worker grava o JSON; os demais esperam e leem o mesmo arquivo.
+    """
+    if not os.path.exists(caminho):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        with open(caminho + '.lock', 'w') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            if not os.path.exists(caminho):
+                session = SessionLocal()
+                try:
+                    gerar_dimensao(session, caminho)
+                finally:
+                    session.close()
+
+    return carregar_dimensao(caminho)
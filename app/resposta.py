@@ -0,0 +1,94 @@
+"""
+Montagem e serialização rápida das respostas de consulta
+
+/consulta, /consulta/lote e /consulta/stream usam as mesmas regras e os
+mesmos campos (todos sempre presentes, na ordem de PortabilidadeResponse).
+
+Os campos da operadora (nome, sigla, estado, tipo) se repetem entre milhões
+de números: cada combinação é serializada uma única vez com orjson e
+guardada como fragmento JSON. A resposta de /consulta é só a concatenação
+dos campos do número (dígitos já validados) com o fragmento da operadora,
+sem passar pelo modelo Pydantic nem pelo encoder padrão do FastAPI.
+"""
+from functools import lru_cache
+
+import orjson
+
+from app.operadoras import obter_dimensao
+
+_NAO_ENCONTRADO = "Não encontrado"
+
+# Campos da operadora, na ordem da resposta
+CAMPOS_OPERADORA = ("operadora", "sigla_operadora", "portado", "estado", "tipo_numero", "rn1")
+
+
+def nome_portado(portabilidade, nomes_rn1):
+    """
+    Nome da operadora de destino de um número portado
+
+    Pelo RN1 quando o evento tem; senão pelo SPID na dimensão de operadoras.
+    Nunca usa a operadora da faixa, que é a de origem.
+    """
+    rn1 = (portabilidade.codigo_completo or '').strip()
+    if rn1:
+        return nomes_rn1.get(rn1, rn1)
+
+    dimensao = obter_dimensao()
+    if dimensao is not None and portabilidade.spid_destino:
+        operadora = dimensao.por_codigo('spid', portabilidade.spid_destino)
+        if operadora is not None and operadora['nome']:
+            return operadora['nome']
+
+    return _NAO_ENCONTRADO
+
+
+def valores_operadora(faixa, portabilidade, nomes_rn1):
+    """
+    Valores de CAMPOS_OPERADORA de uma consulta (tupla)
+
+    Com evento de portabilidade, a operadora é a de destino (RN1 ou SPID) e
+    estado/tipo vêm da faixa. Sem evento, vale a operadora original da faixa.
+    """
+    estado = faixa.estado if faixa is not None else None
+    tipo_numero = faixa.tipo_numero if faixa is not None else None
+
+    if portabilidade is not None:
+        rn1 = (portabilidade.codigo_completo or '').strip()
+        # Sigla da faixa é da operadora original
+        return (nome_portado(portabilidade, nomes_rn1), None, True, estado, tipo_numero, rn1 or None)
+
+    if faixa is None:
+        return (_NAO_ENCONTRADO, None, False, None, None, None)
+
+    return (faixa.nome_operadora, faixa.sigla_operadora, False, estado, tipo_numero, None)
+
+
+@lru_cache(maxsize=16384)
+def fragmento_operadora(valores):
+    """Campos da operadora serializados como fragmento JSON (sem as chaves externas)"""
+    return orjson.dumps(dict(zip(CAMPOS_OPERADORA, valores)))[1:-1]
+
+
+def montar_resultado(telefone, ddd, prefixo, numero, faixa, portabilidade, nomes_rn1):
+    """Resultado de uma consulta (dict no formato de PortabilidadeResponse)"""
+    return {
+        "telefone": telefone,
+        **dict(zip(CAMPOS_OPERADORA, valores_operadora(faixa, portabilidade, nomes_rn1))),
+        "ddd": ddd,
+        "prefixo": prefixo,
+        "numero": numero
+    }
+
+
+def montar_resposta(telefone, ddd, prefixo, numero, faixa, portabilidade, nomes_rn1):
+    """
+    Corpo JSON (bytes) da consulta de um telefone normalizado
+
+    Mesmo conteúdo de orjson.dumps(montar_resultado(...)).
+    """
+    operadora = fragmento_operadora(valores_operadora(faixa, portabilidade, nomes_rn1))
+
+    # telefone, ddd, prefixo e numero são só dígitos (normalizar_telefone)
+    return b'{"telefone":"%s",%s,"ddd":"%s","prefixo":"%s","numero":"%s"}' % (
+        telefone.encode(), operadora, ddd.encode(), prefixo.encode(), numero.encode()
+    )
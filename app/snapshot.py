@@ -0,0 +1,205 @@
+"""
+Snapshot binário de portabilidade_atual, lido via mmap
+
+Formato do arquivo (little-endian):
+    cabeçalho (32 bytes): magic 'PORTAB01', quantidade (uint64),
+                          gerado_em (int64, epoch), reservado (8 bytes)
+    telefones: int64[quantidade], ordenados
+    codigos:   uint16[quantidade], paralelo a telefones
+
+O código é o RN1 (codigo_completo, 55xxx) quando numérico; senão o SPID de
+destino (4 dígitos). 0 = desconhecido. Cerca de 10 bytes por número.
+
+O arquivo é aberto somente leitura com mmap, então vários workers do uvicorn
+compartilham as mesmas páginas do page cache.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from app.lookup import Portabilidade
+
+SNAPSHOT_PATH = os.getenv("PORTABILIDADE_SNAPSHOT", "/app/data/portabilidade_atual.bin")
+
+MAGIC = b'PORTAB01'
+CABECALHO = struct.Struct('<8sQq8x')
+
+# RN1 começa em 55000; SPID tem 4 dígitos
+_LIMITE_SPID = 10000
+
+
+def codificar_operadora(codigo_completo, spid_destino):
+    """Converte codigo_completo/spid_destino para o código uint16 do snapshot"""
+    for valor in (codigo_completo, spid_destino):
+        valor = (valor or '').strip()
+        if valor.isdigit() and 0 < int(valor) <= 0xFFFF:
+            return int(valor)
+    return 0
+
+
+def decodificar_operadora(codigo):
+    """Converte o código uint16 de volta para Portabilidade"""
+    if codigo >= _LIMITE_SPID:
+        return Portabilidade(str(codigo), None)
+    if codigo > 0:
+        return Portabilidade(None, f"{codigo:04d}")
+    return Portabilidade(None, None)
+
+
+def gerar_snapshot(conn, caminho=SNAPSHOT_PATH, lote=100000):
+    """
+    Gera o snapshot a partir de portabilidade_atual
+
+    Lê a tabela em ordem de telefone com cursor do lado do servidor e grava
+    em arquivo temporário, trocado por os.replace no final.
+    Retorna a quantidade de telefones gravados.
+    """
+    inicio = time.time()
+    print(f"[SNAPSHOT] Gerando {caminho}...", flush=True)
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    temporario = caminho + '.tmp'
+    temporario_codigos = caminho + '.codigos.tmp'
+
+    cursor = conn.cursor(name='snapshot_portabilidade')
+    cursor.itersize = lote
+    cursor.execute("""
+        SELECT telefone, codigo_completo, spid_destino
+        FROM portabilidade_atual
+        ORDER BY telefone
+    """)
+
+    total = 0
+    with open(temporario, 'wb') as f_telefones, open(temporario_codigos, 'wb') as f_codigos:
+        f_telefones.write(CABECALHO.pack(MAGIC, 0, 0))
+
+        while True:
+            linhas = cursor.fetchmany(lote)
+            if not linhas:
+                break
+
+            telefones = array('q', (linha[0] for linha in linhas))
+            codigos = array('H', (codificar_operadora(linha[1], linha[2]) for linha in linhas))
+            telefones.tofile(f_telefones)
+            codigos.tofile(f_codigos)
+            total += len(linhas)
+
+    cursor.close()
+    conn.commit()
+
+    # Anexar os códigos depois dos telefones e gravar o cabeçalho final
+    with open(temporario, 'r+b') as f_telefones:
+        f_telefones.seek(0, os.SEEK_END)
+        with open(temporario_codigos, 'rb') as f_codigos:
+            while True:
+                bloco = f_codigos.read(1024 * 1024)
+                if not bloco:
+                    break
+                f_telefones.write(bloco)
+
+        f_telefones.seek(0)
+        f_telefones.write(CABECALHO.pack(MAGIC, total, int(time.time())))
+        f_telefones.flush()
+        os.fsync(f_telefones.fileno())
+
+    os.remove(temporario_codigos)
+    os.replace(temporario, caminho)
+
+    tamanho = os.path.getsize(caminho) / 1024 / 1024
+    print(f"[SNAPSHOT] ✓ {total:,} telefones ({tamanho:,.1f} MB) "
+          f"em {time.time() - inicio:.1f}s", flush=True)
+    return total
+
+
+class SnapshotPortabilidade:
+    """Snapshot mapeado em memória (somente leitura)"""
+
+    def __init__(self, caminho=SNAPSHOT_PATH):
+        self.caminho = caminho
+
+        with open(caminho, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, quantidade, gerado_em = CABECALHO.unpack_from(self._mmap, 0)
+        esperado = CABECALHO.size + quantidade * 10
+        if magic != MAGIC or len(self._mmap) != esperado:
+            self._mmap.close()
+            raise ValueError(f"Snapshot inválido: {caminho}")
+
+        self.quantidade = quantidade
+        self.gerado_em = gerado_em
+
+        fim_telefones = CABECALHO.size + quantidade * 8
+        visao = memoryview(self._mmap)
+        self._telefones = visao[CABECALHO.size:fim_telefones].cast('q')
+        self._codigos = visao[fim_telefones:].cast('H')
+
+    def buscar(self, telefone):
+        """Portabilidade atual do telefone (int) ou None"""
+        telefones = self._telefones
+        i = bisect_left(telefones, telefone)
+        if i < self.quantidade and telefones[i] == telefone:
+            return decodificar_operadora(self._codigos[i])
+        return None
+
+    def buscar_varios(self, telefones):
+        """{telefone: Portabilidade} para os telefones encontrados"""
+        encontrados = {}
+        for telefone in telefones:
+            portabilidade = self.buscar(telefone)
+            if portabilidade is not None:
+                encontrados[telefone] = portabilidade
+        return encontrados
+
+
+# Snapshot ativo do processo (None se o arquivo não existe)
+_snapshot = None
+_lock_carga = threading.Lock()
+
+
+def obter_snapshot():
+    """Retorna o snapshot ativo (None se não carregado)"""
+    return _snapshot
+
+
+def abrir_snapshot(caminho=SNAPSHOT_PATH):
+    """Mapeia o snapshot do disco sem ativá-lo (None se o arquivo não existe)"""
+    if not os.path.exists(caminho):
+        print(f"[SNAPSHOT] Arquivo não encontrado: {caminho}", flush=True)
+        return None
+    return SnapshotPortabilidade(caminho)
+
+
+def ativar_snapshot(novo):
+    """
+    Troca o snapshot ativo (None desativa: consultas vão ao banco)
+
+    O mapeamento anterior é liberado quando a última consulta terminar.
+    """
+    global _snapshot
+
+    with _lock_carga:
+        _snapshot = novo
+
+    if novo is not None:
+        print(f"[SNAPSHOT] Carregado: {novo.quantidade:,} telefones portados", flush=True)
+    return novo
+
+
+def carregar_snapshot(caminho=SNAPSHOT_PATH):
+    """
+    Mapeia o snapshot do disco e troca o ativo
+
+    Sem arquivo, ou se ele não abre, o ativo é desligado: um snapshot de
+    outra geração daria respostas erradas, o banco só mais lentas.
+    """
+    try:
+        novo = abrir_snapshot(caminho)
+    except Exception:
+        ativar_snapshot(None)
+        raise
+    return ativar_snapshot(novo)
@@ -244,6 +244,31 @@ exec_sql "CREATE INDEX IF NOT EXISTS idx_faixa_ddd_prefixo ON faixa_operadora(dd
 
 echo -e "${GREEN}✓ Índices criados${NC}"
 
+# faixa_numero (int8range) com GiST de cobertura (INCLUDE das colunas da
+# resposta): só na primeira vez, após reimportar ou se o índice não cobre
+if ! exec_sql "SELECT 1 FROM pg_indexes WHERE tablename = 'faixa_operadora' AND indexname IN ('idx_faixa_numero', 'faixa_numero_sem_sobreposicao') AND indexdef LIKE '%INCLUDE%';" | grep -q 1 2>/dev/null; then
+    echo -e "${BLUE}🔧 Gerando faixa_numero (int8range) e índice GiST de cobertura...${NC}"
+
+    cd /app
+    python3 << 'EOF'
+from app.import_data import ImportadorPortabilidade
+
+importador = ImportadorPortabilidade()
+try:
+    importador.preparar_faixa_numero()
+    importador.comparar_consultas_faixa()
+finally:
+    importador.cleanup()
+EOF
+
+    echo -e "${GREEN}✓ faixa_numero pronta${NC}"
+fi
+
+# Visibility map em dia para index-only scans (e estatísticas do planner)
+echo -e "${BLUE}🧹 VACUUM ANALYZE...${NC}"
+exec_sql "VACUUM (ANALYZE) operadoras_rn1, operadoras_stfc, faixa_operadora;" > /dev/null 2>&1
+echo -e "${GREEN}✓ Tabelas analisadas${NC}"
+
 # Estatísticas finais
 echo -e "\n${BOLD}5. RESUMO DA IMPORTAÇÃO${NC}"
 echo -e "${YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}\n"
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmark do overhead por requisição da consulta de faixa
+
+Compara o caminho antigo (Session nova + query ORM montada e compilada a
+cada requisição) com o caminho atual (text() fixo, sessão AUTOCOMMIT e
+statement preparado no servidor via asyncpg), e a serialização da resposta
+(modelo Pydantic + encoder do FastAPI contra fragmentos pré-serializados).
+
+Uso:
+    python3 benchmark_consulta.py               # compilação + serialização + banco
+    python3 benchmark_consulta.py --sem-banco   # sem PostgreSQL
+    python3 benchmark_consulta.py -n 20000
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy.dialects import postgresql
+
+from app.database import SessionLocal, LookupSessionLocal, lookup_engine, engine
+from app.models import FaixaOperadora
+from app.lookup import SQL_FAIXA, Faixa, Portabilidade, numero_nacional
+from app.resposta import montar_resultado, montar_resposta
+from app.main import PortabilidadeResponse
+
+# Cores
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BOLD = '\033[1m'
+NC = '\033[0m'
+
+DDD, PREFIXO, NUMERO = '11', '3333', 150
+
+
+def resumo(nome, tempos):
+    """Imprime média, p50 e p99 em microssegundos"""
+    tempos = sorted(tempos)
+    p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+    print(f"  {nome:<45} média {statistics.mean(tempos) * 1e6:9.1f} µs | "
+          f"p50 {statistics.median(tempos) * 1e6:9.1f} µs | p99 {p99 * 1e6:9.1f} µs")
+    return statistics.mean(tempos)
+
+
+def query_orm(session):
+    return session.query(FaixaOperadora).filter(
+        FaixaOperadora.ddd == DDD,
+        FaixaOperadora.prefixo == PREFIXO,
+        FaixaOperadora.faixa_inicio <= NUMERO,
+        FaixaOperadora.faixa_fim >= NUMERO
+    )
+
+
+def compilar(statement, dialeto, cache):
+    """Mesmo caminho usado pela Connection ao executar (com cache de compilação)"""
+    return statement._compile_w_cache(
+        dialeto, compiled_cache=cache, column_keys=[], for_executemany=False
+    )
+
+
+def benchmark_compilacao(n):
+    """Custo de montar e compilar o SQL, sem ida ao banco"""
+    print(f"\n{BOLD}1. MONTAGEM + COMPILAÇÃO DO SQL ({n:,} iterações){NC}")
+    dialeto = postgresql.dialect()
+    session = SessionLocal()
+
+    # ORM: a query é montada a cada requisição e a chave de cache recalculada
+    cache = {}
+    tempos = []
+    for _ in range(n):
+        inicio = time.perf_counter()
+        compilar(query_orm(session).statement, dialeto, cache)
+        tempos.append(time.perf_counter() - inicio)
+    antes = resumo("Query ORM montada por requisição", tempos)
+
+    # text() fixo no módulo: só a busca no cache de compilação
+    cache = {}
+    tempos = []
+    for _ in range(n):
+        inicio = time.perf_counter()
+        compilar(SQL_FAIXA, dialeto, cache)
+        tempos.append(time.perf_counter() - inicio)
+    depois = resumo("text() fixo (lookup.SQL_FAIXA)", tempos)
+
+    session.close()
+    print(f"  {GREEN}→ {antes / depois:.1f}x menos overhead de montagem/compilação{NC}")
+
+
+async def benchmark_serializacao(n):
+    """Custo de montar e serializar o corpo da resposta de /consulta"""
+    print(f"\n{BOLD}2. SERIALIZAÇÃO DA RESPOSTA ({n:,} iterações){NC}")
+    campo = create_response_field(name="resposta", type_=PortabilidadeResponse)
+    faixa = Faixa("TELEFONICA BRASIL S.A.", "VIV", "SP", "M")
+    casos = [
+        ("11987654321", "11", "9876", "54321", faixa, None),
+        ("11987654322", "11", "9876", "54322", faixa, Portabilidade("55320", "0320")),
+    ]
+    nomes_rn1 = {"55320": "TIM S.A."}
+
+    # Antes: dict -> PortabilidadeResponse -> validação do response_model -> JSONResponse
+    tempos = []
+    for i in range(n):
+        *numero, faixa_caso, portabilidade = casos[i & 1]
+        inicio = time.perf_counter()
+        resultado = montar_resultado(*numero, faixa_caso, portabilidade, nomes_rn1)
+        conteudo = await serialize_response(
+            field=campo, response_content=PortabilidadeResponse(**resultado), is_coroutine=True
+        )
+        JSONResponse(conteudo).body
+        tempos.append(time.perf_counter() - inicio)
+    antes = resumo("Pydantic + encoder do FastAPI (antigo)", tempos)
+
+    # Agora: fragmento da operadora pré-serializado + campos do número
+    tempos = []
+    for i in range(n):
+        *numero, faixa_caso, portabilidade = casos[i & 1]
+        inicio = time.perf_counter()
+        Response(montar_resposta(*numero, faixa_caso, portabilidade, nomes_rn1),
+                 media_type="application/json").body
+        tempos.append(time.perf_counter() - inicio)
+    depois = resumo("Fragmentos pré-serializados + orjson (atual)", tempos)
+
+    print(f"  {GREEN}→ {antes / depois:.1f}x menos CPU por resposta{NC}")
+
+
+def benchmark_banco_antigo(n):
+    """Caminho antigo: Session nova + ORM + first() por requisição"""
+    tempos = []
+    for _ in range(n):
+        inicio = time.perf_counter()
+        session = SessionLocal()
+        query_orm(session).first()
+        session.close()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+async def benchmark_banco_atual(n):
+    """Caminho atual: sessão AUTOCOMMIT + text() preparado (sonda em faixa_numero)"""
+    parametros = {"numero_nacional": numero_nacional(DDD, PREFIXO, NUMERO)}
+
+    # Aquecer: prepara o statement na conexão do pool
+    async with LookupSessionLocal() as session:
+        if (await session.execute(SQL_FAIXA, parametros)).fetchone() is None:
+            # Sem a faixa a medição seria de uma busca vazia
+            print(f"  {YELLOW}⚠ Faixa {DDD} {PREFIXO} {NUMERO} não existe na base: "
+                  f"medindo consultas sem resultado{NC}")
+
+    tempos = []
+    for _ in range(n):
+        inicio = time.perf_counter()
+        async with LookupSessionLocal() as session:
+            (await session.execute(SQL_FAIXA, parametros)).fetchone()
+        tempos.append(time.perf_counter() - inicio)
+
+    await lookup_engine.dispose()
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da consulta de faixa")
+    parser.add_argument("-n", type=int, default=5000, help="iterações por cenário")
+    parser.add_argument("--sem-banco", action="store_true", help="não acessar o PostgreSQL")
+    args = parser.parse_args()
+
+    print(f"{BOLD}╔════════════════════════════════════════════════════════════╗{NC}")
+    print(f"{BOLD}║           BENCHMARK - OVERHEAD POR CONSULTA                ║{NC}")
+    print(f"{BOLD}╚════════════════════════════════════════════════════════════╝{NC}")
+
+    benchmark_compilacao(args.n)
+    asyncio.run(benchmark_serializacao(args.n))
+
+    if args.sem_banco:
+        return 0
+
+    print(f"\n{BOLD}3. IDA E VOLTA AO BANCO ({args.n:,} iterações){NC}")
+    try:
+        # Aquecer o pool síncrono
+        benchmark_banco_antigo(10)
+        antes = resumo("Session + ORM por requisição (antigo)", benchmark_banco_antigo(args.n))
+        depois = resumo("AUTOCOMMIT + statement preparado (atual)",
+                        asyncio.run(benchmark_banco_atual(args.n)))
+        print(f"  {GREEN}→ {antes / depois:.1f}x mais rápido por consulta{NC}")
+    except Exception as e:
+        print(f"  {YELLOW}⚠ Banco indisponível: {str(e)[:80]}{NC}")
+        return 1
+    finally:
+        engine.dispose()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
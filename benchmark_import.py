@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmark da carga de portabilidade_historico
+
+Compara os dois formatos do importador (IMPORT_COPY_FORMAT): COPY em texto
+para uma tabela de staging com 19 colunas TEXT + INSERT ... SELECT com
+regex, NULLIF e casts no servidor, e COPY binário direto na tabela final
+(linhas convertidas no cliente por app.copy_binario), sobre um arquivo
+sintético no formato do export.
+
+As cargas vão para tabelas temporárias: portabilidade_historico não é tocada.
+
+Uso:
+    python3 benchmark_import.py                 # 5M linhas, codificação + banco
+    python3 benchmark_import.py --sem-banco     # só a codificação no cliente
+    python3 benchmark_import.py --linhas 500000 --arquivo /tmp/historico.csv
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+from app.copy_binario import COLUNAS, LeitorCopyBinario, sql_copy
+from app.historico import sql_inserir_staging
+from import_chunks_smart import BatchReader, DB_CONFIG
+
+# Cores
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BOLD = '\033[1m'
+NC = '\033[0m'
+
+TIPOS_SQL = {'bigint': 'BIGINT', 'timestamp': 'TIMESTAMP'}
+
+# Caminho em texto do importador: staging convertida no servidor
+SQL_INSERT_STAGING = sql_inserir_staging('bench_historico_texto', 'bench_staging')
+
+
+def gerar_arquivo(caminho, linhas):
+    """Arquivo sintético com o layout do export (19 campos separados por ';')"""
+    print(f"\n{BOLD}1. GERANDO ARQUIVO SINTÉTICO ({linhas:,} linhas){NC}")
+    inicio = time.time()
+    aleatorio = random.Random(42)
+    spids = [f"{aleatorio.randint(1, 999):04d}" for _ in range(60)]
+    status = ['new', 'old', 'active', 'cancel']
+
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for _ in range(linhas):
+            dia = f"20{aleatorio.randint(10, 24):02d}-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d}"
+            hora = f"{aleatorio.randint(0, 23):02d}:{aleatorio.randint(0, 59):02d}:{aleatorio.randint(0, 59):02d}"
+            data = f"{dia} {hora}"
+            f.write(';'.join((
+                aleatorio.choice(spids), '1', data,
+                f"{aleatorio.randint(11, 99)}9{aleatorio.randint(10000000, 99999999)}",
+                str(aleatorio.randint(0, 99999)), aleatorio.choice(spids),
+                str(aleatorio.randint(100, 999)), f"55{aleatorio.randint(100, 999)}",
+                '0', '0', aleatorio.choice(status), '1', data, '0',
+                '0000-00-00 00:00:00', '0', '0', '0', '0000-00-00 00:00:00'
+            )) + '\n')
+
+    tamanho = os.path.getsize(caminho) / 1024 / 1024
+    print(f"  {caminho}: {tamanho:,.0f} MB em {time.time() - inicio:.1f}s")
+
+
+def resumo(nome, linhas, segundos):
+    """Imprime a vazão em registros/s"""
+    vazao = linhas / segundos if segundos > 0 else 0
+    print(f"  {nome:<45} {linhas:>10,} registros em {segundos:7.1f}s | {vazao:>10,.0f} registros/s")
+    return vazao
+
+
+def benchmark_codificacao(caminho):
+    """Só a conversão + codificação binária no cliente, sem banco"""
+    print(f"\n{BOLD}2. CODIFICAÇÃO BINÁRIA NO CLIENTE{NC}")
+    with open(caminho, 'rb', buffering=1024 * 1024) as f:
+        leitor = LeitorCopyBinario(BatchReader(f, float('inf')))
+        inicio = time.perf_counter()
+        while leitor.read(1024 * 1024):
+            pass
+        return resumo("app.copy_binario", leitor.linhas, time.perf_counter() - inicio)
+
+
+def criar_tabelas(cursor):
+    colunas = ", ".join(
+        f"{nome} {TIPOS_SQL.get(tipo) or f'VARCHAR({tamanho})'}"
+        for nome, tipo, tamanho in COLUNAS
+    )
+    cursor.execute(f"CREATE TEMP TABLE bench_historico_texto ({colunas})")
+    cursor.execute(f"CREATE TEMP TABLE bench_historico_binario ({colunas})")
+    cursor.execute(
+        "CREATE TEMP TABLE bench_staging ("
+        + ", ".join(f"campo{i} TEXT" for i in range(1, 20)) + ")"
+    )
+
+
+def benchmark_texto(conn, caminho):
+    """COPY texto para staging + INSERT ... SELECT (IMPORT_COPY_FORMAT=text)"""
+    cursor = conn.cursor()
+    inicio = time.perf_counter()
+    with open(caminho, 'r', encoding='utf-8') as f:
+        cursor.copy_expert("COPY bench_staging FROM STDIN WITH DELIMITER ';' CSV", f)
+    cursor.execute(SQL_INSERT_STAGING)
+    linhas = cursor.rowcount
+    conn.commit()
+    segundos = time.perf_counter() - inicio
+    cursor.close()
+    return linhas, segundos
+
+
+def benchmark_binario(conn, caminho):
+    """COPY binário direto na tabela (IMPORT_COPY_FORMAT=binary)"""
+    cursor = conn.cursor()
+    inicio = time.perf_counter()
+    with open(caminho, 'rb', buffering=1024 * 1024) as f:
+        leitor = LeitorCopyBinario(BatchReader(f, float('inf')))
+        cursor.copy_expert(sql_copy('bench_historico_binario'), leitor, size=1024 * 1024)
+    conn.commit()
+    segundos = time.perf_counter() - inicio
+    cursor.close()
+    return leitor.linhas, segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da carga de portabilidade_historico")
+    parser.add_argument("--linhas", type=int, default=5000000, help="linhas do arquivo sintético")
+    parser.add_argument("--arquivo", default="/tmp/benchmark_historico.csv", help="arquivo sintético")
+    parser.add_argument("--reusar", action="store_true", help="reusar o arquivo se já existir")
+    parser.add_argument("--sem-banco", action="store_true", help="não acessar o PostgreSQL")
+    args = parser.parse_args()
+
+    print(f"{BOLD}╔════════════════════════════════════════════════════════════╗{NC}")
+    print(f"{BOLD}║          BENCHMARK - CARGA DO HISTÓRICO (COPY)             ║{NC}")
+    print(f"{BOLD}╚════════════════════════════════════════════════════════════╝{NC}")
+
+    if not (args.reusar and os.path.exists(args.arquivo)):
+        gerar_arquivo(args.arquivo, args.linhas)
+
+    benchmark_codificacao(args.arquivo)
+
+    if args.sem_banco:
+        return 0
+
+    print(f"\n{BOLD}3. CARGA NO BANCO (tabelas temporárias){NC}")
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except Exception as e:
+        print(f"  {YELLOW}⚠ Banco indisponível: {str(e)[:80]}{NC}")
+        return 1
+
+    try:
+        cursor = conn.cursor()
+        criar_tabelas(cursor)
+        conn.commit()
+        cursor.close()
+
+        texto = resumo("COPY texto + INSERT ... SELECT (text)", *benchmark_texto(conn, args.arquivo))
+        binario = resumo("COPY binário direto na tabela (binary)", *benchmark_binario(conn, args.arquivo))
+        print(f"  {GREEN}→ binary: {binario / texto:.2f}x os registros/s de text{NC}")
+    finally:
+        conn.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,49 @@
 #!/usr/bin/env python3
 """
 Importador inteligente de histórico de portabilidade
-- Divide arquivo em chunks de 1M registros
-- Usa COPY para velocidade máxima
-- Fallback para INSERT linha por linha em caso de erro
+- Lê o arquivo uma única vez, em lotes de 1M registros enviados direto ao COPY
+  (sem contagem prévia de linhas nem arquivos de chunk em disco)
+- COPY em texto para uma staging temporária + INSERT ... SELECT convertendo
+  no servidor (padrão), ou COPY binário direto na tabela final com as linhas
+  convertidas no cliente (IMPORT_COPY_FORMAT=binary; ver benchmark_import.py)
+- Modo paralelo (IMPORT_WORKERS > 1 ou --workers N): faixas de bytes do
+  arquivo importadas por processos com conexões próprias
+- Carga em massa (IMPORT_BULK=true ou --bulk): índices secundários removidos
+  antes da carga e recriados uma vez no fim, em paralelo, seguidos de ANALYZE
+- Retomada por checkpoint (import_checkpoint): a posição em bytes de cada
+  faixa é gravada na mesma transação do lote; ao reiniciar, seek direto nela
+- Recarga sem indisponibilidade (IMPORT_RELOAD=true ou --recarregar): carga em
+  uma tabela sombra UNLOGGED, indexada e validada, trocada pela tabela em uso
+  em uma transação curta; a API continua consultando a base anterior até lá
+- Fallback em caso de erro: COPY em blocos menores e INSERT linha por linha
+  só no bloco que falhar
 - Progresso visual em tempo real
-- Otimizado para liberar memória após cada chunk
+- Memória limitada ao buffer de leitura (o lote não é carregado inteiro)
 """
+import csv
 import os
+import re
 import sys
 import time
+import multiprocessing
 import psycopg2
 from psycopg2 import sql
 from datetime import datetime
 import tempfile
-import subprocess
-from io import StringIO
-import gc  # Garbage collector para liberar memória
+from io import BytesIO, StringIO
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from app.historico import (
+    reconstruir_portabilidade_atual, preparar_datas_historico, atualizar_rollups,
+    sql_inserir_staging
+)
+from app.copy_binario import (
+    LeitorCopyBinario, converter_linha, COLUNAS as COLUNAS_BINARIO, sql_copy
+)
+from app.snapshot import gerar_snapshot
+from app.bloom import gerar_filtro_bloom
+from app.geracao import publicar_geracao
 
 # Configurações
 DB_CONFIG = {
@@ -28,8 +55,39 @@ DB_CONFIG = {
 }
 
 INPUT_FILE = '/app/data/export_full_mysql.csv'
-CHUNK_SIZE = 1000000  # 1 milhão de linhas por chunk
-TEMP_DIR = '/app/data/portabilidade_chunks'
+CHUNK_SIZE = 1000000  # 1 milhão de linhas por lote
+FALLBACK_BLOCK = 5000  # linhas por COPY no fallback de um lote recusado
+# Formato do COPY: 'text' converte no servidor (C), 'binary' no cliente (Python).
+# Medido com benchmark_import.py (1M linhas, 1 core, PostgreSQL 16): text
+# 67k registros/s, binary 39k registros/s
+COPY_FORMAT = os.getenv('IMPORT_COPY_FORMAT', 'text').lower()
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', 1))  # processos/conexões em paralelo
+
+# Carga em massa: índices secundários removidos durante a carga e recriados
+# no fim, em paralelo
+IMPORT_BULK = os.getenv('IMPORT_BULK', 'false').lower() in ('1', 'true', 'yes')
+INDEX_WORKERS = int(os.getenv('IMPORT_INDEX_WORKERS', 3))  # índices criados ao mesmo tempo
+MAINTENANCE_WORK_MEM = os.getenv('IMPORT_MAINTENANCE_WORK_MEM', '1GB')  # por índice em criação
+PARALLEL_MAINTENANCE_WORKERS = int(os.getenv('IMPORT_PARALLEL_MAINTENANCE_WORKERS', 2))
+# Índices usados pela API durante a carga (/historico, /consulta?data_referencia=)
+BULK_KEEP_INDEXES = ('idx_historico_telefone_data',)
+
+# Recarga: tabela sombra em esquema próprio, trocada no fim por SET SCHEMA
+IMPORT_RELOAD = os.getenv('IMPORT_RELOAD', 'false').lower() in ('1', 'true', 'yes')
+HISTORICO = 'portabilidade_historico'
+SHADOW_SCHEMA = 'carga_historico'
+OLD_SCHEMA = 'carga_historico_antiga'
+SHADOW_TABLE = f'{SHADOW_SCHEMA}.{HISTORICO}'
+# A troca espera pouco pelos locks (leituras novas da API ficam na fila atrás
+# dela) e tenta de novo até SWAP_RETRIES vezes
+SWAP_LOCK_TIMEOUT = os.getenv('IMPORT_SWAP_LOCK_TIMEOUT', '2s')
+SWAP_RETRIES = int(os.getenv('IMPORT_SWAP_RETRIES', 5))
+# Validação antes da troca: fração máxima de linhas com erro e fração mínima
+# de registros em relação à tabela em uso
+RELOAD_MAX_ERROR_RATIO = float(os.getenv('IMPORT_RELOAD_MAX_ERROR_RATIO', 0.001))
+RELOAD_MIN_ROWS_RATIO = float(os.getenv('IMPORT_RELOAD_MIN_ROWS_RATIO', 0.9))
+# Tabelas trocadas juntas: o rollup (marca por id) é montado na sombra
+SWAP_TABLES = (HISTORICO, 'portabilidade_rollup', 'rollup_controle')
 
 # Cores para output
 GREEN = '\033[0;32m'
@@ -46,12 +104,6 @@ def print_progress_bar(current, total, prefix='', suffix='', decimals=1, length=
     bar = fill * filled_length + '░' * (length - filled_length)
     print(f'\r{prefix} |{bar}| {percent}% {suffix}', end='', flush=True)
 
-def count_lines(filename):
-    """Conta linhas do arquivo rapidamente"""
-    print(f"{YELLOW}Contando linhas do arquivo...{NC}")
-    result = subprocess.run(['wc', '-l', filename], capture_output=True, text=True)
-    return int(result.stdout.split()[0])
-
 def get_current_count():
     """Obtém quantidade de registros já importados"""
     try:
@@ -65,167 +117,101 @@ def get_current_count():
     except:
         return 0
 
-def split_file_into_chunks(filename, chunk_size):
-    """Divide arquivo em chunks menores"""
-    os.makedirs(TEMP_DIR, exist_ok=True)
-    os.makedirs('/app/data', exist_ok=True)  # Garantir que diretório existe
+class BatchReader:
+    """
+    Leitor de no máximo max_lines linhas do arquivo de origem (binário)
 
-    print(f"\n{BOLD}1. DIVIDINDO ARQUIVO EM CHUNKS{NC}")
-    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
+    Entregue ao COPY FROM STDIN: o lote vai do arquivo direto para o banco,
+    sem ser materializado em disco nem em memória. Com end, para também ao
+    chegar nessa posição do arquivo (fim da faixa de um worker paralelo).
+    """
 
-    # Verificar registros já importados
-    current_count = get_current_count()
-    skip_lines = current_count
-
-    if skip_lines > 0:
-        print(f"{GREEN}✓ Detectados {skip_lines:,} registros já importados{NC}")
-        print(f"{YELLOW}→ Pulando primeiras {skip_lines:,} linhas{NC}\n")
-
-    total_lines = count_lines(filename)
-    remaining_lines = total_lines - skip_lines
-    total_chunks = (remaining_lines // chunk_size) + (1 if remaining_lines % chunk_size else 0)
-
-    print(f"Total de linhas: {total_lines:,}")
-    print(f"Linhas já processadas: {skip_lines:,}")
-    print(f"Linhas restantes: {remaining_lines:,}")
-    print(f"Linhas por chunk: {chunk_size:,}")
-    print(f"Total de chunks: {total_chunks}\n")
-
-    chunk_files = []
-    current_chunk = 0
-    current_lines = 0
-    chunk_file = None
-    chunk_writer = None
-
-    with open(filename, 'r', encoding='utf-8') as infile:
-        # Pular linhas já processadas
-        for _ in range(skip_lines):
-            next(infile)
-
-        for line_num, line in enumerate(infile, skip_lines + 1):
-            # Novo chunk
-            if current_lines == 0:
-                if chunk_file:
-                    chunk_file.close()
-
-                current_chunk += 1
-                chunk_filename = os.path.join(TEMP_DIR, f'chunk_{current_chunk:04d}.csv')
-                chunk_files.append(chunk_filename)
-                chunk_file = open(chunk_filename, 'w', encoding='utf-8')
-
-            chunk_file.write(line)
-            current_lines += 1
-
-            # Progresso
-            if line_num % 100000 == 0:
-                print_progress_bar(line_num, total_lines,
-                                 prefix=f'Dividindo',
-                                 suffix=f'Chunk {current_chunk}/{total_chunks}')
-
-            # Fechar chunk atual
-            if current_lines >= chunk_size:
-                current_lines = 0
-
-    if chunk_file:
-        chunk_file.close()
-
-    print(f"\n{GREEN}✓ Arquivo dividido em {len(chunk_files)} chunks{NC}\n")
-    return chunk_files
+    def __init__(self, infile, max_lines, end=None):
+        self.infile = infile
+        self.remaining = max_lines
+        self.lines = 0
+        self.position = infile.tell()
+        self.end = end
+
+    def read(self, size=-1):
+        # Sempre linhas inteiras, para o lote terminar em fim de linha
+        parts = []
+        total = 0
+        while self.remaining > 0 and (size < 0 or total < size):
+            if self.end is not None and self.position >= self.end:
+                self.remaining = 0
+                break
+            line = self.infile.readline()
+            if not line:
+                self.remaining = 0
+                break
+            parts.append(line)
+            total += len(line)
+            self.position += len(line)
+            self.remaining -= 1
+            self.lines += 1
+        return b''.join(parts)
+
+def skip_imported_lines(infile, skip_lines):
+    """Avança o arquivo sobre as linhas já importadas"""
+    skipped = 0
+    while skipped < skip_lines and infile.readline():
+        skipped += 1
+        if skipped % 1000000 == 0:
+            print(f"\r{YELLOW}→ Pulando linhas: {skipped:,}/{skip_lines:,}{NC}", end='', flush=True)
+    if skip_lines:
+        print()
+    return skipped
 
 def create_temp_table(conn):
-    """Cria tabela temporária para staging"""
+    """Cria tabela temporária para staging (COPY em texto)"""
     cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TEMP TABLE IF NOT EXISTS staging_portabilidade (
-            campo1 TEXT,
-            campo2 TEXT,
-            campo3 TEXT,
-            campo4 TEXT,
-            campo5 TEXT,
-            campo6 TEXT,
-            campo7 TEXT,
-            campo8 TEXT,
-            campo9 TEXT,
-            campo10 TEXT,
-            campo11 TEXT,
-            campo12 TEXT,
-            campo13 TEXT,
-            campo14 TEXT,
-            campo15 TEXT,
-            campo16 TEXT,
-            campo17 TEXT,
-            campo18 TEXT,
-            campo19 TEXT
-        )
-    """)
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS staging_portabilidade ("
+        + ", ".join(f"campo{i} TEXT" for i in range(1, 20)) + ")"
+    )
     conn.commit()
     cursor.close()
 
-def import_chunk_with_copy(conn, chunk_file, chunk_num, total_chunks):
-    """Tenta importar chunk usando COPY (mais rápido)"""
+def copy_rows(cursor, reader, table=HISTORICO):
+    """
+    COPY das linhas do reader (bytes, linhas inteiras) para `table` no
+    formato COPY_FORMAT; retorna a quantidade de registros gravados
+    """
+    if COPY_FORMAT == 'binary':
+        binario = LeitorCopyBinario(reader)
+        cursor.copy_expert(sql_copy(table), binario, size=1024 * 1024)
+        return binario.linhas
+
+    cursor.execute("TRUNCATE staging_portabilidade")
+    cursor.copy_expert(
+        "COPY staging_portabilidade FROM STDIN WITH DELIMITER ';' CSV",
+        reader,
+        size=1024 * 1024
+    )
+    cursor.execute(sql_inserir_staging(table, 'staging_portabilidade'))
+    return cursor.rowcount
+
+def import_batch_with_copy(conn, reader, verbose=True, checkpoint=None, table=HISTORICO):
+    """
+    Tenta importar o lote usando COPY (mais rápido), no formato COPY_FORMAT
+
+    checkpoint(cursor, importados, erros) roda antes do commit, na mesma
+    transação do lote.
+    """
     cursor = conn.cursor()
 
     try:
-        # Limpar staging
-        cursor.execute("TRUNCATE staging_portabilidade")
-
-        # COPY para staging
-        print(f"{BLUE}Importando com COPY...{NC}", end='', flush=True)
-        with open(chunk_file, 'r', encoding='utf-8') as f:
-            cursor.copy_expert(
-                "COPY staging_portabilidade FROM STDIN WITH DELIMITER ';' CSV",
-                f
-            )
-
-        # Inserir na tabela final com tratamento
-        cursor.execute("""
-            INSERT INTO portabilidade_historico (
-                spid_origem, flag_1, data_criacao, telefone, codigo_1,
-                spid_destino, codigo_operadora, codigo_completo,
-                flag_2, flag_3, status, flag_4, data_atualizacao,
-                flag_5, data_nula_1, flag_6, flag_7, flag_8, data_nula_2
-            )
-            SELECT
-                campo1::VARCHAR(10),
-                NULLIF(campo2, '')::BIGINT,
-                campo3::VARCHAR(50),
-                CASE
-                    WHEN campo4 ~ '^[0-9]+$' AND LENGTH(campo4) <= 15
-                    THEN campo4::BIGINT
-                    ELSE NULL
-                END,
-                NULLIF(campo5, '')::BIGINT,
-                campo6::VARCHAR(10),
-                campo7::VARCHAR(10),
-                campo8::VARCHAR(10),
-                NULLIF(campo9, '')::BIGINT,
-                NULLIF(campo10, '')::BIGINT,
-                campo11::VARCHAR(20),
-                NULLIF(campo12, '')::BIGINT,
-                campo13::VARCHAR(50),
-                NULLIF(campo14, '')::BIGINT,
-                CASE
-                    WHEN campo15 = '0000-00-00 00:00:00' THEN NULL
-                    ELSE campo15::VARCHAR(50)
-                END,
-                NULLIF(campo16, '')::BIGINT,
-                NULLIF(campo17, '')::BIGINT,
-                NULLIF(campo18, '')::BIGINT,
-                CASE
-                    WHEN campo19 = '0000-00-00 00:00:00' THEN NULL
-                    ELSE campo19::VARCHAR(50)
-                END
-            FROM staging_portabilidade
-        """)
-
-        rows_inserted = cursor.rowcount
-        conn.commit()
+        if verbose:
+            print(f"{BLUE}Importando com COPY...{NC}", end='', flush=True)
 
-        # Limpar staging após inserção
-        cursor.execute("TRUNCATE staging_portabilidade")
+        rows_inserted = copy_rows(cursor, reader, table)
+        if checkpoint is not None:
+            checkpoint(cursor, rows_inserted, 0)
         conn.commit()
 
-        print(f"\r{GREEN}✓ COPY bem-sucedido: {rows_inserted:,} registros{NC}")
+        if verbose:
+            print(f"\r{GREEN}✓ COPY bem-sucedido: {rows_inserted:,} registros{NC}")
         return True, rows_inserted, 0
 
     except Exception as e:
@@ -235,139 +221,672 @@ def import_chunk_with_copy(conn, chunk_file, chunk_num, total_chunks):
     finally:
         cursor.close()
 
-def import_chunk_with_insert(conn, chunk_file, chunk_num, total_chunks):
-    """Importa chunk linha por linha (mais lento mas resiliente)"""
-    cursor = conn.cursor()
+def import_batch_with_insert(conn, lines, total_lines, checkpoint=None, table=HISTORICO):
+    """
+    Importa o lote recusado pelo COPY em blocos de FALLBACK_BLOCK linhas
 
-    print(f"{YELLOW}Modo INSERT linha por linha...{NC}")
-
-    insert_sql = """
-        INSERT INTO portabilidade_historico (
-            spid_origem, flag_1, data_criacao, telefone, codigo_1,
-            spid_destino, codigo_operadora, codigo_completo,
-            flag_2, flag_3, status, flag_4, data_atualizacao,
-            flag_5, data_nula_1, flag_6, flag_7, flag_8, data_nula_2
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
+    Cada bloco tenta um COPY (copy_rows) em um SAVEPOINT; só o bloco que falhar
+    é inserido linha por linha (SAVEPOINT por linha), então uma linha
+    rejeitada não derruba as demais do lote. Um único commit no fim, junto
+    com o checkpoint. lines são as linhas do arquivo (bytes).
     """
+    cursor = conn.cursor()
+
+    print(f"{YELLOW}Modo fallback: COPY em blocos de {FALLBACK_BLOCK:,} linhas...{NC}")
+
+    insert_sql = (
+        f"INSERT INTO {table} ("
+        + ", ".join(nome for nome, _, _ in COLUNAS_BINARIO)
+        + ") VALUES (" + ", ".join(["%s"] * len(COLUNAS_BINARIO)) + ")"
+    )
 
-    total_lines = sum(1 for line in open(chunk_file, 'r', encoding='utf-8'))
     success_count = 0
     error_count = 0
-
-    with open(chunk_file, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            try:
-                # Parse linha
-                fields = line.strip().split(';')
-                if len(fields) < 19:
+    line_num = 0
+    lines = iter(lines)
+
+    while True:
+        block = list(islice(lines, FALLBACK_BLOCK))
+        if not block:
+            break
+
+        cursor.execute("SAVEPOINT bloco")
+        try:
+            rows = copy_rows(cursor, BatchReader(BytesIO(b''.join(block)), len(block)), table)
+            cursor.execute("RELEASE SAVEPOINT bloco")
+            success_count += rows
+            line_num += len(block)
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT bloco")
+
+            for line in block:
+                line_num += 1
+                try:
+                    # Mesmas conversões do COPY (app.copy_binario)
+                    fields = next(csv.reader([line.decode('utf-8', errors='replace')], delimiter=';'), [])
+                    if len(fields) < 19:
+                        error_count += 1
+                        continue
+                    data = converter_linha(fields[:19])
+
+                    cursor.execute("SAVEPOINT linha")
+                    try:
+                        cursor.execute(insert_sql, data)
+                    except Exception:
+                        cursor.execute("ROLLBACK TO SAVEPOINT linha")
+                        raise
+                    cursor.execute("RELEASE SAVEPOINT linha")
+                    success_count += 1
+
+                except Exception as e:
                     error_count += 1
-                    continue
-
-                # Preparar dados
-                data = (
-                    fields[0],                               # spid_origem
-                    int(fields[1]) if fields[1] else None,   # flag_1
-                    fields[2],                               # data_criacao
-                    int(fields[3]) if fields[3] and fields[3].isdigit() else None,  # telefone
-                    int(fields[4]) if fields[4] else None,   # codigo_1
-                    fields[5],                               # spid_destino
-                    fields[6],                               # codigo_operadora
-                    fields[7],                               # codigo_completo
-                    int(fields[8]) if fields[8] else None,   # flag_2
-                    int(fields[9]) if fields[9] else None,   # flag_3
-                    fields[10],                              # status
-                    int(fields[11]) if fields[11] else None, # flag_4
-                    fields[12],                              # data_atualizacao
-                    int(fields[13]) if fields[13] else None, # flag_5
-                    None if fields[14] == '0000-00-00 00:00:00' else fields[14],  # data_nula_1
-                    int(fields[15]) if fields[15] else None, # flag_6
-                    int(fields[16]) if fields[16] else None, # flag_7
-                    int(fields[17]) if fields[17] else None, # flag_8
-                    None if fields[18] == '0000-00-00 00:00:00' else fields[18]   # data_nula_2
-                )
-
-                cursor.execute(insert_sql, data)
-                success_count += 1
-
-                # Commit a cada 10k registros
-                if success_count % 10000 == 0:
-                    conn.commit()
-
-            except Exception as e:
-                error_count += 1
-                if error_count <= 5:  # Mostrar apenas primeiros 5 erros
-                    print(f"{RED}  Erro linha {line_num}: {str(e)[:50]}...{NC}")
+                    if error_count <= 5:  # Mostrar apenas primeiros 5 erros
+                        print(f"{RED}  Erro linha {line_num}: {str(e)[:50]}...{NC}")
 
-            # Progresso
-            if line_num % 1000 == 0:
-                print_progress_bar(line_num, total_lines,
-                                 prefix='INSERT',
-                                 suffix=f'OK: {success_count:,} | Erros: {error_count:,}')
+        print_progress_bar(line_num, total_lines,
+                           prefix='Fallback',
+                           suffix=f'OK: {success_count:,} | Erros: {error_count:,}')
 
+    if checkpoint is not None:
+        checkpoint(cursor, success_count, error_count)
     conn.commit()
     cursor.close()
 
-    print(f"\n{GREEN}✓ INSERT concluído: {success_count:,} OK, {error_count:,} erros{NC}")
+    print(f"\n{GREEN}✓ Fallback concluído: {success_count:,} OK, {error_count:,} erros{NC}")
     return True, success_count, error_count
 
-def import_all_chunks(chunk_files):
-    """Importa todos os chunks"""
-    print(f"\n{BOLD}2. IMPORTANDO CHUNKS PARA O BANCO{NC}")
-    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
+def import_batch(conn, infile, batch_size, end=None, verbose=True, checkpoint=None, table=HISTORICO):
+    """
+    Importa um lote a partir da posição atual do arquivo
+
+    COPY primeiro; se falhar, o arquivo volta ao início do lote (seek) e o
+    mesmo trecho é importado em blocos menores (import_batch_with_insert). checkpoint(cursor, posicao,
+    importados, erros) grava a posição final do lote na transação do lote.
+    Retorna (linhas_lidas, importados, erros).
+    """
+    batch_start = infile.tell()
+    reader = BatchReader(infile, batch_size, end)
+
+    def save(cursor, imported, errors):
+        if checkpoint is not None:
+            checkpoint(cursor, reader.position, imported, errors)
+
+    success, imported, errors = import_batch_with_copy(conn, reader, verbose, save, table)
+
+    if not success and reader.lines > 0:
+        infile.seek(batch_start)
+        lines = (infile.readline() for _ in range(reader.lines))
+        success, imported, errors = import_batch_with_insert(conn, lines, reader.lines, save, table)
+
+    return reader.lines, imported, errors
+
+def file_identity(filename):
+    """(caminho, tamanho, mtime) que identificam o arquivo dos checkpoints"""
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, int(stat.st_mtime)
+
+def ensure_checkpoint_table(conn):
+    """
+    Tabela de checkpoints: uma linha por faixa de bytes do arquivo, com a
+    posição até onde os lotes já foram commitados na tabela `destino`
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoint (
+            arquivo TEXT NOT NULL,
+            tamanho BIGINT NOT NULL,
+            modificado_em BIGINT NOT NULL,
+            inicio BIGINT NOT NULL,
+            fim BIGINT NOT NULL,
+            posicao BIGINT NOT NULL,
+            linhas BIGINT NOT NULL DEFAULT 0,
+            erros BIGINT NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (arquivo, inicio)
+        )
+    """)
+    # Checkpoints anteriores à recarga são todos da tabela em uso
+    cursor.execute(f"""
+        ALTER TABLE import_checkpoint
+        ADD COLUMN IF NOT EXISTS destino TEXT NOT NULL DEFAULT '{HISTORICO}'
+    """)
+    conn.commit()
+    cursor.close()
+
+def save_checkpoint(cursor, filename, range_start, position, imported, errors):
+    """Avança o checkpoint da faixa (chamado antes do commit do lote)"""
+    cursor.execute("""
+        UPDATE import_checkpoint
+        SET posicao = %s, linhas = linhas + %s, erros = erros + %s, atualizado_em = now()
+        WHERE arquivo = %s AND inicio = %s
+    """, (position, imported, errors, os.path.abspath(filename), range_start))
 
+def plan_ranges(filename, workers, table=HISTORICO):
+    """
+    Faixas de bytes a importar: [(inicio, posicao, fim)] com posicao < fim
+
+    Com checkpoints do mesmo arquivo (caminho, tamanho e mtime) e da mesma
+    tabela, retoma cada faixa da posição gravada, sem ler o que já foi
+    importado. Sem checkpoint, divide o arquivo em faixas novas; se a tabela
+    em uso já tem registros de uma importação anterior aos checkpoints, pula
+    as linhas contadas (COUNT). A tabela sombra sem checkpoint recomeça vazia.
+    """
+    arquivo, tamanho, modificado_em = file_identity(filename)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    ensure_checkpoint_table(conn)
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT inicio, posicao, fim, linhas, erros
+        FROM import_checkpoint
+        WHERE arquivo = %s AND tamanho = %s AND modificado_em = %s AND destino = %s
+        ORDER BY inicio
+    """, (arquivo, tamanho, modificado_em, table))
+    checkpoints = cursor.fetchall()
+
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+    has_rows = cursor.fetchone()[0]
+
+    if checkpoints and has_rows:
+        imported = sum(c[3] for c in checkpoints)
+        done = sum(c[1] - c[0] for c in checkpoints)
+        print(f"{GREEN}✓ Checkpoint encontrado: {imported:,} registros já importados "
+              f"({done / 1024 / 1024:,.0f} MB de {tamanho / 1024 / 1024:,.0f} MB){NC}")
+        cursor.close()
+        conn.close()
+        return [(inicio, posicao, fim) for inicio, posicao, fim, _, _ in checkpoints if posicao < fim]
+
+    # Checkpoints de outro arquivo (ou de uma tabela esvaziada) não valem mais
+    cursor.execute("DELETE FROM import_checkpoint WHERE arquivo = %s", (arquivo,))
+    if has_rows and table != HISTORICO:
+        cursor.execute(f"TRUNCATE {table}")
+        has_rows = False
+    conn.commit()
+
+    start = 0
+    if has_rows:
+        skip_lines = get_current_count()
+        print(f"{YELLOW}→ Sem checkpoint: {skip_lines:,} registros já importados, "
+              f"pulando primeiras {skip_lines:,} linhas{NC}")
+        with open(filename, 'rb', buffering=1024 * 1024) as infile:
+            skip_imported_lines(infile, skip_lines)
+            start = infile.tell()
+
+    ranges = split_ranges(filename, start, workers)
+    for inicio, fim in ranges:
+        cursor.execute("""
+            INSERT INTO import_checkpoint (arquivo, tamanho, modificado_em, inicio, fim, posicao, destino)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (arquivo, tamanho, modificado_em, inicio, fim, inicio, table))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    return [(inicio, inicio, fim) for inicio, fim in ranges]
+
+def split_ranges(filename, start, workers):
+    """
+    Divide o arquivo, a partir de start, em até `workers` faixas de bytes
+
+    Cada divisão é ajustada para o início da linha seguinte (seek + readline),
+    sem contar linhas. Retorna lista de (inicio, fim).
+    """
+    file_size = os.path.getsize(filename)
+    bounds = [start]
+
+    with open(filename, 'rb') as infile:
+        for k in range(1, workers):
+            infile.seek(start + (file_size - start) * k // workers)
+            infile.readline()
+            bounds.append(max(infile.tell(), bounds[-1]))
+    bounds.append(file_size)
+
+    return [(inicio, fim) for inicio, fim in zip(bounds, bounds[1:]) if fim > inicio]
+
+def import_range(worker_id, filename, range_start, start, end, batch_size, table=HISTORICO):
+    """
+    Importa a faixa [start, end) do arquivo com a própria conexão,
+    gravando o checkpoint da faixa
+    range_start a cada lote. No modo paralelo roda em um processo do pool.
+    """
     conn = psycopg2.connect(**DB_CONFIG)
-    create_temp_table(conn)
+    if COPY_FORMAT != 'binary':
+        create_temp_table(conn)
 
     total_success = 0
     total_errors = 0
+    batch_num = 0
+    start_time = time.time()
+
+    with open(filename, 'rb', buffering=1024 * 1024) as infile:
+        infile.seek(start)
+
+        while infile.tell() < end:
+            lines, imported, errors = import_batch(
+                conn, infile, batch_size, end, verbose=False,
+                checkpoint=lambda cursor, position, imported, errors: save_checkpoint(
+                    cursor, filename, range_start, position, imported, errors
+                ),
+                table=table
+            )
+            if lines == 0:
+                break
 
-    for i, chunk_file in enumerate(chunk_files, 1):
-        chunk_size = os.path.getsize(chunk_file) / 1024 / 1024  # MB
-        print(f"\n{BOLD}Chunk {i}/{len(chunk_files)}{NC} ({chunk_size:.1f} MB)")
-        print("─" * 60)
+            batch_num += 1
+            total_success += imported
+            total_errors += errors
 
-        start_time = time.time()
+            elapsed = time.time() - start_time
+            percent = 100 * (infile.tell() - start) / max(end - start, 1)
+            print(f"{BLUE}[W{worker_id}]{NC} Lote {batch_num}: {imported:,} registros | "
+                  f"{percent:.1f}% da faixa | {total_success / max(elapsed, 0.001):,.0f} registros/s",
+                  flush=True)
 
-        # Tentar COPY primeiro
-        success, imported, errors = import_chunk_with_copy(conn, chunk_file, i, len(chunk_files))
+    conn.close()
 
-        # Se COPY falhar, usar INSERT
-        if not success:
-            success, imported, errors = import_chunk_with_insert(conn, chunk_file, i, len(chunk_files))
+    return {
+        'worker': worker_id,
+        'start': start,
+        'end': end,
+        'success': total_success,
+        'errors': total_errors,
+        'elapsed': time.time() - start_time
+    }
 
-        elapsed = time.time() - start_time
-        speed = imported / elapsed if elapsed > 0 else 0
+def import_file(filename, batch_size, workers, table=HISTORICO):
+    """
+    Importa o arquivo em faixas de bytes para `table`, retomando dos checkpoints
 
-        print(f"Tempo: {elapsed:.1f}s | Velocidade: {speed:,.0f} registros/s")
+    Com workers > 1 cada faixa é importada por um processo com sua conexão;
+    com 1 worker as faixas são importadas em sequência neste processo.
+    """
+    print(f"\n{BOLD}IMPORTANDO ARQUIVO PARA O BANCO ({workers} WORKER{'S' if workers > 1 else ''}){NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
 
-        total_success += imported
-        total_errors += errors
+    pending = plan_ranges(filename, workers, table)
+    if not pending:
+        print(f"{GREEN}✓ Arquivo já importado por completo{NC}")
+        return 0, 0
+
+    for worker_id, (inicio, posicao, fim) in enumerate(pending, 1):
+        print(f"  W{worker_id}: bytes {posicao:,} a {fim:,} ({(fim - posicao) / 1024 / 1024:,.0f} MB)")
+
+    results = []
+    if workers > 1 and len(pending) > 1:
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=contexto) as executor:
+            futures = [
+                executor.submit(import_range, worker_id, filename, inicio, posicao, fim, batch_size, table)
+                for worker_id, (inicio, posicao, fim) in enumerate(pending, 1)
+            ]
+            for future in futures:
+                results.append(future.result())
+    else:
+        for worker_id, (inicio, posicao, fim) in enumerate(pending, 1):
+            results.append(import_range(worker_id, filename, inicio, posicao, fim, batch_size, table))
+
+    # Vazão por worker
+    print(f"\n{BOLD}Resumo por worker{NC}")
+    print("─" * 60)
+    for result in results:
+        speed = result['success'] / result['elapsed'] if result['elapsed'] > 0 else 0
+        print(f"  W{result['worker']}: {result['success']:,} registros, {result['errors']:,} erros "
+              f"em {result['elapsed']:.1f}s ({speed:,.0f} registros/s)")
+
+    # VACUUM não roda dentro de transação; a tabela sombra é reescrita por
+    # SET LOGGED e passa pelo VACUUM depois dos índices (finish_shadow_table)
+    if table == HISTORICO:
+        print(f"\n{YELLOW}Otimizando banco de dados...{NC}")
+        conn = psycopg2.connect(**DB_CONFIG)
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"VACUUM ANALYZE {table}")
+        cursor.close()
+        conn.close()
 
-        # Limpar arquivo do chunk após processamento
-        os.remove(chunk_file)
+    return sum(r['success'] for r in results), sum(r['errors'] for r in results)
 
-        # Forçar limpeza de memória
-        gc.collect()
+def defer_indexes():
+    """
+    Remove os índices secundários de portabilidade_historico para a carga
 
-        # Executar VACUUM ANALYZE a cada 10 chunks para otimizar banco
-        if i % 10 == 0:
-            print(f"\n{YELLOW}Otimizando banco de dados...{NC}")
-            cursor = conn.cursor()
-            cursor.execute("VACUUM ANALYZE portabilidade_historico")
-            conn.commit()
-            cursor.close()
+    As definições (pg_get_indexdef) são gravadas em import_indices_adiados
+    antes do DROP, então uma carga interrompida não perde índices: a próxima
+    execução os recria. Chave primária, índices de constraints e os usados
+    pela API (BULK_KEEP_INDEXES) ficam.
+    """
+    print(f"\n{BOLD}FASE 1: REMOVENDO ÍNDICES SECUNDÁRIOS{NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
 
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_indices_adiados (
+            nome TEXT PRIMARY KEY,
+            definicao TEXT NOT NULL,
+            removido_em TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(ix.indexrelid)
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        WHERE ix.indrelid = 'portabilidade_historico'::regclass
+          AND NOT ix.indisprimary
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid)
+          AND i.relname <> ALL(%s)
+        ORDER BY i.relname
+    """, (list(BULK_KEEP_INDEXES),))
+    indexes = cursor.fetchall()
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM portabilidade_historico)")
+    if indexes and cursor.fetchone()[0]:
+        print(f"  {RED}{BOLD}⚠ A tabela já tem registros: consultas da API que usam os índices "
+              f"abaixo farão seq scan até a FASE 3. Para recarregar sem afetar a API, "
+              f"use --recarregar{NC}")
+
+    for name, definition in indexes:
+        cursor.execute("""
+            INSERT INTO import_indices_adiados (nome, definicao) VALUES (%s, %s)
+            ON CONFLICT (nome) DO UPDATE SET definicao = EXCLUDED.definicao
+        """, (name, definition))
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        conn.commit()
+        print(f"  {GREEN}✓{NC} {name}")
+
+    cursor.close()
+    conn.close()
+
+    if not indexes:
+        print("  Nenhum índice secundário a remover")
+    return len(indexes)
+
+def build_index(name, definition, deferred=True):
+    """
+    Cria um índice em uma conexão própria, com memória de manutenção alta
+
+    Com deferred, remove o índice de import_indices_adiados depois de criado.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    start_time = time.time()
+
+    try:
+        cursor.execute("SET maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,))
+        cursor.execute("SET max_parallel_maintenance_workers = %s", (PARALLEL_MAINTENANCE_WORKERS,))
+        cursor.execute(re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX IF NOT EXISTS ', definition))
+        if deferred:
+            cursor.execute("DELETE FROM import_indices_adiados WHERE nome = %s", (name,))
+    finally:
+        cursor.close()
+        conn.close()
+
+    return time.time() - start_time
+
+def rebuild_indexes():
+    """
+    Recria os índices adiados (INDEX_WORKERS ao mesmo tempo) e roda ANALYZE
+
+    Cada índice usa maintenance_work_mem = MAINTENANCE_WORK_MEM e até
+    PARALLEL_MAINTENANCE_WORKERS processos do PostgreSQL no CREATE INDEX.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('import_indices_adiados') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        conn.close()
+        return 0
+
+    cursor.execute("SELECT nome, definicao FROM import_indices_adiados ORDER BY nome")
+    indexes = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    if not indexes:
+        return 0
+
+    print(f"\n{BOLD}FASE 3: RECRIANDO {len(indexes)} ÍNDICES "
+          f"({INDEX_WORKERS} em paralelo, maintenance_work_mem={MAINTENANCE_WORK_MEM}){NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, INDEX_WORKERS)) as executor:
+        futures = {
+            executor.submit(build_index, name, definition): name
+            for name, definition in indexes
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"  {GREEN}✓{NC} [{done}/{len(indexes)}] {name} em {elapsed:.1f}s")
+            except Exception as e:
+                print(f"  {RED}✗ [{done}/{len(indexes)}] {name}: {str(e)[:80]}{NC}")
+
+    print(f"\n{BOLD}FASE 4: ANALYZE{NC}")
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    analyze_start = time.time()
+    cursor.execute("ANALYZE portabilidade_historico")
+    cursor.close()
     conn.close()
+    print(f"  {GREEN}✓{NC} ANALYZE em {time.time() - analyze_start:.1f}s")
+
+    print(f"\n{GREEN}✓ Índices recriados em {time.time() - start_time:.1f}s{NC}")
+    return len(indexes)
+
+def prepare_shadow_table():
+    """
+    Cria (ou reaproveita, para retomar) a tabela sombra da recarga
 
-    # Limpar diretório temporário
-    print(f"\n{YELLOW}Limpando diretório temporário...{NC}")
-    if os.path.exists(TEMP_DIR):
-        os.rmdir(TEMP_DIR)
+    Mesmas colunas da tabela em uso (LIKE), UNLOGGED e sem índices durante a
+    carga, com sequence própria para o id. Retorna o nome qualificado.
+    """
+    print(f"\n{BOLD}FASE 1: TABELA SOMBRA {SHADOW_TABLE} (UNLOGGED){NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
 
-    return total_success, total_errors
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {SHADOW_SCHEMA}")
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (SHADOW_TABLE,))
+    exists = cursor.fetchone()[0]
+
+    if exists:
+        print(f"  {GREEN}✓{NC} Tabela sombra de uma recarga anterior: retomando")
+    else:
+        cursor.execute(f"CREATE UNLOGGED TABLE {SHADOW_TABLE} (LIKE {HISTORICO} INCLUDING DEFAULTS)")
+        cursor.execute(f"CREATE SEQUENCE {SHADOW_TABLE}_id_seq OWNED BY {SHADOW_TABLE}.id")
+        cursor.execute(f"ALTER TABLE {SHADOW_TABLE} ALTER COLUMN id SET DEFAULT nextval('{SHADOW_TABLE}_id_seq')")
+        print(f"  {GREEN}✓{NC} Tabela sombra criada")
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return SHADOW_TABLE
+
+def shadow_index_definitions(cursor):
+    """
+    Índices secundários da tabela em uso (e os adiados por uma carga em
+    massa interrompida), reescritos para a tabela sombra
+    """
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(ix.indexrelid)
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        WHERE ix.indrelid = %s::regclass
+          AND NOT ix.indisprimary
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid)
+    """, (HISTORICO,))
+    definitions = dict(cursor.fetchall())
+
+    cursor.execute("SELECT to_regclass('import_indices_adiados') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT nome, definicao FROM import_indices_adiados")
+        for name, definition in cursor.fetchall():
+            definitions.setdefault(name, definition)
+
+    return sorted(
+        (name, re.sub(rf' ON (public\.)?{HISTORICO} ', f' ON {SHADOW_TABLE} ', definition))
+        for name, definition in definitions.items()
+    )
+
+def finish_shadow_table():
+    """
+    Prepara a tabela sombra para a troca: SET LOGGED, chave primária,
+    índices secundários (INDEX_WORKERS em paralelo) e VACUUM ANALYZE
+    """
+    print(f"\n{BOLD}FASE 3: INDEXANDO A TABELA SOMBRA{NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    start_time = time.time()
+
+    # SET LOGGED reescreve a tabela: antes dos índices, para não reconstruí-los
+    cursor.execute(f"ALTER TABLE {SHADOW_TABLE} SET LOGGED")
+    print(f"  {GREEN}✓{NC} LOGGED em {time.time() - start_time:.1f}s")
+
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')
+    """, (SHADOW_TABLE,))
+    if not cursor.fetchone()[0]:
+        cursor.execute("SET maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,))
+        cursor.execute(f"ALTER TABLE {SHADOW_TABLE} ADD PRIMARY KEY (id)")
+    print(f"  {GREEN}✓{NC} Chave primária")
+
+    indexes = shadow_index_definitions(cursor)
+    with ThreadPoolExecutor(max_workers=max(1, INDEX_WORKERS)) as executor:
+        futures = {
+            executor.submit(build_index, name, definition, False): name
+            for name, definition in indexes
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            elapsed = future.result()
+            print(f"  {GREEN}✓{NC} [{done}/{len(indexes)}] {futures[future]} em {elapsed:.1f}s")
+
+    cursor.execute(f"VACUUM ANALYZE {SHADOW_TABLE}")
+    cursor.close()
+    conn.close()
+    print(f"\n{GREEN}✓ Tabela sombra pronta em {time.time() - start_time:.1f}s{NC}")
+
+def validate_shadow_table(cursor):
+    """
+    Confere a carga da tabela sombra antes da troca
+
+    Todas as faixas do arquivo importadas até o fim, erros abaixo de
+    RELOAD_MAX_ERROR_RATIO e ao menos RELOAD_MIN_ROWS_RATIO dos registros
+    da tabela em uso. Retorna a lista de falhas (vazia se válida).
+    """
+    cursor.execute("""
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE posicao < fim),
+               COALESCE(SUM(linhas), 0), COALESCE(SUM(erros), 0)
+        FROM import_checkpoint
+        WHERE destino = %s
+    """, (SHADOW_TABLE,))
+    ranges, pending, imported, errors = cursor.fetchone()
+
+    cursor.execute(f"SELECT COUNT(*) FROM {SHADOW_TABLE}")
+    new_count = cursor.fetchone()[0]
+    old_count = get_current_count()
+    error_ratio = errors / max(imported + errors, 1)
+
+    print(f"  Tabela em uso: {old_count:,} registros | tabela nova: {new_count:,} registros")
+    print(f"  Faixas: {ranges - pending}/{ranges} completas | erros: {errors:,} ({error_ratio:.3%})")
+
+    failures = []
+    if ranges == 0 or pending:
+        failures.append(f"{pending} de {ranges} faixas do arquivo não foram importadas até o fim")
+    if error_ratio > RELOAD_MAX_ERROR_RATIO:
+        failures.append(f"{error_ratio:.3%} de linhas com erro (máximo {RELOAD_MAX_ERROR_RATIO:.3%})")
+    if new_count == 0 or new_count < old_count * RELOAD_MIN_ROWS_RATIO:
+        failures.append(f"{new_count:,} registros, menos de {RELOAD_MIN_ROWS_RATIO:.0%} "
+                        f"dos {old_count:,} em uso")
+    return failures
+
+def discard_shadow_table(cursor):
+    """Remove a tabela sombra e seus checkpoints (a próxima recarga recomeça)"""
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SHADOW_SCHEMA} CASCADE")
+    cursor.execute("DELETE FROM import_checkpoint WHERE destino = %s", (SHADOW_TABLE,))
+
+def swap_shadow_table():
+    """
+    Valida a tabela sombra e a troca pela tabela em uso em uma transação
+
+    O rollup da sombra é montado antes (atualizar_rollups no esquema da
+    carga) e trocado junto, então /stats/portabilidade não fica vazio.
+    ALTER TABLE ... SET SCHEMA leva índices, constraints e sequences junto;
+    as consultas da API esperam só pelos locks da troca, limitados a
+    SWAP_LOCK_TIMEOUT por tentativa (até SWAP_RETRIES tentativas).
+
+    Se a validação falha, a sombra é descartada e a tabela em uso mantida.
+    Se os locks não saem, a sombra fica pronta para a próxima execução.
+    Retorna True se a tabela nova entrou em uso.
+    """
+    print(f"\n{BOLD}FASE 4: VALIDAÇÃO E TROCA{NC}")
+    print(f"{YELLOW}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{NC}")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+
+    failures = validate_shadow_table(cursor)
+    if failures:
+        for failure in failures:
+            print(f"  {RED}✗ {failure}{NC}")
+        discard_shadow_table(cursor)
+        conn.commit()
+        cursor.close()
+        conn.close()
+        print(f"{RED}✗ Validação falhou: tabela sombra descartada, base atual mantida{NC}")
+        return False
+
+    atualizar_rollups(conn, esquema=SHADOW_SCHEMA)
+
+    for attempt in range(1, SWAP_RETRIES + 1):
+        try:
+            cursor.execute("SET LOCAL lock_timeout = %s", (SWAP_LOCK_TIMEOUT,))
+            cursor.execute(f"DROP SCHEMA IF EXISTS {OLD_SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {OLD_SCHEMA}")
+            for table in SWAP_TABLES:
+                cursor.execute(f"ALTER TABLE IF EXISTS public.{table} SET SCHEMA {OLD_SCHEMA}")
+                cursor.execute(f"ALTER TABLE {SHADOW_SCHEMA}.{table} SET SCHEMA public")
+
+            cursor.execute("DELETE FROM import_checkpoint WHERE destino = %s", (HISTORICO,))
+            cursor.execute("UPDATE import_checkpoint SET destino = %s WHERE destino = %s",
+                           (HISTORICO, SHADOW_TABLE))
+            conn.commit()
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"  {YELLOW}⚠ Tentativa {attempt}/{SWAP_RETRIES}: locks não obtidos "
+                  f"em {SWAP_LOCK_TIMEOUT}{NC}")
+            time.sleep(attempt)
+        except Exception as e:
+            conn.rollback()
+            print(f"{RED}✗ Troca falhou, base atual mantida: {str(e)[:80]}{NC}")
+            cursor.close()
+            conn.close()
+            return False
+    else:
+        print(f"{RED}✗ Troca não concluída, base atual mantida; a tabela sombra "
+              f"fica pronta para a próxima execução{NC}")
+        cursor.close()
+        conn.close()
+        return False
+
+    print(f"  {GREEN}✓{NC} Tabela nova e rollup em uso")
+
+    cursor.execute(f"DROP SCHEMA IF EXISTS {OLD_SCHEMA} CASCADE")
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SHADOW_SCHEMA} CASCADE")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"  {GREEN}✓{NC} Tabela anterior removida")
+    return True
 
 def main():
     print(f"{BOLD}╔════════════════════════════════════════════════════════════╗{NC}")
@@ -381,16 +900,35 @@ def main():
     file_size = os.path.getsize(INPUT_FILE) / 1024 / 1024 / 1024  # GB
     print(f"\nArquivo: {INPUT_FILE}")
     print(f"Tamanho: {file_size:.1f} GB")
-    print(f"Chunk size: {CHUNK_SIZE:,} linhas")
+    print(f"Linhas por lote: {CHUNK_SIZE:,}")
+    print(f"Workers: {IMPORT_WORKERS}")
+    print(f"Formato do COPY: {COPY_FORMAT}")
+    print(f"Carga em massa: {'sim' if IMPORT_BULK else 'não'}")
+    print(f"Recarga (tabela sombra): {'sim' if IMPORT_RELOAD else 'não'}")
 
     start_total = time.time()
 
     try:
-        # Dividir arquivo
-        chunk_files = split_file_into_chunks(INPUT_FILE, CHUNK_SIZE)
-
-        # Importar chunks
-        total_success, total_errors = import_all_chunks(chunk_files)
+        table = HISTORICO
+        if IMPORT_RELOAD:
+            # A sombra já é carregada sem índices: IMPORT_BULK não se aplica
+            table = prepare_shadow_table()
+            print(f"\n{BOLD}FASE 2: CARGA NA TABELA SOMBRA{NC}")
+        elif IMPORT_BULK:
+            defer_indexes()
+            print(f"\n{BOLD}FASE 2: CARGA SEM ÍNDICES SECUNDÁRIOS{NC}")
+
+        # Importar direto do arquivo, em lotes (um processo por faixa de bytes
+        # no modo paralelo), retomando dos checkpoints
+        total_success, total_errors = import_file(INPUT_FILE, CHUNK_SIZE, IMPORT_WORKERS, table)
+
+        if IMPORT_RELOAD:
+            finish_shadow_table()
+            if not swap_shadow_table():
+                return
+
+        # Também recria índices de uma carga em massa anterior interrompida
+        rebuild_indexes()
 
         # Resumo final
         elapsed_total = time.time() - start_total
@@ -403,10 +941,31 @@ def main():
         print(f"\nTempo total: {elapsed_total/60:.1f} minutos")
         print(f"Velocidade média: {total_success/elapsed_total:,.0f} registros/s")
 
+        # Estado atual de cada número para a API
+        print(f"\n{YELLOW}Atualizando estado atual dos números portados...{NC}")
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            preparar_datas_historico(conn)
+            atualizar_rollups(conn)
+            reconstruir_portabilidade_atual(conn)
+            gerar_snapshot(conn)
+            gerar_filtro_bloom(conn)
+        finally:
+            conn.close()
+
+        # Workers da API mapeiam o snapshot e o filtro novos
+        publicar_geracao()
+
     except KeyboardInterrupt:
         print(f"\n\n{RED}✗ Importação interrompida pelo usuário{NC}")
     except Exception as e:
         print(f"\n\n{RED}✗ Erro fatal: {e}{NC}")
 
 if __name__ == "__main__":
+    if '--workers' in sys.argv:
+        IMPORT_WORKERS = int(sys.argv[sys.argv.index('--workers') + 1])
+    if '--bulk' in sys.argv:
+        IMPORT_BULK = True
+    if '--recarregar' in sys.argv:
+        IMPORT_RELOAD = True
     main()
\ No newline at end of file
@@ -1,6 +1,6 @@
 #!/bin/bash
 # Script automático para importar arquivo de 51M de registros
-# Com chunks, COPY/INSERT e progresso visual
+# Leitura única em lotes direto para o COPY, INSERT de fallback e progresso visual
 
 export TERM=${TERM:-xterm}
 
@@ -37,6 +37,14 @@ check_imported() {
     return 1
 }
 
+# Recarga em andamento: checkpoints da tabela sombra (retomar sem baixar de novo)
+check_reload_pending() {
+    local count=$(psql -h localhost -U $POSTGRES_USER -d $POSTGRES_DB -t -c "SELECT COUNT(*) FROM import_checkpoint WHERE destino = 'carga_historico.portabilidade_historico'" 2>/dev/null || echo "0")
+    count=$(echo $count | tr -d ' ')
+
+    [ "${count:-0}" -gt "0" ]
+}
+
 # Download do arquivo se necessário
 download_csv() {
     if [ -f "$CSV_FILE" ]; then
@@ -99,13 +107,22 @@ start_monitor() {
 main() {
     echo -e "\n${BOLD}=== VERIFICAÇÃO DE IMPORTAÇÃO HISTÓRICA ===${NC}\n"
 
-    # Verificar se já foi importado
-    if check_imported; then
+    # Verificar se já foi importado (a recarga substitui a base atual)
+    if [ "${IMPORT_RELOAD}" = "true" ] || [ "${IMPORT_RELOAD}" = "1" ]; then
+        echo -e "${YELLOW}🔄 Recarga: a base atual segue em uso até a troca pela nova${NC}"
+        if check_reload_pending && [ -f "$CSV_FILE" ]; then
+            # Mesmo arquivo (caminho, tamanho e mtime) dos checkpoints
+            echo -e "${BLUE}ℹ Retomando recarga interrompida com o arquivo atual${NC}"
+        else
+            rm -f "$CSV_FILE"
+        fi
+    elif check_imported; then
         echo -e "${GREEN}✓ Importação histórica já realizada${NC}"
         return 0
+    else
+        echo -e "${YELLOW}⚠ Base histórica não encontrada${NC}"
     fi
 
-    echo -e "${YELLOW}⚠ Base histórica não encontrada${NC}"
     echo -e "${BLUE}ℹ Total esperado: 51.618.684 registros${NC}\n"
 
     # Verificar se deve importar automaticamente
@@ -55,6 +55,9 @@ su - postgres -c "psql -h localhost -p 5432 -c \"CREATE USER ${POSTGRES_USER} WI
 su - postgres -c "psql -h localhost -p 5432 -c \"GRANT ALL PRIVILEGES ON DATABASE ${POSTGRES_DB} TO ${POSTGRES_USER};\"" 2>/dev/null || true
 su - postgres -c "psql -h localhost -p 5432 -d ${POSTGRES_DB} -c \"GRANT ALL PRIVILEGES ON SCHEMA public TO ${POSTGRES_USER};\"" 2>/dev/null || true
 su - postgres -c "psql -h localhost -p 5432 -c \"ALTER DATABASE ${POSTGRES_DB} OWNER TO ${POSTGRES_USER};\"" 2>/dev/null || true
+# Pools dos workers da API + importador (ver DB_CONEXOES_API em .env.example);
+# vale a partir do próximo start (supervisord)
+su - postgres -c "psql -h localhost -p 5432 -c \"ALTER SYSTEM SET max_connections = ${POSTGRES_MAX_CONNECTIONS:-150};\"" 2>/dev/null || true
 
 # Parar PostgreSQL temporário
 su - postgres -c "/usr/lib/postgresql/*/bin/pg_ctl -D /var/lib/postgresql/data stop" > /dev/null 2>&1